@@ -0,0 +1,98 @@
+"""
+Write-behind buffer for cake_analytics sales counters.
+
+/analytics only adds to an in-process {product_name: quantity} map; a
+background task flushes it every ANALYTICS_FLUSH_SECONDS as one bulk
+INSERT ... ON CONFLICT DO UPDATE. The map is bounded: once it holds
+ANALYTICS_MAX_PENDING products a flush is queued, and counts for products
+not already pending are refused (AnalyticsBufferFull, a 503 for /analytics)
+until it has run. Remaining counts are flushed on shutdown.
+"""
+import asyncio
+import logging
+import os
+import threading
+from datetime import datetime
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from db_utils import get_db_session
+from models import CakeAnalytics
+
+FLUSH_INTERVAL_SECONDS = float(os.getenv("ANALYTICS_FLUSH_SECONDS", "5"))
+MAX_PENDING_PRODUCTS = int(os.getenv("ANALYTICS_MAX_PENDING", "1000"))
+
+logger = logging.getLogger("analytics_buffer")
+
+
+class AnalyticsBufferFull(Exception):
+    """Raised when counts for new products would grow the buffer past its cap."""
+
+
+class AnalyticsBuffer:
+    def __init__(self):
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def is_full(self):
+        return len(self._counts) >= MAX_PENDING_PRODUCTS
+
+    def add(self, product_name, quantity):
+        """Count a sale and return the product's pending quantity."""
+        return self.add_many([(product_name, quantity)])[product_name]
+
+    def add_many(self, items):
+        """Count [(product_name, quantity)] all at once, or none if that would pass the cap."""
+        with self._lock:
+            new = {name for name, _ in items if name not in self._counts}
+            if new and len(self._counts) + len(new) > MAX_PENDING_PRODUCTS:
+                raise AnalyticsBufferFull(f"{len(self._counts)} products already pending")
+            for name, quantity in items:
+                self._counts[name] = self._counts.get(name, 0) + quantity
+            return {name: self._counts[name] for name, _ in items}
+
+    def flush(self):
+        """Write all pending counts in one upsert. Returns the number of products written."""
+        with self._lock:
+            pending, self._counts = self._counts, {}
+        if not pending:
+            return 0
+
+        now = datetime.utcnow()
+        stmt = pg_insert(CakeAnalytics).values([
+            {"product_name": name, "quantity_sold": qty, "last_updated": now}
+            for name, qty in pending.items()
+        ])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[CakeAnalytics.product_name],
+            set_={
+                "quantity_sold": CakeAnalytics.quantity_sold + stmt.excluded.quantity_sold,
+                "last_updated": stmt.excluded.last_updated
+            }
+        )
+
+        session = get_db_session('admin')
+        try:
+            session.execute(stmt)
+            session.commit()
+            return len(pending)
+        except Exception:
+            session.rollback()
+            # Put the counts back so the next flush retries them
+            with self._lock:
+                for name, qty in pending.items():
+                    self._counts[name] = self._counts.get(name, 0) + qty
+            raise
+        finally:
+            session.close()
+
+    async def run(self):
+        """Background task: flush periodically until cancelled."""
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL_SECONDS)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                logger.error("Analytics flush error: %s", e)
+
+
+analytics_buffer = AnalyticsBuffer()
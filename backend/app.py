@@ -1,39 +1,60 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response, Header
+from fastapi.responses import StreamingResponse, FileResponse
+# orjson is required: list endpoints hand it raw rows (datetimes included)
+from fastapi.responses import ORJSONResponse as FastJSONResponse
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from rag_engine import rag_engine
 import uvicorn
 import os
+import time
+import logging
 import warnings
 from dotenv import load_dotenv
 load_dotenv()
+import metrics
+import profiling
+metrics.configure_logging()
+logger = logging.getLogger("app")
 # Suppress numpy warnings on Windows (float128 not fully supported)
 # Suppress numpy warnings on Windows (float128 not fully supported)
 warnings.filterwarnings("ignore", category=RuntimeWarning, module="numpy")
 
 # Database & Auth Imports
-import bcrypt
 from db_utils import get_db_session
-from models import User, Payment, Order, OrderDetail, WarehouseInventory, WorkshopRegistration, CakeAnalytics
+from passwords import (
+    needs_rehash, hash_password_async, verify_password_async, PasswordPoolBusy,
+    shutdown_pool as shutdown_password_pool
+)
+from models import User, Payment, Order, OrderDetail, WarehouseInventory, WorkshopRegistration, ShippingStatus
+from reservations import stock_view, reserve_items, release_cart, run_sweeper
+from events import broker
+from analytics_buffer import analytics_buffer, AnalyticsBufferFull
+from design_cache import design_cache, design_hash, ProviderError, MEDIA_TYPES as DESIGN_MEDIA_TYPES, DESIGN_TIMEOUT_SECONDS
+from sessions import issue_token, claims_from_header, user_profiles, PROFILE_COLUMNS
+import outbox
+from jobs import job, queue as job_queue, PermanentJobError
+from tracking import SHIPPING_STATUSES, lookup as lookup_tracking, parse_order_id, record_statuses
+from carts import CartError, cart_view, add_item, set_quantity, remove_item, merge_carts, checkout_lines, delete_cart
+import sales_rollups
+import forecasting
+from site_files import is_site_file
+from bulk_io import TABLES as BULK_TABLES, FORMATS as BULK_FORMATS, export_rows, import_rows
+from sqlalchemy import insert, select, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from datetime import datetime
-import requests
+from datetime import datetime, timedelta
 import io
+import tempfile
+import mimetypes
+import unicodedata
+from email.utils import formatdate, parsedate_to_datetime
 
-import base64
+import re
 import json # Added json import
-# Password Hashing
-def get_password_hash(password):
-    # Truncate to 72 bytes to avoid bcrypt limitation and encode
-    pwd_bytes = password[:72].encode('utf-8')
-    salt = bcrypt.gensalt()
-    hashed_bytes = bcrypt.hashpw(pwd_bytes, salt)
-    return hashed_bytes.decode('utf-8') # Return string for storage
-
-def verify_password(plain_password, hashed_password):
-    plain_password_bytes = plain_password[:72].encode('utf-8')
-    hashed_password_bytes = hashed_password.encode('utf-8')
-    return bcrypt.checkpw(plain_password_bytes, hashed_password_bytes)
+import asyncio
 
 app = FastAPI()
 
@@ -45,9 +66,80 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+class StreamSafeGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware that leaves the given paths alone.
+
+    Older Starlette versions compress text/event-stream too and buffer it in
+    the gzip stream, so SSE clients would get events late or in bursts.
+    """
+
+    def __init__(self, app, uncompressed_paths=(), **kwargs):
+        super().__init__(app, **kwargs)
+        self.uncompressed_paths = frozenset(uncompressed_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in self.uncompressed_paths:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+# JSON and other dynamic responses; static files are served precompressed (see Static Site)
+app.add_middleware(StreamSafeGZipMiddleware, minimum_size=1024, uncompressed_paths={"/api/events"})
 
 from typing import Optional
 
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Per-route latency histogram, in-flight gauge and slow-request log.
+
+    Latency is time to response headers, so streamed bodies (SSE, exports)
+    aren't counted for their whole lifetime.
+    """
+    started = time.perf_counter()
+    metrics.http_in_flight.inc()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.http_in_flight.dec()
+        # Route template (e.g. /admin/shipping/{order_id}) keeps label cardinality bounded
+        route = request.scope.get("route")
+        route_path = route.path if route is not None else "unmatched"
+        metrics.http_requests.inc(method=request.method, route=route_path, status=status)
+        metrics.http_latency.observe(elapsed, method=request.method, route=route_path)
+        if elapsed * 1000 >= SLOW_REQUEST_MS:
+            logger.warning("slow request", extra={
+                "method": request.method, "route": route_path,
+                "status": status, "duration_ms": round(elapsed * 1000, 1)
+            })
+
+@app.middleware("http")
+async def profile_slow_requests(request: Request, call_next):
+    """Sample stacks and SQL for opted-in requests (see profiling.py)."""
+    profile = profiling.start(request.method, request.url.path, request.headers.get("x-profile"))
+    if profile is None:
+        return await call_next(request)
+    with profile:
+        response = await call_next(request)
+    route = request.scope.get("route")
+    profile.route = route.path if route is not None else None
+    profile.status = response.status_code
+    profile_id = profiling.finish(profile)
+    if profile_id:
+        response.headers["X-Profile-Id"] = profile_id
+        logger.info("request profiled", extra={"profile_id": profile_id, **profile.summary()})
+    return response
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus scrape endpoint."""
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 class ChatRequest(BaseModel):
     message: str
     image: Optional[str] = None
@@ -63,25 +155,85 @@ class RegisterRequest(BaseModel):
 class LoginRequest(BaseModel):
     username: str
     password: str
+    cart_id: Optional[str] = None  # Guest cart to merge into the user's cart
 
 class PaymentRequest(BaseModel):
-    user_id: int
+    user_id: Optional[int] = None  # Legacy; the session token decides (see ALLOW_LEGACY_PAYMENT_USER_ID)
     amount: float
-    order_info: Optional[str] = None
+    order_info: Optional[str] = None  # Checkout form only: {"checkout": {...}}
     payment_method: Optional[str] = None
     status: str = "pending"
+    cart_id: Optional[str] = None  # Server cart to charge; also converts its stock reservations into deductions
+    line_ids: list[int] = []  # Cart line ids the customer reviewed; must match the server cart
+    idempotency_key: Optional[str] = None  # Same as the Idempotency-Key header
 
 class AnalyticsRequest(BaseModel):
-    cake_name: str
+    product_name: Optional[str] = None
+    cake_name: Optional[str] = None  # Legacy field name, same meaning as product_name
     quantity: int = 1
 
 class ShippingUpdateRequest(BaseModel):
     status: str
+    note: Optional[str] = None  # Shown to the customer on the tracking page
+
+class ShippingBulkUpdateRequest(BaseModel):
+    order_ids: list[int]
+    status: str
+    note: Optional[str] = None
 
 @app.on_event("startup")
 async def startup_event():
-    print("Starting up - Initializing RAG Engine")
+    logger.info("Starting up - Initializing RAG Engine")
     rag_engine.setup_chain()
+    logger.info("Starting event broker")
+    broker.bind(asyncio.get_running_loop())
+    stock_view.add_listener(lambda changes: broker.publish("inventory", changes))
+    logger.info("Starting reservation sweeper")
+    try:
+        stock_view.load()
+    except Exception as e:
+        logger.warning("Stock view load failed, will retry in sweeper: %s", e)
+    app.state.reservation_sweeper = asyncio.create_task(run_sweeper())
+    app.state.analytics_flusher = asyncio.create_task(analytics_buffer.run())
+    app.state.outbox_processor = asyncio.create_task(outbox.run_processor())
+    app.state.job_runner = asyncio.create_task(job_queue.run())
+    # Catch up on orders placed while no worker was running
+    try:
+        await job_queue.enqueue('analytics.rollup', key='analytics.rollup')
+    except Exception as e:
+        logger.warning("Queueing the sales rollup failed: %s", e)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.reservation_sweeper.cancel()
+    app.state.analytics_flusher.cancel()
+    app.state.outbox_processor.cancel()
+    app.state.job_runner.cancel()
+    broker.close()
+    shutdown_password_pool()
+    await design_cache.close()
+    try:
+        analytics_buffer.flush()
+    except Exception as e:
+        logger.error("Analytics flush on shutdown failed: %s", e)
+
+EVENT_CHANNELS = {"inventory", "shipping"}
+
+@app.get("/api/events")
+async def stream_events(http_request: Request, channels: str = "inventory"):
+    """Server-Sent Events stream of inventory/shipping deltas.
+
+    Clients load a snapshot first (/api/inventory, /admin/shipping) and then
+    apply the changed rows pushed here instead of polling.
+    """
+    wanted = {c.strip() for c in channels.split(",") if c.strip() in EVENT_CHANNELS}
+    if not wanted:
+        raise HTTPException(status_code=400, detail=f"channels must be any of {sorted(EVENT_CHANNELS)}")
+    return StreamingResponse(
+        broker.stream(wanted, http_request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.post("/chat")
 async def chat_endpoint(request: ChatRequest):
@@ -89,9 +241,65 @@ async def chat_endpoint(request: ChatRequest):
         response = rag_engine.query(request.message, request.image)
         return {"response": response}
     except Exception as e:
-        print(f"Chat error: {e}")
+        logger.exception("Chat error")
         raise HTTPException(status_code=500, detail="Internal server error during chat processing")
 
+@job('rag.rebuild', concurrency=1, max_attempts=2, local=True)
+def run_rag_rebuild(payload):
+    """Re-read the site and rebuild the chatbot's vector store."""
+    rag_engine.initialize_vector_store()
+    return {"rebuilt_at": datetime.utcnow().isoformat()}
+
+@app.post("/admin/rag/rebuild", status_code=202)
+async def rebuild_rag_index():
+    """Queue a rebuild of the chatbot index (e.g. after editing pages); returns the job id."""
+    job_id = await job_queue.enqueue('rag.rebuild', key='rag.rebuild')
+    return {"status": "queued", "job_id": job_id}
+
+# --- Background Jobs ---
+@app.get("/api/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """Status of a queued job: pending, running, done (with its result) or failed (with the error)."""
+    status = await job_queue.status(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return status
+
+# --- Profiling ---
+class ProfilingSettingsRequest(BaseModel):
+    enabled: Optional[bool] = None
+    sample_rate: Optional[float] = None
+    threshold_ms: Optional[float] = None
+    sample_ms: Optional[float] = None
+
+@app.get("/admin/profiling")
+async def get_profiling():
+    """Current profiler settings and the most recent captured profiles."""
+    return {"settings": profiling.settings, "profiles": profiling.list_profiles()}
+
+@app.post("/admin/profiling")
+async def update_profiling(request: ProfilingSettingsRequest):
+    """Turn sampling of all requests on/off and tune threshold and interval."""
+    changes = request.dict(exclude_none=True)
+    if "sample_rate" in changes and not 0 <= changes["sample_rate"] <= 1:
+        raise HTTPException(status_code=400, detail="sample_rate must be between 0 and 1")
+    if changes.get("sample_ms", 1) <= 0 or changes.get("threshold_ms", 0) < 0:
+        raise HTTPException(status_code=400, detail="sample_ms must be positive and threshold_ms non-negative")
+    profiling.settings.update(changes)
+    logger.info("profiling settings changed", extra={"settings": profiling.settings})
+    return {"settings": profiling.settings}
+
+@app.get("/admin/profiling/{profile_id}")
+async def get_profile(profile_id: str, format: str = "json"):
+    """One profile: JSON summary with SQL timings, or ?format=folded for flame graphs."""
+    found = profiling.get_profile(profile_id)
+    if not found:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    record, folded = found
+    if format == "folded":
+        return Response(content=folded, media_type="text/plain")
+    return record
+
 # --- Member Service ---
 @app.post("/register")
 async def register(request: RegisterRequest):
@@ -102,7 +310,7 @@ async def register(request: RegisterRequest):
         if existing_user:
             raise HTTPException(status_code=400, detail="Username or Email already registered")
         
-        hashed_password = get_password_hash(request.password)
+        hashed_password = await hash_password_async(request.password)
         new_user = User(
             username=request.username, 
             password_hash=hashed_password, 
@@ -115,6 +323,10 @@ async def register(request: RegisterRequest):
         session.add(new_user)
         session.commit()
         return {"message": "User registered successfully", "username": new_user.username}
+    except HTTPException:
+        raise
+    except PasswordPoolBusy:
+        raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
     except Exception as e:
         session.rollback()
         raise HTTPException(status_code=500, detail=str(e))
@@ -130,45 +342,120 @@ async def login(request: LoginRequest):
             (User.username == request.username) | (User.email == request.username)
         ).first()
         
-        if not user or not verify_password(request.password, user.password_hash):
+        if not user or not await verify_password_async(request.password, user.password_hash):
             raise HTTPException(status_code=401, detail="Sai thông tin đăng nhập")
-            
+
+        # Transparently upgrade hashes made with an older (lower) cost factor
+        if needs_rehash(user.password_hash):
+            try:
+                user.password_hash = await hash_password_async(request.password)
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                logger.warning("Password rehash failed: %s", e, extra={"user_id": user.id})
+
+        token, expires_at = issue_token(user.id, user.username)
+        user_profiles.put(user_profiles.to_profile(user))
+
+        # A failed merge must not block the login; the guest cart is still usable
+        cart_id = request.cart_id
+        try:
+            cart_id = merge_carts(request.cart_id, user.id) or request.cart_id
+        except Exception as e:
+            logger.warning("Cart merge failed: %s", e, extra={"user_id": user.id})
+
         return {
             "message": "Login successful",
             "username": user.username,
             "email": user.email,
-            "id": user.id
+            "id": user.id,
+            "token": token,
+            "token_type": "bearer",
+            "expires_at": expires_at,
+            "cart_id": cart_id
         }
     except HTTPException:
         raise
+    except PasswordPoolBusy:
+        raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         session.close()
 
-# ... (payment code logic placeholder) ...
+def _existing_payment_response(payment_session, user_id, idempotency_key):
+    """Response of an order this user already placed with this key, or None."""
+    order = payment_session.query(Order).filter(
+        Order.user_id == user_id, Order.idempotency_key == idempotency_key
+    ).first()
+    if not order:
+        return None
+    payment = payment_session.query(Payment).filter(Payment.order_id == order.id).first()
+    return {
+        "message": "Payment recorded successfully",
+        "payment_id": payment.id if payment else None,
+        "order_id": order.id,
+        "amount": payment.amount if payment else order.total_amount,
+        "status": payment.status if payment else order.status,
+        "replayed": True
+    }
+
+@job('order.notify', concurrency=4, local=True)
+def notify_new_order(payload):
+    """Show a new order on open admin dashboards."""
+    broker.publish("shipping", {payload["order_id"]: {"status": "Pending", "updated_at": payload["updated_at"], "new": True}})
+
+# Bare user_id without a session token, for clients from before login tokens
+ALLOW_LEGACY_PAYMENT_USER_ID = os.getenv("ALLOW_LEGACY_PAYMENT_USER_ID", "0").lower() in ("1", "true", "yes")
+
 @app.post("/payment")
-async def create_payment(request: PaymentRequest):
-    member_session = get_db_session("member")
+async def create_payment(
+    request: PaymentRequest,
+    authorization: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None)
+):
+    """Record an order, its details and the payment in one payment_db transaction.
+
+    Retries carrying the same Idempotency-Key return the original order instead
+    of creating a duplicate. Only lines of the server cart named by cart_id are
+    charged, priced from the price table, and the cart is consumed in the same
+    transaction; order_info carries just the checkout form.
+    Member contact updates and the reservation commit are written to the outbox
+    in the same transaction and applied asynchronously.
+    """
     payment_session = get_db_session("payment")
+    idempotency_key = (idempotency_key or request.idempotency_key or "").strip()[:64] or None
 
     try:
-        user = member_session.query(User).filter(User.id == request.user_id).first()
+        user_id = request.user_id if ALLOW_LEGACY_PAYMENT_USER_ID else None
+        if authorization:
+            claims = claims_from_header(authorization)
+            if not claims:
+                raise HTTPException(status_code=401, detail="Invalid or expired session")
+            if request.user_id is not None and request.user_id != claims["uid"]:
+                raise HTTPException(status_code=403, detail="Session does not match user_id")
+            user_id = claims["uid"]
+        if user_id is None:
+            raise HTTPException(status_code=401, detail="Login required")
+
+        # Profile comes from the TTL cache; contact changes are applied to member_db via the outbox
+        user = user_profiles.get(user_id)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
+        profile_changes = {}
 
-        order_payload = {}
-        items = []
         checkout = {}
 
         if request.order_info:
             try:
                 order_payload = json.loads(request.order_info)
-                if isinstance(order_payload, dict):
-                    items = order_payload.get("items", []) or []
-                    checkout = order_payload.get("checkout", {}) or {}
             except json.JSONDecodeError:
                 raise HTTPException(status_code=400, detail="Invalid order_info JSON")
+            if isinstance(order_payload, dict):
+                # Lines are never priced from the client; they must be in the server cart
+                if order_payload.get("items"):
+                    raise HTTPException(status_code=400, detail="Order lines must be added to the server cart")
+                checkout = order_payload.get("checkout", {}) or {}
 
         billing = checkout.get("billing", {}) if isinstance(checkout, dict) else {}
         contact = checkout.get("contact", {}) if isinstance(checkout, dict) else {}
@@ -185,112 +472,167 @@ async def create_payment(request: PaymentRequest):
             [str(part).strip() for part in address_parts if part and str(part).strip()]
         )
 
-        if formatted_address:
-            user.address = formatted_address
+        if formatted_address and formatted_address != user["address"]:
+            profile_changes["address"] = formatted_address
 
         checkout_phone = contact.get("phone")
-        if checkout_phone and str(checkout_phone).strip():
-            user.phone_number = str(checkout_phone).strip()
+        if checkout_phone and str(checkout_phone).strip() and str(checkout_phone).strip() != user["phone_number"]:
+            profile_changes["phone_number"] = str(checkout_phone).strip()
 
         payment_method = request.payment_method or checkout.get("paymentMethod") or "unknown"
 
         items_total = 0.0
         normalized_items = []
 
-        for item in items:
-            product_name = (item.get("productName") or item.get("name") or "Unknown Product").strip()
-            quantity = max(int(item.get("quantity", 1) or 1), 1)
-            unit_price = round(float(item.get("finalPrice", 0) or 0), 2)
-            subtotal = round(quantity * unit_price, 2)
-
-            items_total += subtotal
+        # Checked before the cart, which a completed order has already consumed
+        if idempotency_key:
+            existing = _existing_payment_response(payment_session, user_id, idempotency_key)
+            if existing:
+                return existing
+
+        if not request.cart_id:
+            raise HTTPException(status_code=400, detail="cart_id required")
+        # Server cart lines are referenced by id only; the client must have seen exactly these
+        server_lines = checkout_lines(payment_session, request.cart_id, user_id)
+        if not server_lines:
+            raise HTTPException(status_code=400, detail="Cart is empty")
+        if set(request.line_ids) != {line["id"] for line in server_lines}:
+            raise HTTPException(status_code=409, detail="Cart changed, please review it again")
+
+        for line in server_lines:
+            items_total += line["subtotal"]
             normalized_items.append({
-                "product_name": product_name,
-                "quantity": quantity,
-                "unit_price": unit_price,
-                "subtotal": subtotal
+                "product_name": line["name"],
+                "quantity": line["quantity"],
+                "unit_price": line["unit_price"],
+                "subtotal": line["subtotal"]
             })
 
         final_amount = round(float(request.amount), 2)
-
-        if normalized_items:
-            recalculated_total = round(items_total + 8.99, 2)
-            if abs(recalculated_total - final_amount) > 0.05:
-                final_amount = recalculated_total
-
-        order = Order(
-            user_id=request.user_id,
-            total_amount=final_amount,
-            status=request.status,
-            payment_method=payment_method,
-            created_at=datetime.utcnow()
+        recalculated_total = round(items_total + 8.99, 2)
+        if abs(recalculated_total - final_amount) > 0.05:
+            final_amount = recalculated_total
+
+        now = datetime.utcnow()
+        order_id = payment_session.execute(
+            insert(Order).values(
+                user_id=user_id,
+                total_amount=final_amount,
+                status=request.status,
+                payment_method=payment_method,
+                idempotency_key=idempotency_key,
+                created_at=now
+            ).returning(Order.id)
+        ).scalar_one()
+
+        # All lines in a single multi-row INSERT
+        payment_session.execute(
+            insert(OrderDetail).values([{"order_id": order_id, **item} for item in normalized_items])
         )
-        payment_session.add(order)
-        payment_session.flush()
-
-        for item in normalized_items:
-            detail = OrderDetail(
-                order_id=order.id,
-                product_name=item["product_name"],
-                quantity=item["quantity"],
-                unit_price=item["unit_price"],
-                subtotal=item["subtotal"]
-            )
-            payment_session.add(detail)
 
         payment = Payment(
-            order_id=order.id,
-            user_id=request.user_id,
+            order_id=order_id,
+            user_id=user_id,
             amount=final_amount,
             status=request.status,
-            timestamp=datetime.utcnow()
+            timestamp=now
         )
         payment_session.add(payment)
 
+        # Cross-database follow-ups commit atomically with the order, applied by the outbox processor
+        if profile_changes:
+            payment_session.add(outbox.new_event('member.contact_update', {"user_id": user_id, "changes": profile_changes}))
+        payment_session.add(outbox.new_event('shipping.open', {
+            "order_id": order_id,
+            "customer_name": user["full_name"] or user["username"],
+            "phone": str(checkout_phone).strip() if checkout_phone else user["phone_number"]
+        }))
+        if request.cart_id and request.status == "completed":
+            delete_cart(payment_session, request.cart_id)
+            payment_session.add(outbox.new_event('reservation.commit', {"cart_id": request.cart_id}))
+
         payment_session.commit()
-        member_session.commit()
+        outbox.notify()
+
+        # Best effort: the order is already committed
+        try:
+            await job_queue.enqueue('order.notify', {"order_id": order_id, "updated_at": now.isoformat()})
+            if request.status == "completed":
+                await job_queue.enqueue('analytics.record', {
+                    "items": [[item["product_name"], item["quantity"]] for item in normalized_items]
+                })
+                # Runs once the order is past the rollup lag
+                key, delay = sales_rollups.schedule(now)
+                await job_queue.enqueue('analytics.rollup', key=key, delay_seconds=delay)
+        except Exception as e:
+            logger.warning("Queueing order follow-ups failed: %s", e, extra={"order_id": order_id})
 
         return {
             "message": "Payment recorded successfully",
             "payment_id": payment.id,
-            "order_id": order.id,
+            "order_id": order_id,
             "amount": payment.amount,
             "status": payment.status
         }
 
     except HTTPException:
         payment_session.rollback()
-        member_session.rollback()
         raise
+    except CartError as e:
+        payment_session.rollback()
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except IntegrityError:
+        # A concurrent retry with the same key won the race; answer with its order
+        payment_session.rollback()
+        existing = _existing_payment_response(payment_session, user_id, idempotency_key) if idempotency_key else None
+        if existing:
+            return existing
+        raise HTTPException(status_code=409, detail="Conflicting order")
     except Exception as e:
         payment_session.rollback()
-        member_session.rollback()
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        member_session.close()
         payment_session.close()
 
-@app.get("/admin/customers")
+class CustomerSummary(BaseModel):
+    id: int
+    user_id: int
+    username: str
+    full_name: str
+    email: Optional[str] = None
+    phone_number: str
+    vip_level: str
+    status: str
+    created_at: Optional[datetime] = None
+    total_spend: float
+    total_orders: int
+
+@app.get("/admin/customers", response_class=FastJSONResponse, responses={200: {"model": list[CustomerSummary]}})
 async def get_customers():
-    """Fetch customers directly from member_db with payment stats from payment_db"""
+    """Fetch customers directly from member_db with payment stats from payment_db.
+
+    Only the needed columns are selected and spend/order counts are
+    aggregated in SQL; rows go straight to the fast JSON encoder.
+    """
     member_session = get_db_session('member')
     payment_session = get_db_session('payment')
     
     try:
-        users = member_session.query(User).all()
+        users = member_session.execute(select(*PROFILE_COLUMNS, User.created_at)).all()
         
-        # Calculate payment stats
-        payments = payment_session.query(Payment).all()
-        user_stats = {}
-        for p in payments:
-            if p.user_id not in user_stats:
-                user_stats[p.user_id] = {'spend': 0.0, 'orders': 0}
-            user_stats[p.user_id]['spend'] += p.amount
-            user_stats[p.user_id]['orders'] += 1
+        # Payment stats per user, aggregated by the database
+        user_stats = {
+            row.user_id: (float(row.spend or 0), row.orders)
+            for row in payment_session.execute(
+                select(Payment.user_id, func.sum(Payment.amount).label("spend"), func.count().label("orders"))
+                .group_by(Payment.user_id)
+            )
+        }
 
         results = []
         for user in users:
-            stats = user_stats.get(user.id, {'spend': 0.0, 'orders': 0})
+            spend, orders = user_stats.get(user.id, (0.0, 0))
+            user_profiles.put(user_profiles.to_profile(user))  # Warm the cache for shipping/payment lookups
             
             results.append({
                 "id": user.id,
@@ -299,17 +641,17 @@ async def get_customers():
                 "full_name": user.full_name or user.username,  # Use full_name if available
                 "email": user.email,
                 "phone_number": user.phone_number or "N/A", # Use phone_number if available
-                "vip_level": "Gold" if stats['spend'] > 500 else "Silver" if stats['spend'] > 200 else "Bronze" if stats['spend'] > 50 else "New",
+                "vip_level": "Gold" if spend > 500 else "Silver" if spend > 200 else "Bronze" if spend > 50 else "New",
                 "status": user.status or "Active",
                 "created_at": user.created_at,
-                "total_spend": stats['spend'],
-                "total_orders": stats['orders']
+                "total_spend": spend,
+                "total_orders": orders
             })
         
-        return results
+        return FastJSONResponse(results)
     except Exception as e:
-        print(f"Error serving customers: {e}")
-        return []
+        logger.exception("Error serving customers")
+        return FastJSONResponse([])
     finally:
         member_session.close()
         payment_session.close()
@@ -334,11 +676,12 @@ async def delete_customer(user_id: int):
 
         member_session.delete(user)
         member_session.commit()
+        user_profiles.invalidate(user_id)
         return {"message": "Customer deleted successfully"}
     except Exception as e:
         member_session.rollback()
         payment_session.rollback()
-        print(f"Delete Error: {e}") # Debug log
+        logger.exception("Delete customer failed", extra={"user_id": user_id})
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         member_session.close()
@@ -361,20 +704,45 @@ async def delete_shipping_order(order_id: int):
     finally:
         payment_session.close()
 
-@app.get("/admin/shipping")
+class ShippingOrder(BaseModel):
+    id: int
+    order_id: int
+    customer_name: str
+    phone_number: str
+    address: str
+    status: Optional[str] = None
+    updated_at: Optional[datetime] = None
+    amount: float
+
+@app.get("/admin/shipping", response_class=FastJSONResponse, responses={200: {"model": list[ShippingOrder]}})
 async def get_shipping_status():
     payment_session = get_db_session('payment')
-    member_session = get_db_session('member')
 
     try:
-        payments = payment_session.query(Payment).order_by(Payment.timestamp.desc()).all()
-        users = member_session.query(User).all()
+        payments = payment_session.execute(
+            select(Payment.id, Payment.order_id, Payment.user_id, Payment.status, Payment.timestamp, Payment.amount)
+            .order_by(Payment.timestamp.desc())
+        ).all()
+        # Only the customers that actually have orders, mostly served from the profile cache
+        users = user_profiles.get_many([p.user_id for p in payments]).values()
+
+        # Status set by an admin (ShippingStatus) wins over the one derived from the payment
+        admin_session = get_db_session('admin')
+        try:
+            shipping_map = {
+                row.order_id: (row.status, row.updated_at)
+                for row in admin_session.execute(
+                    select(ShippingStatus.order_id, ShippingStatus.status, ShippingStatus.updated_at)
+                )
+            }
+        finally:
+            admin_session.close()
 
         user_map = {
-            u.id: {
-                'name': u.username,
-                'phone': u.phone_number,
-                'address': u.address
+            u['id']: {
+                'name': u['username'],
+                'phone': u['phone_number'],
+                'address': u['address']
             } for u in users
         }
 
@@ -384,110 +752,381 @@ async def get_shipping_status():
                 p.user_id,
                 {'name': 'Unknown', 'phone': 'N/A', 'address': 'N/A'}
             )
+            order_id = p.order_id if p.order_id else p.id
+            shipping = shipping_map.get(order_id)
+
+            if shipping:
+                status, updated_at = shipping
+            else:
+                status = "Delivered" if p.status == "completed" else "Pending" if p.status == "pending" else p.status
+                updated_at = p.timestamp
 
             results.append({
                 "id": p.id,
-                "order_id": p.order_id if p.order_id else p.id,
+                "order_id": order_id,
                 "customer_name": user_data['name'],
                 "phone_number": user_data['phone'] or "N/A",
                 "address": user_data['address'] or "N/A",
-                "status": "Delivered" if p.status == "completed" else "Pending" if p.status == "pending" else p.status,
-                "updated_at": p.timestamp.isoformat() if p.timestamp else None,
+                "status": status,
+                "updated_at": updated_at,
                 "amount": float(p.amount) if p.amount is not None else 0
             })
 
-        print("SHIPPING RESULTS:", results)
-        return results
+        return FastJSONResponse(results)
 
     except Exception as e:
-        print(f"ERROR fetching shipping: {e}")
-        return []
+        logger.exception("Error fetching shipping")
+        return FastJSONResponse([])
     finally:
         payment_session.close()
-        member_session.close()
+
+MAX_BULK_SHIPPING_ORDERS = 1000
+
+def _shipping_targets(order_ids):
+    """{"order_id", "customer_name", "phone"} for each order that exists, in one query."""
+    payment_session = get_db_session('payment')
+    try:
+        orders = payment_session.execute(
+            select(Order.id, Order.user_id).where(Order.id.in_(order_ids))
+        ).all()
+    finally:
+        payment_session.close()
+    profiles = user_profiles.get_many([o.user_id for o in orders])
+    targets = []
+    for o in orders:
+        user = profiles.get(o.user_id)
+        targets.append({
+            "order_id": o.id,
+            "customer_name": user["username"] if user else "Unknown",
+            "phone": user["phone_number"] if user else None
+        })
+    return targets
+
+def _record_shipping(order_ids, status, note):
+    """Look up and update the orders in a worker thread. Returns (targets, update time)."""
+    targets = _shipping_targets(order_ids)
+    return targets, record_statuses(targets, status, note)
+
+def _check_shipping_status(status: str):
+    if status not in SHIPPING_STATUSES:
+        raise HTTPException(status_code=400, detail=f"Status must be one of: {', '.join(SHIPPING_STATUSES)}")
+
+@app.put("/admin/shipping/{order_id}")
+async def update_shipping_status(order_id: int, request: ShippingUpdateRequest):
+    _check_shipping_status(request.status)
+    try:
+        targets, now = await asyncio.to_thread(_record_shipping, [order_id], request.status, request.note)
+        if not targets:
+            raise HTTPException(status_code=404, detail="Order not found")
+
+        broker.publish("shipping", {order_id: {"status": request.status, "updated_at": now.isoformat()}})
+        return {"message": "Shipping status updated", "order_id": order_id, "status": request.status, "updated_at": now.isoformat()}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/admin/shipping/bulk")
+async def bulk_update_shipping_status(request: ShippingBulkUpdateRequest):
+    """Move many orders to one status: one event per order, all in a single transaction."""
+    _check_shipping_status(request.status)
+    order_ids = list(dict.fromkeys(request.order_ids))
+    if not order_ids:
+        raise HTTPException(status_code=400, detail="No orders given")
+    if len(order_ids) > MAX_BULK_SHIPPING_ORDERS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_SHIPPING_ORDERS} orders per request")
+    try:
+        targets, now = await asyncio.to_thread(_record_shipping, order_ids, request.status, request.note)
+        updated = [t["order_id"] for t in targets]
+        if updated:
+            broker.publish("shipping", {
+                order_id: {"status": request.status, "updated_at": now.isoformat()} for order_id in updated
+            })
+        return {
+            "message": "Shipping status updated",
+            "status": request.status,
+            "updated": updated,
+            "not_found": sorted(set(order_ids) - set(updated))
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/tracking")
+async def track_order(order_id: str, phone: str):
+    """Shipping timeline of an order, for the phone number it was placed with.
+
+    Unknown orders and wrong phone numbers both answer 404.
+    """
+    parsed_id = parse_order_id(order_id)
+    result = await asyncio.to_thread(lookup_tracking, parsed_id, phone) if parsed_id else None
+    if result is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    return result
 
 # --- Warehouse Service ---
 class WarehouseUpdateRequest(BaseModel):
     product_name: str
     quantity_change: int
 
-@app.get("/admin/warehouse")
+class WarehouseItem(BaseModel):
+    id: int
+    product_name: str
+    quantity: Optional[int] = None
+    reserved_quantity: int
+    last_restock: Optional[datetime] = None
+
+@app.get("/admin/warehouse", response_class=FastJSONResponse, responses={200: {"model": list[WarehouseItem]}})
 async def get_warehouse_inventory():
     session = get_db_session('admin')
     try:
-        results = session.query(WarehouseInventory).all()
-        return results
+        rows = session.execute(select(
+            WarehouseInventory.id, WarehouseInventory.product_name, WarehouseInventory.quantity,
+            WarehouseInventory.reserved_quantity, WarehouseInventory.last_restock
+        )).mappings().all()
+        return FastJSONResponse([dict(row) for row in rows])
     finally:
         session.close()
 
-@app.post("/admin/warehouse/update")
-async def update_warehouse_inventory(request: WarehouseUpdateRequest):
+def _change_inventory(product_name, quantity_change):
     session = get_db_session('admin')
     try:
-        item = session.query(WarehouseInventory).filter(WarehouseInventory.product_name == request.product_name).first()
-        if not item:
-            item = WarehouseInventory(product_name=request.product_name, quantity=0)
-            session.add(item)
-        
-        item.quantity += request.quantity_change
-        item.last_restock = datetime.utcnow()
+        # Single upsert so concurrent updates can't lose each other's changes
+        now = datetime.utcnow()
+        stmt = pg_insert(WarehouseInventory).values(
+            product_name=product_name,
+            quantity=quantity_change,
+            last_restock=now
+        ).on_conflict_do_update(
+            index_elements=[WarehouseInventory.product_name],
+            set_={
+                "quantity": WarehouseInventory.quantity + quantity_change,
+                "last_restock": now
+            }
+        ).returning(WarehouseInventory.quantity, WarehouseInventory.reserved_quantity, WarehouseInventory.last_restock)
+        row = session.execute(stmt).one()
         session.commit()
+        stock_view.apply(product_name, row.quantity, row.reserved_quantity)
+        return row
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+@app.post("/admin/warehouse/update")
+async def update_warehouse_inventory(request: WarehouseUpdateRequest):
+    try:
+        row = await asyncio.to_thread(_change_inventory, request.product_name, request.quantity_change)
         return {
             "message": "Inventory updated", 
-            "new_quantity": item.quantity,
-            "last_restock": item.last_restock.isoformat() if item.last_restock else None
+            "new_quantity": row.quantity,
+            "last_restock": row.last_restock.isoformat() if row.last_restock else None
         }
-    finally:
-        session.close()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/admin/warehouse/forecast", response_class=FastJSONResponse)
+async def get_restock_forecast():
+    """Demand forecast, projected stock-out date and suggested restock per warehouse product.
+
+    Computed for all products at once and cached until new orders are rolled
+    up; stock levels are always current.
+    """
+    if not forecasting.available():
+        raise HTTPException(status_code=503, detail="Forecasting needs numpy (pip install numpy)")
+    try:
+        return FastJSONResponse(await asyncio.to_thread(forecasting.restock_plan))
+    except Exception as e:
+        logger.exception("Error computing restock forecast")
+        raise HTTPException(status_code=500, detail=str(e))
+
+class ReserveItem(BaseModel):
+    product_name: str
+    quantity: int = 1
+
+class InventoryReserveRequest(BaseModel):
+    items: list[ReserveItem]
+    cart_id: Optional[str] = None  # Omit on the first add; reuse the returned id afterwards
+    all_or_nothing: bool = False
+
+class InventoryReleaseRequest(BaseModel):
+    cart_id: str
+
+@app.post("/api/inventory/reserve")
+async def reserve_inventory(request: InventoryReserveRequest):
+    """Hold stock for every line item of a cart in one transaction.
+
+    Each line is a conditional UPDATE (available >= n), so concurrent carts can
+    never oversell. Holds expire after RESERVATION_TTL_MINUTES unless the cart
+    is paid. Returns per-item success; with all_or_nothing=True any shortage
+    rolls back the whole batch.
+    """
+    # Merge duplicate lines so each row is touched once
+    wanted = {}
+    for item in request.items:
+        if item.quantity <= 0:
+            raise HTTPException(status_code=400, detail=f"Invalid quantity for {item.product_name}")
+        wanted[item.product_name] = wanted.get(item.product_name, 0) + item.quantity
+
+    try:
+        return await asyncio.to_thread(reserve_items, request.cart_id, wanted, request.all_or_nothing)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/inventory/release")
+async def release_inventory(request: InventoryReleaseRequest):
+    """Return all stock held by a cart (e.g. when it is emptied)."""
+    try:
+        released = await asyncio.to_thread(release_cart, request.cart_id)
+        return {"message": "Reservations released", "released": released}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 class InventoryCheckRequest(BaseModel):
     product_names: list[str]
 
+def _etag_matches(http_request: Request, etag: str) -> bool:
+    if_none_match = http_request.headers.get("if-none-match", "")
+    return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+
+@app.get("/api/inventory")
+async def get_inventory_snapshot(http_request: Request):
+    """Available-to-sell stock for every product, with ETag revalidation.
+
+    Served from the in-process stock view; the JSON body is serialized once per
+    change, so repeat page loads cost a header comparison (304) at most.
+    """
+    await stock_view.ensure_fresh()
+    etag, body = stock_view.snapshot()
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(http_request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 @app.post("/api/inventory/check")
-async def check_inventory(request: InventoryCheckRequest):
-    """Check stock for a list of products. Returns map {name: quantity}"""
-    session = get_db_session('admin')
+async def check_inventory(request: InventoryCheckRequest, http_request: Request, response: Response):
+    """Check available-to-sell stock for a list of products. Returns map {name: quantity}"""
     try:
-        # Normalize names to lowercase for comparison if needed, or exact match
-        # Using 'in_' clause for efficiency
-        items = session.query(WarehouseInventory).filter(WarehouseInventory.product_name.in_(request.product_names)).all()
-        
-        stock_map = {item.product_name: item.quantity for item in items}
-        
-        # Ensure all requested items are in the map (default 0 if not found)
-        # Note: If an item is not in the DB, we assume 0 stock to be safe, or logic can be inverted.
-        # Here we return what we found. Frontend can decide default.
-        result = {}
-        for name in request.product_names:
-            result[name] = stock_map.get(name, 0) # Default to 0 if not found
-            
-        return result
+        await stock_view.ensure_fresh()
+        etag = stock_view.etag(request.product_names)
+        if _etag_matches(http_request, etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "no-cache"
+        # Served from the in-process stock view; unknown products report 0
+        return stock_view.available(request.product_names)
     except Exception as e:
-        print(f"Inventory Check Error: {e}")
+        logger.exception("Inventory check error")
         return {} # Return empty on error to avoid breaking frontend
-    finally:
-        session.close()
+
+@job('analytics.record', concurrency=2, local=True)
+def record_sales(payload):
+    """Count the lines of a paid order; written in bulk by the analytics flusher."""
+    # A full buffer fails the job, which is retried after the next flush
+    analytics_buffer.add_many([(product_name, quantity) for product_name, quantity in payload["items"]])
+
+@job('analytics.flush', concurrency=1, local=True)
+def flush_analytics(payload):
+    return {"products": analytics_buffer.flush()}
 
 @app.post("/analytics")
 async def update_analytics(request: AnalyticsRequest):
-    session = get_db_session('admin')
+    """Count a sale. Buffered in memory and written in bulk by the analytics flusher."""
+    product_name = (request.product_name or request.cake_name or "").strip()
+    if not product_name:
+        raise HTTPException(status_code=400, detail="product_name is required")
+    if request.quantity <= 0:
+        raise HTTPException(status_code=400, detail="quantity must be positive")
+
     try:
-        # Check if cake entry exists
-        cake_stat = session.query(CakeAnalytics).filter(CakeAnalytics.cake_name == request.cake_name).first()
-        if cake_stat:
-            cake_stat.quantity_sold += request.quantity
-            cake_stat.last_updated = datetime.utcnow()
-        else:
-            cake_stat = CakeAnalytics(cake_name=request.cake_name, quantity_sold=request.quantity)
-            session.add(cake_stat)
-        
-        session.commit()
-        return {"message": "Analytics updated", "cake": cake_stat.cake_name, "total_sold": cake_stat.quantity_sold}
+        # A full buffer is written out by a job right away instead of at the next interval
+        if analytics_buffer.is_full():
+            await job_queue.enqueue('analytics.flush', key='analytics.flush')
+        pending = analytics_buffer.add(product_name, request.quantity)
+        return {"message": "Analytics queued", "product": product_name, "pending": pending}
+    except AnalyticsBufferFull:
+        raise HTTPException(status_code=503, detail="Analytics busy, please retry", headers={"Retry-After": "1"})
     except Exception as e:
-        session.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        session.close()
+
+@job('analytics.rollup', concurrency=1)
+async def refresh_sales_rollups(payload):
+    covered = await asyncio.to_thread(sales_rollups.refresh)
+    # Recent days are recomputed now and then for orders whose status changed after they were counted
+    restated = await asyncio.to_thread(sales_rollups.restate)
+    # Orders still inside the lag get a run of their own instead of waiting for the next order
+    unsettled = await asyncio.to_thread(sales_rollups.oldest_unsettled)
+    if unsettled is not None:
+        key, delay = sales_rollups.schedule(unsettled)
+        await job_queue.enqueue('analytics.rollup', key=key, delay_seconds=delay)
+    # Keeps restatements going when no new orders come in
+    key, delay = sales_rollups.schedule_restate()
+    await job_queue.enqueue('analytics.rollup', key=key, delay_seconds=delay)
+    # Their carts have been committed by now too, which changes the demand
+    # forecast; recompute it before an admin asks
+    if covered and forecasting.available():
+        await job_queue.enqueue('analytics.forecast', key='analytics.forecast')
+    return {"orders": covered, "restated": restated}
+
+@job('analytics.forecast', concurrency=1, max_attempts=2, local=True)
+def refresh_forecast(payload):
+    return {"demand_through": forecasting.warm()}
+
+TIMESERIES_BUCKETS = {
+    # bucket -> (shortest possible bucket, default range)
+    "hour": (timedelta(hours=1), timedelta(days=2)),
+    "day": (timedelta(days=1), timedelta(days=30)),
+    "week": (timedelta(weeks=1), timedelta(weeks=26)),
+    "month": (timedelta(days=28), timedelta(days=730)),
+}
+MAX_TIMESERIES_POINTS = 2000
+MAX_TIMESERIES_PRODUCTS = 20
+
+def _local_time(value: str, name: str) -> datetime:
+    """Parse an ISO date/datetime; offset-aware values are converted to the analytics local time."""
+    try:
+        moment = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be an ISO date or datetime")
+    if moment.tzinfo is not None:
+        moment = moment.replace(tzinfo=None) - moment.utcoffset() + timedelta(hours=sales_rollups.UTC_OFFSET_HOURS)
+    return moment
+
+@app.get("/admin/analytics/timeseries", response_class=FastJSONResponse)
+async def get_sales_timeseries(
+    bucket: str = "day",
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    product: Optional[str] = None,
+    top: int = 5
+):
+    """Units, revenue and orders per hour/day/week/month, served from the sales rollups.
+
+    start/end are local shop time (end exclusive, defaults to now). `product`
+    is a comma-separated list; without it the `top` best sellers in the range
+    are returned alongside the totals.
+    """
+    if bucket not in TIMESERIES_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucket must be one of: {', '.join(TIMESERIES_BUCKETS)}")
+    width, default_range = TIMESERIES_BUCKETS[bucket]
+    end_at = _local_time(end, "end") if end else sales_rollups.local_now()
+    start_at = sales_rollups.align(_local_time(start, "start") if start else end_at - default_range, bucket)
+    if start_at >= end_at:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if (end_at - start_at) / width > MAX_TIMESERIES_POINTS:
+        raise HTTPException(status_code=400, detail=f"Range too long for {bucket} buckets (max {MAX_TIMESERIES_POINTS} points)")
+
+    products = [name.strip() for name in (product or "").split(",") if name.strip()]
+    if len(products) > MAX_TIMESERIES_PRODUCTS or not 0 <= top <= MAX_TIMESERIES_PRODUCTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_TIMESERIES_PRODUCTS} products per chart")
+
+    try:
+        return FastJSONResponse(await asyncio.to_thread(
+            sales_rollups.timeseries, bucket, start_at, end_at, products, top
+        ))
+    except Exception as e:
+        logger.exception("Error fetching sales timeseries")
+        raise HTTPException(status_code=500, detail=str(e))
 
 class WorkshopRequest(BaseModel):
     full_name: str
@@ -514,39 +1153,262 @@ async def register_workshop(request: WorkshopRequest):
     finally:
         session.close()
 
+# --- Cart Service ---
+class CartItemRequest(BaseModel):
+    cart_id: Optional[str] = None  # Omit on the first add; reuse the returned id afterwards
+    sku: str
+    quantity: int = 1
+    options: dict[str, int] = {}  # {assortment / gift option sku: quantity}
+    label: Optional[str] = None  # Display name of the chosen variant
+    client_id: Optional[str] = None  # The browser's id for the line, echoed back in cart views
+
+class CartQuantityRequest(BaseModel):
+    quantity: int
+
+def _cart_user_id(authorization: Optional[str]) -> Optional[int]:
+    """User id of the session token, None for guests; a bad token is rejected."""
+    if not authorization:
+        return None
+    claims = claims_from_header(authorization)
+    if not claims:
+        raise HTTPException(status_code=401, detail="Invalid or expired session")
+    return claims["uid"]
+
+async def _run_cart_op(operation, *args):
+    try:
+        return await asyncio.to_thread(operation, *args)
+    except CartError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    except Exception as e:
+        logger.exception("Cart operation failed")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/cart/{cart_id}")
+async def get_cart(cart_id: str, authorization: Optional[str] = Header(None)):
+    """Cart lines priced server-side from the cached price table."""
+    return await _run_cart_op(cart_view, cart_id, _cart_user_id(authorization))
+
+@app.post("/api/cart/items")
+async def add_cart_item(request: CartItemRequest, authorization: Optional[str] = Header(None)):
+    """Add one line (product sku + option quantities). Returns the cart id and the priced line."""
+    return await _run_cart_op(
+        add_item, request.cart_id, _cart_user_id(authorization),
+        request.sku, request.quantity, request.options, request.label, request.client_id
+    )
+
+@app.patch("/api/cart/{cart_id}/items/{item_id}")
+async def update_cart_item(cart_id: str, item_id: int, request: CartQuantityRequest, authorization: Optional[str] = Header(None)):
+    return await _run_cart_op(set_quantity, cart_id, _cart_user_id(authorization), item_id, request.quantity)
+
+@app.delete("/api/cart/{cart_id}/items/{item_id}")
+async def delete_cart_item(cart_id: str, item_id: int, authorization: Optional[str] = Header(None)):
+    remaining = await _run_cart_op(remove_item, cart_id, _cart_user_id(authorization), item_id)
+    return {"message": "Item removed", "remaining": remaining}
+
+# --- Bulk Data Service ---
+BULK_MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+BULK_SPOOL_BYTES = 8 * 1024 * 1024  # Larger uploads spill to a temp file
+
+def _check_bulk_args(table: str, format: str):
+    if table not in BULK_TABLES:
+        raise HTTPException(status_code=404, detail=f"Unknown table '{table}'")
+    if format not in BULK_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(BULK_FORMATS)}")
+
+@app.get("/admin/export/{table}")
+async def export_table(table: str, format: str = "csv"):
+    """Stream a whole table as CSV or NDJSON straight from a server-side cursor."""
+    _check_bulk_args(table, format)
+    return StreamingResponse(
+        export_rows(table, format),
+        media_type=BULK_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{table}.{format}"'}
+    )
+
+@app.post("/admin/import/{table}")
+async def import_table(table: str, http_request: Request, format: str = "csv", upsert: bool = False):
+    """Load a CSV (with header) or NDJSON request body into a table in one transaction."""
+    _check_bulk_args(table, format)
+    with tempfile.SpooledTemporaryFile(max_size=BULK_SPOOL_BYTES) as spool:
+        async for chunk in http_request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+        stream = io.TextIOWrapper(spool, encoding="utf-8-sig", newline="")
+        try:
+            count = await asyncio.to_thread(import_rows, table, stream, format, upsert)
+        except ValueError as e:  # Bad rows (BulkImportError) or arguments
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        finally:
+            stream.detach()
+
+    if table == "warehouse_inventory":
+        await asyncio.to_thread(stock_view.load)
+    return {"message": "Import complete", "table": table, "rows": count}
+
 # --- AI Design Service ---
 class DesignRequest(BaseModel):
     box_name: str
     items: list[str] = []
 
-@app.post("/api/generate-design")
-async def generate_design(request: DesignRequest):
-    # Pollinations.ai does NOT require an API Token!
-    # API_URL = "https://image.pollinations.ai/prompt/{prompt}"
-    
-    items_str = ", ".join(request.items) if request.items else "assorted premium cakes"
-    # Prompt optimized for Pollinations
-    prompt = f"product photography of a open {request.box_name} gift box filled with {items_str}, delicious, cinematic lighting, 8k, highly detailed, photorealistic"
-    
-    # URL Encode the prompt
-    encoded_prompt = requests.utils.quote(prompt)
-    API_URL = f"https://image.pollinations.ai/prompt/{encoded_prompt}?nologo=true"
+DESIGN_FILE_NAME = re.compile(r"^(?P<digest>[0-9a-f]{64})(?:-(?P<width>\d+))?\.(?P<ext>jpg|webp|avif)$")
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
 
+@job('design.generate', concurrency=int(os.getenv("DESIGN_JOB_CONCURRENCY", "4")), max_attempts=3,
+     timeout=DESIGN_TIMEOUT_SECONDS + 30)
+async def run_design_job(payload):
     try:
-        # Pollinations returns the image binary directly
-        # Increased timeout to 60s as free APIs can be slow under load
-        response = requests.get(API_URL, timeout=60)
-        
-        if response.status_code != 200:
-            raise HTTPException(status_code=response.status_code, detail=f"Error from AI provider: {response.text}")
-
-        image_bytes = response.content
-        base64_image = base64.b64encode(image_bytes).decode('utf-8')
-        return {"image": f"data:image/jpeg;base64,{base64_image}"}
+        digest = await design_cache.ensure(payload["box_name"], payload["items"])
+    except ProviderError as e:
+        if e.status_code < 500 and e.status_code != 429:
+            raise PermanentJobError(str(e))  # Rejected prompt; retrying gives the same answer
+        raise
+    return {"hash": digest}
 
+@app.post("/api/generate-design")
+async def generate_design(request: DesignRequest, http_request: Request):
+    """URL of the image for a gift box + assortment, generated once per combination.
+
+    Cached designs are answered at once. Otherwise Pollinations.ai (no API
+    token needed) is called by a 'design.generate' job and the answer is 202
+    with its job id: poll GET /api/jobs/{job_id}, then repeat this request.
+    Identical requests share one job. The image itself is served by
+    /designs/{name}, so browsers can cache it.
+    """
+    try:
+        digest = design_hash(request.box_name, request.items)
+        if await asyncio.to_thread(design_cache.touch, digest):
+            return {
+                "hash": digest,
+                **design_cache.urls(digest, lambda name: str(http_request.url_for("get_design_image", name=name)))
+            }
+        job_id = await job_queue.enqueue(
+            'design.generate', {"box_name": request.box_name, "items": request.items}, key=f"design:{digest}"
+        )
+        return FastJSONResponse(
+            {"status": "pending", "job_id": job_id, "hash": digest},
+            status_code=202,
+            headers={"Retry-After": "2"}
+        )
     except Exception as e:
-        print(f"Error generating image: {e}")
+        logger.error("Error generating image: %s", e)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/designs/{name}")
+async def get_design_image(name: str, http_request: Request):
+    """A generated design (<hash>.jpg) or a variant (<hash>.webp, <hash>-320.webp).
+
+    Names are content hashes, so responses are cacheable forever.
+    """
+    match = DESIGN_FILE_NAME.match(name)
+    if not match:
+        raise HTTPException(status_code=404, detail="Design not found")
+    etag = f'"{match["digest"]}-{match["width"] or 0}-{match["ext"]}"'
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE}
+    if _etag_matches(http_request, etag):
+        return Response(status_code=304, headers=headers)
+
+    width = int(match["width"]) if match["width"] else None
+    try:
+        path = await asyncio.to_thread(design_cache.variant_file, match["digest"], width, match["ext"])
+    except OSError as e:
+        logger.error("Design variant failed: %s", e, extra={"design": name})
+        raise HTTPException(status_code=500, detail="Could not create image variant")
+    if not path:
+        raise HTTPException(status_code=404, detail="Design not found")
+    return FileResponse(path, media_type=DESIGN_MEDIA_TYPES[match["ext"]], headers=headers)
+
+# --- Static Site ---
+# With SERVE_FRONTEND=1 the API also serves the website, so pages call it
+# same-origin (no CORS preflights). FRONTEND_DIR defaults to the build output
+# (../dist, see build_assets.py) and falls back to the repo root. Either way
+# only web assets outside non-site directories are served (site_files.py), so
+# docker-compose.yml, docs and backend sources never are.
+SERVE_FRONTEND = os.getenv("SERVE_FRONTEND", "0").lower() in ("1", "true", "yes")
+_default_frontend = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dist")
+if not os.path.isdir(_default_frontend):
+    _default_frontend = os.path.dirname(_default_frontend)
+FRONTEND_DIR = os.path.realpath(os.getenv("FRONTEND_DIR") or _default_frontend)
+FRONTEND_MAX_AGE = int(os.getenv("FRONTEND_MAX_AGE", "3600"))
+# Fingerprinted build output: the name changes whenever the content does
+HASHED_ASSET = re.compile(r"^(?:assets|img)/(?:.*[.])?[0-9a-f]{10,64}(?:-\d+)?\.[A-Za-z0-9]+$")
+PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+# The Windows registry can map .js to text/plain, which browsers refuse for module scripts
+for _media_type, _ext in (("text/javascript", ".js"), ("text/css", ".css"), ("image/webp", ".webp"), ("image/avif", ".avif")):
+    mimetypes.add_type(_media_type, _ext)
+
+def _frontend_file(path: str) -> Optional[str]:
+    parts = [p for p in path.split("/") if p]
+    candidate = os.path.realpath(os.path.join(FRONTEND_DIR, *parts))
+    if candidate != FRONTEND_DIR and not candidate.startswith(FRONTEND_DIR + os.sep):
+        return None
+    if os.path.isdir(candidate):
+        candidate = os.path.join(candidate, "index.html")
+    if not is_site_file(os.path.relpath(candidate, FRONTEND_DIR)):
+        return None
+    # The source tree has Vietnamese names stored in both NFC and NFD
+    for form in (None, "NFC", "NFD"):
+        name = unicodedata.normalize(form, candidate) if form else candidate
+        if os.path.isfile(name):
+            return name
+    return None
+
+def _accepted_encodings(header: str) -> set:
+    accepted = set()
+    for item in header.split(","):
+        coding, _, params = item.strip().partition(";")
+        if coding and not re.search(r"q=0(?:\.0*)?\s*$", params.strip()):
+            accepted.add(coding.strip().lower())
+    return accepted
+
+if SERVE_FRONTEND:
+    @app.get("/{path:path}", include_in_schema=False)
+    async def serve_frontend(path: str, http_request: Request):
+        """Static site: precompressed .br/.gz siblings, ETag/Last-Modified, immutable hashed assets."""
+        file_path = _frontend_file(path)
+        if file_path is None:
+            raise HTTPException(status_code=404, detail="Not Found")
+        rel = os.path.relpath(file_path, FRONTEND_DIR).replace(os.sep, "/")
+        if HASHED_ASSET.match(rel):
+            cache_control = IMMUTABLE_CACHE
+        elif rel.endswith(".html"):
+            cache_control = "no-cache"  # Always revalidated, so new builds show up at once
+        else:
+            cache_control = f"public, max-age={FRONTEND_MAX_AGE}"
+
+        served, encoding = file_path, None
+        accepted = _accepted_encodings(http_request.headers.get("accept-encoding", ""))
+        for coding, suffix in PRECOMPRESSED:
+            if coding in accepted and os.path.isfile(file_path + suffix):
+                served, encoding = file_path + suffix, coding
+                break
+
+        st = os.stat(served)
+        etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}{"-" + encoding if encoding else ""}"'
+        headers = {
+            "ETag": etag,
+            "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+            "Cache-Control": cache_control,
+            "Vary": "Accept-Encoding",
+        }
+        if_modified_since = http_request.headers.get("if-modified-since")
+        if "if-none-match" in http_request.headers:
+            not_modified = _etag_matches(http_request, etag)
+        elif if_modified_since:
+            try:
+                not_modified = int(st.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                not_modified = False
+        else:
+            not_modified = False
+        if not_modified:
+            return Response(status_code=304, headers=headers)
+
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        media_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+        return FileResponse(served, media_type=media_type, headers=headers)
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,383 @@
+"""
+Per-page JS/CSS bundles for the static build (used by build_assets.py).
+
+For each HTML page:
+  - consecutive local stylesheet <link>s (same media) become one minified
+    CSS bundle, with relative url()s rebased to the bundle's location;
+  - consecutive local classic <script src> tags become one minified bundle.
+    Scripts at the very end of <body> run after parsing either way, so a
+    trailing run of plain and `defer` scripts is merged into a single
+    deferred bundle in their original execution order (plain ones first);
+  - ES modules are minified and fingerprinted one file each, with their
+    relative import specifiers pointing at the fingerprinted dependencies.
+
+Output files are named <stem>.<content hash>.<ext> under dist/assets/, so
+they can be served with immutable, year-long cache headers. precompress()
+writes .gz (and .br, when the `brotli` package is installed) siblings.
+
+The minifiers are deliberately conservative: comments and indentation go,
+line breaks stay (no reliance on automatic semicolon insertion changes),
+and string, template and regex literals are copied verbatim.
+"""
+import gzip
+import hashlib
+import html
+import os
+import re
+
+try:
+    import brotli
+except ImportError:  # Optional: .br siblings are skipped without it
+    brotli = None
+
+BUNDLE_DIR = "assets"
+COMPRESS_EXTENSIONS = {".html", ".css", ".js", ".svg", ".json"}
+MIN_COMPRESS_BYTES = 1024
+
+TAG = re.compile(r"<link\b[^>]*>|<script\b[^>]*>\s*</script>", re.IGNORECASE)
+ATTR = re.compile(r"""\s([a-zA-Z-]+)(?:\s*=\s*("[^"]*"|'[^']*'|[^\s"'>]+))?""")
+BODY_END = re.compile(r"\s*</body>", re.IGNORECASE)
+IMPORT_SPECIFIER = re.compile(r"""(\bfrom\s*|\bimport\s*\(?\s*)(["'])(\.{1,2}/[^"'\n]+)\2""")
+CSS_URL = re.compile(r"""url\(\s*(["']?)([^"')]+)\1\s*\)""", re.IGNORECASE)
+
+# After these tokens a "/" starts a regex literal rather than a division
+_REGEX_KEYWORDS = {"return", "typeof", "instanceof", "in", "of", "new", "delete", "void", "throw",
+                   "case", "do", "else", "yield", "await"}
+_IDENT = re.compile(r"[A-Za-z0-9_$\u0080-\uffff]+")
+
+
+# --- Minifiers ---
+
+def _skip_quoted(text, i):
+    quote, j, n = text[i], i + 1, len(text)
+    while j < n and text[j] != quote and text[j] != "\n":
+        j += 2 if text[j] == "\\" else 1
+    return min(j + 1, n)
+
+
+def _skip_template(text, i):
+    j, n = i + 1, len(text)
+    while j < n:
+        if text[j] == "\\":
+            j += 2
+        elif text[j] == "`":
+            return j + 1
+        elif text.startswith("${", j):
+            j = _skip_code_block(text, j + 2)
+        else:
+            j += 1
+    return n
+
+
+def _skip_code_block(text, i):
+    """Index just past the "}" closing a template ${...} expression starting at i."""
+    depth, j, n = 1, i, len(text)
+    while j < n:
+        c = text[j]
+        if c in "\"'":
+            j = _skip_quoted(text, j)
+        elif c == "`":
+            j = _skip_template(text, j)
+        elif c == "{":
+            depth, j = depth + 1, j + 1
+        elif c == "}":
+            depth, j = depth - 1, j + 1
+            if depth == 0:
+                return j
+        else:
+            j += 1
+    return n
+
+
+def _skip_regex(text, i):
+    """End of a regex literal starting at i, or None if it isn't one on this line."""
+    j, n, in_class = i + 1, len(text), False
+    while j < n and text[j] != "\n":
+        c = text[j]
+        if c == "\\":
+            j += 2
+            continue
+        if c == "[":
+            in_class = True
+        elif c == "]":
+            in_class = False
+        elif c == "/" and not in_class:
+            j += 1
+            while j < n and (text[j].isalnum() or text[j] == "_"):  # flags
+                j += 1
+            return j
+        j += 1
+    return None
+
+
+def minify_js(text):
+    """Drop comments, indentation, trailing spaces and blank lines."""
+    out = []
+    last = None  # last significant token
+
+    def newline():
+        while out and out[-1] == " ":
+            out.pop()
+        if out and out[-1] != "\n":
+            out.append("\n")
+
+    def space():
+        if out and out[-1] not in (" ", "\n"):
+            out.append(" ")
+
+    i, n = 0, len(text)
+    while i < n:
+        c = text[i]
+        if c == "\n":
+            newline()
+            i += 1
+        elif c in " \t\r\f\v":
+            space()
+            i += 1
+        elif c in "\"'":
+            j = _skip_quoted(text, i)
+            out.append(text[i:j])
+            last, i = c, j
+        elif c == "`":
+            j = _skip_template(text, i)
+            out.append(text[i:j])
+            last, i = c, j
+        elif text.startswith("//", i):
+            j = text.find("\n", i)
+            i = n if j < 0 else j
+        elif text.startswith("/*", i):
+            j = text.find("*/", i + 2)
+            j = n if j < 0 else j + 2
+            # A comment spanning lines may end a statement, so it becomes a line break
+            if "\n" in text[i:j]:
+                newline()
+            else:
+                space()
+            i = j
+        elif c == "/" and (last is None or last in _REGEX_KEYWORDS or not (_IDENT.fullmatch(last) or last in ")]")):
+            j = _skip_regex(text, i)
+            if j is None:
+                out.append(c)
+                last, i = c, i + 1
+            else:
+                out.append(text[i:j])
+                last, i = "/re/", j
+        else:
+            match = _IDENT.match(text, i)
+            if match:
+                out.append(match.group(0))
+                last, i = match.group(0), match.end()
+            else:
+                out.append(c)
+                last, i = c, i + 1
+    return "".join(out).strip() + "\n"
+
+
+def _minify_css_code(code):
+    code = re.sub(r"/\*.*?\*/", "", code, flags=re.DOTALL)
+    code = re.sub(r"\s+", " ", code)
+    # Spaces around these are never significant (unlike before ":", which is a descendant selector)
+    code = re.sub(r"\s*([{};,>])\s*", r"\1", code)
+    return re.sub(r":\s+", ":", code).replace(";}", "}")
+
+
+def minify_css(text):
+    """Drop comments and collapse whitespace; strings are left untouched."""
+    parts = []
+    i = start = 0
+    n = len(text)
+    while i < n:
+        if text.startswith("/*", i):
+            j = text.find("*/", i + 2)
+            i = n if j < 0 else j + 2
+        elif text[i] in "\"'":
+            parts.append(_minify_css_code(text[start:i]))
+            j = _skip_quoted(text, i)
+            parts.append(text[i:j])
+            i = start = j
+        else:
+            i += 1
+    parts.append(_minify_css_code(text[start:]))
+    return "".join(parts).strip() + "\n"
+
+
+def rebase_css_urls(text, from_dir, to_dir):
+    """Rewrite relative url()s so they still resolve once the CSS lives in to_dir."""
+    def replace(match):
+        quote, url = match.groups()
+        if re.match(r"^(?:[a-z]+:|/|#)", url, re.IGNORECASE):
+            return match.group(0)
+        target = os.path.normpath(os.path.join(from_dir, url))
+        return f"url({quote}{os.path.relpath(target, to_dir or '.').replace(os.sep, '/')}{quote})"
+    return CSS_URL.sub(replace, text)
+
+
+# --- Output ---
+
+def content_name(stem, data, ext):
+    digest = hashlib.sha256(data.encode("utf-8")).hexdigest()[:10]
+    stem = re.sub(r"[^A-Za-z0-9_-]+", "-", stem).strip("-") or "bundle"
+    return f"{stem}.{digest}{ext}"
+
+
+def write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def precompress(path):
+    """Write .gz/.br siblings of a text asset if missing or stale; returns the sibling paths."""
+    if os.path.splitext(path)[1].lower() not in COMPRESS_EXTENSIONS or os.path.getsize(path) < MIN_COMPRESS_BYTES:
+        return []
+    siblings = []
+    mtime = os.path.getmtime(path)
+    data = None
+    encoders = [(".gz", lambda d: gzip.compress(d, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        encoders.append((".br", lambda d: brotli.compress(d, quality=11)))
+    for suffix, encode in encoders:
+        target = path + suffix
+        siblings.append(target)
+        if os.path.exists(target) and os.path.getmtime(target) >= mtime:
+            continue
+        if data is None:
+            with open(path, "rb") as f:
+                data = f.read()
+        write_atomic(target, encode(data))
+    return siblings
+
+
+# --- Bundling ---
+
+def _attrs(tag):
+    return {k.lower(): html.unescape(v.strip("\"'")) if v else "" for k, v in ATTR.findall(tag[:tag.index(">")])}
+
+
+class Bundler:
+    """
+    Rewrites pages to use bundles; `texts` maps canonical source paths to
+    their (already processed) contents, `resolve(base_dir, ref)` maps a
+    reference to a canonical path or None.
+    """
+
+    def __init__(self, out, texts, resolve):
+        self.out = out
+        self.texts = texts
+        self.resolve = resolve
+        self.produced = set()  # absolute paths of written bundles
+        self._emitted = {}  # (kind, source keys) -> bundle file name
+        self._modules = {}  # source key -> bundle file name (None while in progress)
+
+    def _emit(self, stem, data, ext):
+        name = content_name(stem, data, ext)
+        path = os.path.join(self.out, BUNDLE_DIR, name)
+        if path not in self.produced:
+            if not os.path.exists(path):
+                write_atomic(path, data.encode("utf-8"))
+            self.produced.add(path)
+        return name
+
+    def css(self, keys):
+        cache_key = ("css", tuple(keys))
+        if cache_key not in self._emitted:
+            parts = [rebase_css_urls(minify_css(self.texts[k]), os.path.dirname(k), BUNDLE_DIR) for k in keys]
+            stem = os.path.splitext(os.path.basename(keys[0]))[0] if len(keys) == 1 else "bundle"
+            self._emitted[cache_key] = self._emit(stem, "".join(parts), ".css")
+        return self._emitted[cache_key]
+
+    def scripts(self, keys):
+        cache_key = ("js", tuple(keys))
+        if cache_key not in self._emitted:
+            # ";" guards against a file ending without a semicolon
+            data = ";\n".join(minify_js(self.texts[k]) for k in keys)
+            stem = os.path.splitext(os.path.basename(keys[0]))[0] if len(keys) == 1 else "bundle"
+            self._emitted[cache_key] = self._emit(stem, data, ".js")
+        return self._emitted[cache_key]
+
+    def module(self, key):
+        if key in self._modules:
+            if self._modules[key] is None:
+                raise ValueError(f"Import cycle through {key}; bundle it by hand or break the cycle")
+            return self._modules[key]
+        self._modules[key] = None
+        base_dir = os.path.dirname(key)
+
+        def replace(match):
+            prefix, quote, spec = match.groups()
+            dep = self.resolve(base_dir, spec)
+            if dep is None or dep not in self.texts:
+                return match.group(0)
+            return f"{prefix}{quote}./{self.module(dep)}{quote}"
+
+        data = IMPORT_SPECIFIER.sub(replace, minify_js(self.texts[key]))
+        self._modules[key] = self._emit(os.path.splitext(os.path.basename(key))[0], data, ".js")
+        return self._modules[key]
+
+    def _items(self, text, base_dir):
+        """Bundleable <link>/<script> tags as (start, end, kind, key, attrs)."""
+        items = []
+        for match in TAG.finditer(text):
+            tag = match.group(0)
+            attrs = _attrs(tag)
+            if tag[1:5].lower() == "link":
+                if attrs.get("rel", "").lower() != "stylesheet" or set(attrs) - {"rel", "href", "media", "type"}:
+                    continue
+                key = self.resolve(base_dir, attrs.get("href"))
+                if key and key.endswith(".css") and key in self.texts:
+                    items.append((match.start(), match.end(), "css", key, attrs.get("media", "all")))
+            else:
+                key = self.resolve(base_dir, attrs.get("src"))
+                if not key or not key.endswith(".js") or key not in self.texts:
+                    continue
+                if attrs.get("type") == "module" and set(attrs) <= {"src", "type"}:
+                    items.append((match.start(), match.end(), "module", key, None))
+                elif set(attrs) <= {"src", "defer", "type"} and attrs.get("type", "text/javascript") == "text/javascript":
+                    items.append((match.start(), match.end(), "js", key, "defer" in attrs))
+        return items
+
+    def _groups(self, text, items):
+        groups = []
+        for item in items:
+            last = groups[-1][-1] if groups else None
+            if (last and last[2] == item[2] != "module" and not text[last[1]:item[0]].strip()
+                    and (item[2] == "js" or last[4] == item[4])):
+                groups[-1].append(item)
+            else:
+                groups.append([item])
+        return groups
+
+    def rewrite_page(self, text, page_key):
+        """Replace the page's local <link>/<script> tags with bundles. Returns (html, count)."""
+        base_dir = os.path.dirname(page_key)
+        prefix = os.path.relpath(BUNDLE_DIR, base_dir or ".").replace(os.sep, "/") + "/"
+        replacements = []
+        for group in self._groups(text, self._items(text, base_dir)):
+            kind = group[0][2]
+            if kind == "css":
+                media = group[0][4]
+                media_attr = f' media="{html.escape(media)}"' if media != "all" else ""
+                tags = [(group, f'<link rel="stylesheet" href="{prefix}{self.css([g[3] for g in group])}"{media_attr}>')]
+            elif kind == "module":
+                tags = [(group, f'<script type="module" src="{prefix}{self.module(group[0][3])}"></script>')]
+            elif BODY_END.match(text, group[-1][1]):
+                # Trailing scripts: plain ones run as the parser reaches them, deferred ones right after
+                ordered = [g[3] for g in group if not g[4]] + [g[3] for g in group if g[4]]
+                defer = " defer" if any(g[4] for g in group) else ""
+                tags = [(group, f'<script src="{prefix}{self.scripts(ordered)}"{defer}></script>')]
+            else:
+                runs = []
+                for item in group:
+                    if runs and runs[-1][-1][4] == item[4]:
+                        runs[-1].append(item)
+                    else:
+                        runs.append([item])
+                tags = [(run, f'<script src="{prefix}{self.scripts([g[3] for g in run])}"'
+                              f'{" defer" if run[0][4] else ""}></script>') for run in runs]
+            replacements.extend((run[0][0], run[-1][1], tag) for run, tag in tags)
+
+        for start, end, tag in reversed(replacements):
+            text = text[:start] + tag + text[end:]
+        return text, len(replacements)
@@ -0,0 +1,457 @@
+"""
+Static asset build: responsive image variants, srcset rewrites and JS/CSS bundles.
+
+Copies the site (HTML, JS, CSS, images and fonts only; see site_files.py)
+into dist/ and, for every local JPG/PNG used by an <img> tag, generates
+AVIF/WebP variants at several widths plus a resized fallback in the
+original format. Each such <img> in
+the copied HTML is wrapped in a <picture> with AVIF/WebP <source> srcsets,
+and its src is pointed at the fallback.
+
+Images are deduplicated: file names are canonicalised to NFC (the repo has
+byte-identical NFC and NFD copies of Vietnamese names), and every image
+referenced from HTML/JS/CSS is emitted once per content hash as
+img/<hash>.<ext>, with the references rewritten to it. Images no page or
+script names literally (e.g. box thumbnails derived in cart.js) are copied
+under their NFC path instead.
+
+Page scripts and stylesheets are then minified, bundled and fingerprinted
+(see asset_bundler.py), and .gz/.br siblings are written for text assets.
+
+Incremental: variants are named by the source's content hash and recorded in
+dist/img/manifest.json, so unchanged images are skipped on the next run
+(and identical files are only encoded once). Encoding runs on a process pool.
+Files in dist/ that the current build no longer produces are removed.
+
+Usage (from backend/):
+  python build_assets.py                 # ../ -> ../dist
+  python build_assets.py --widths 480,960 --workers 4
+"""
+import argparse
+import hashlib
+import html
+import json
+import os
+import re
+import shutil
+import sys
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import unquote
+
+from PIL import Image
+
+from asset_bundler import Bundler, precompress
+from site_files import EXCLUDE_DIRS, is_site_file
+
+SITE_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+DEFAULT_WIDTHS = (320, 640, 960, 1280, 1920)
+FALLBACK_MAX_WIDTH = 1280
+IMG_DIR = "img"
+MANIFEST = "manifest.json"
+RASTER_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+ASSET_EXTENSIONS = RASTER_EXTENSIONS | {".gif", ".webp", ".svg", ".ico"}
+CODE_EXTENSIONS = {".js", ".css"}
+TEXT_EXTENSIONS = CODE_EXTENSIONS | {".html"}
+QUALITY = {"avif": 55, "webp": 78, "jpg": 82}
+
+# `sizes` hints by <img> class; the browser picks the smallest adequate variant
+SIZES_BY_CLASS = {
+    "logo": "160px",
+    "footer-logo": "160px",
+    "product-thumb": "(max-width: 768px) 50vw, 25vw",
+    "review-image": "(max-width: 768px) 33vw, 160px",
+    "item-image": "120px",
+}
+DEFAULT_SIZES = "(max-width: 768px) 100vw, 50vw"
+
+IMG_TAG = re.compile(r"<img\b[^>]*>", re.IGNORECASE)
+ATTR = re.compile(r"""\s([a-zA-Z-]+)\s*=\s*("[^"]*"|'[^']*')""")
+# Asset paths in quoted strings (HTML attributes, JS literals, CSS url('...')) and unquoted CSS url(...)
+QUOTED_REF = re.compile(r"""(["'])([^"'<>\n]+?\.(?:jpe?g|png|gif|webp|svg|ico))([?#][^"'<>\n]*)?\1""", re.IGNORECASE)
+CSS_URL_REF = re.compile(r"""url\(\s*([^"'()\s]+)\s*\)""", re.IGNORECASE)
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def supported_formats():
+    extensions = Image.registered_extensions()
+    formats = ["webp"] if extensions.get(".webp") == "WEBP" else []
+    if extensions.get(".avif") == "AVIF":
+        formats.insert(0, "avif")
+    return formats
+
+
+# --- Image encoding (runs in worker processes) ---
+
+def build_variants(source_path, out_dir, digest, widths, formats):
+    """Encode all variants of one image; returns its manifest entry."""
+    with Image.open(source_path) as img:
+        img.load()
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        base = img.convert("RGBA" if has_alpha else "RGB")
+
+    targets = sorted({w for w in widths if w < base.width} | {min(base.width, max(widths))})
+    fallback_ext = "png" if has_alpha else "jpg"
+    fallback_width = max([w for w in targets if w <= FALLBACK_MAX_WIDTH] or [targets[0]])
+    files = {fmt: {} for fmt in formats}
+
+    for width in targets:
+        resized = base if width == base.width else base.resize(
+            (width, round(base.height * width / base.width)), Image.LANCZOS)
+        for fmt in formats:
+            name = f"{digest}-{width}.{fmt}"
+            resized.save(os.path.join(out_dir, name), format=fmt.upper(), quality=QUALITY[fmt])
+            files[fmt][width] = name
+        if width == fallback_width:
+            name = f"{digest}-{width}.{fallback_ext}"
+            if has_alpha:
+                resized.save(os.path.join(out_dir, name), format="PNG", optimize=True)
+            else:
+                resized.save(os.path.join(out_dir, name), format="JPEG", quality=QUALITY["jpg"],
+                             optimize=True, progressive=True)
+            fallback = name
+
+    return {
+        "hash": digest,
+        "width": base.width,
+        "height": base.height,
+        "files": {fmt: {str(w): n for w, n in by_width.items()} for fmt, by_width in files.items()},
+        "fallback": fallback,
+    }
+
+
+def entry_files(entry):
+    yield entry["fallback"]
+    for by_width in entry["files"].values():
+        yield from by_width.values()
+
+
+# --- Source tree ---
+
+def iter_site_files(root):
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d not in EXCLUDE_DIRS and not d.startswith(".")]
+        for name in filenames:
+            rel = os.path.relpath(os.path.join(dirpath, name), root)
+            if is_site_file(rel):
+                yield rel
+
+
+def canonical(path):
+    """'/'-separated NFC form of a site-relative path."""
+    return unicodedata.normalize("NFC", path.replace(os.sep, "/"))
+
+
+class Site:
+    """Source files by canonical path; NFC/NFD spellings of one name collapse into one entry."""
+
+    def __init__(self, root):
+        self.root = root
+        self.files = {}  # canonical path -> path on disk (relative to root)
+        self.dropped = []  # on-disk paths that only duplicate another's name in a different normalization
+        self._hashes = {}
+        for rel in sorted(iter_site_files(root)):
+            key = canonical(rel)
+            other = self.files.get(key)
+            if other is None:
+                self.files[key] = rel
+                continue
+            # Prefer the spelling that already is NFC
+            keep, drop = (rel, other) if rel.replace(os.sep, "/") == key else (other, rel)
+            if self.hash(keep) != file_hash(os.path.join(root, drop)):
+                print(f"Warning: {drop!r} differs from {keep!r} only by Unicode normalization "
+                      f"but has different content; using {keep!r}.")
+            self.files[key] = keep
+            self.dropped.append(drop)
+
+    def path(self, key):
+        return os.path.join(self.root, self.files[key])
+
+    def hash(self, key_or_rel):
+        rel = self.files.get(key_or_rel, key_or_rel)
+        if rel not in self._hashes:
+            self._hashes[rel] = file_hash(os.path.join(self.root, rel))
+        return self._hashes[rel]
+
+    def resolve(self, base_dir, ref, extensions=ASSET_EXTENSIONS):
+        """Canonical path of a local file referenced relative to base_dir, or None."""
+        if not ref or re.match(r"^(?:[a-z]+:|//|#|\$\{)", ref, re.IGNORECASE):
+            return None
+        ref = unquote(ref.split("?", 1)[0].split("#", 1)[0])
+        if os.path.splitext(ref)[1].lower() not in extensions:
+            return None
+        path = os.path.normpath(ref.lstrip("/") if ref.startswith("/") else os.path.join(base_dir, ref))
+        key = canonical(path)
+        return key if key in self.files else None
+
+
+def fingerprinted_name(site, key):
+    return f"{site.hash(key)}{os.path.splitext(key)[1].lower()}"
+
+
+# --- Rewriting ---
+
+def _srcset(entry, fmt, prefix):
+    return ", ".join(f"{prefix}{name} {width}w" for width, name in sorted(
+        entry["files"][fmt].items(), key=lambda kv: int(kv[0])))
+
+
+def rewrite_html(text, html_rel, site, entries_by_source, formats):
+    """Wrap local <img> tags in <picture> with AVIF/WebP srcsets. Returns (html, count)."""
+    base_dir = os.path.dirname(html_rel)
+    prefix = os.path.relpath(IMG_DIR, base_dir or ".").replace(os.sep, "/") + "/"
+    count = 0
+    image_index = 0
+
+    def replace(match):
+        nonlocal count, image_index
+        tag = match.group(0)
+        attrs = {k.lower(): html.unescape(v[1:-1]) for k, v in ATTR.findall(tag)}
+        source = site.resolve(base_dir, attrs.get("src"), RASTER_EXTENSIONS)
+        entry = entries_by_source.get(source) if source else None
+        if not entry or "srcset" in attrs:
+            return tag
+        image_index += 1
+        classes = attrs.get("class", "").split()
+        sizes = next((SIZES_BY_CLASS[c] for c in classes if c in SIZES_BY_CLASS), DEFAULT_SIZES)
+
+        new_tag = re.sub(r"""\ssrc\s*=\s*("[^"]*"|'[^']*')""", f' src="{prefix}{entry["fallback"]}"', tag, count=1)
+        extra = ' decoding="async"' if "decoding" not in attrs else ""
+        # Keep the first images (logo, hero) eager so they don't delay first paint
+        if "loading" not in attrs and image_index > 3:
+            extra += ' loading="lazy"'
+        new_tag = re.sub(r"\s*/?>$", lambda m: f"{extra}{m.group(0)}", new_tag, count=1)
+
+        sources = "".join(
+            f'<source type="image/{fmt}" srcset="{_srcset(entry, fmt, prefix)}" sizes="{sizes}">'
+            for fmt in formats if entry["files"].get(fmt)
+        )
+        count += 1
+        return f"<picture>{sources}{new_tag}</picture>"
+
+    return IMG_TAG.sub(replace, text), count
+
+
+def rewrite_asset_refs(text, base_dir, site, prefix, referenced):
+    """Point every reference to a local image at its fingerprinted copy. Returns (text, count)."""
+    count = 0
+
+    def target(ref):
+        key = site.resolve(base_dir, ref)
+        if key is None:
+            return None
+        referenced.add(key)
+        return prefix + fingerprinted_name(site, key)
+
+    def replace_quoted(match):
+        nonlocal count
+        quote, ref, _ = match.groups()
+        url = target(ref)
+        if url is None:
+            return match.group(0)
+        count += 1
+        return f"{quote}{url}{quote}"
+
+    def replace_css_url(match):
+        nonlocal count
+        url = target(match.group(1))
+        if url is None:
+            return match.group(0)
+        count += 1
+        return f"url({url})"
+
+    text = QUOTED_REF.sub(replace_quoted, text)
+    return CSS_URL_REF.sub(replace_css_url, text), count
+
+
+# --- Output ---
+
+def copy_if_changed(src, dst):
+    try:
+        s, d = os.stat(src), os.stat(dst)
+        if s.st_size == d.st_size and int(s.st_mtime) <= int(d.st_mtime):
+            return False
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    shutil.copy2(src, dst)
+    return True
+
+
+def write_if_changed(path, text):
+    data = text.encode("utf-8")
+    try:
+        with open(path, "rb") as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+    return True
+
+
+def prune(out, produced):
+    """Delete files under out that this build did not produce; returns how many."""
+    removed = 0
+    for dirpath, _, filenames in os.walk(out, topdown=False):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if path not in produced:
+                os.remove(path)
+                removed += 1
+        if dirpath != out and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+    return removed
+
+
+def build(root, out, widths, workers):
+    formats = supported_formats()
+    if not formats:
+        sys.exit("This Pillow build can't write WebP; install a recent Pillow.")
+    if "avif" not in formats:
+        print("Note: Pillow has no AVIF support here, building WebP only.")
+
+    img_out = os.path.join(out, IMG_DIR)
+    os.makedirs(img_out, exist_ok=True)
+    manifest_path = os.path.join(img_out, MANIFEST)
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        manifest = {}
+    settings = {"widths": list(widths), "formats": formats}
+    if manifest.get("settings") != settings:
+        manifest = {"settings": settings, "images": {}}
+    images = manifest["images"]  # content hash -> entry
+
+    site = Site(root)
+    text_files = [k for k in site.files if os.path.splitext(k)[1].lower() in TEXT_EXTENSIONS]
+    html_files = [k for k in text_files if k.lower().endswith(".html")]
+    sources = {}
+    for key in text_files:
+        with open(site.path(key), "r", encoding="utf-8") as f:
+            sources[key] = f.read()
+
+    # 1. Every local raster image referenced by an <img> tag
+    in_img_tags = set()
+    for key in html_files:
+        for tag in IMG_TAG.findall(sources[key]):
+            attrs = {k.lower(): html.unescape(v[1:-1]) for k, v in ATTR.findall(tag)}
+            source = site.resolve(os.path.dirname(key), attrs.get("src"), RASTER_EXTENSIONS)
+            if source:
+                in_img_tags.add(source)
+
+    # 2. Encode what isn't in the manifest yet (by content hash)
+    pending = {}
+    for key in sorted(in_img_tags):
+        digest = site.hash(key)
+        entry = images.get(digest)
+        if not entry or not all(os.path.exists(os.path.join(img_out, n)) for n in entry_files(entry)):
+            pending.setdefault(digest, key)
+
+    unique = {site.hash(k) for k in in_img_tags}
+    print(f"{len(in_img_tags)} images in <img> tags, {len(unique)} unique, {len(pending)} to encode.")
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(build_variants, site.path(key), img_out, digest, widths, formats): key
+                       for digest, key in pending.items()}
+            for future in futures:
+                entry = future.result()
+                images[entry["hash"]] = entry
+                print(f"  encoded {futures[future]}")
+    for digest in set(images) - unique:
+        del images[digest]
+    write_if_changed(manifest_path, json.dumps(manifest, indent=1, ensure_ascii=False))
+
+    # 3. Rewrite HTML/JS/CSS: <picture> for <img> tags, fingerprinted URLs for all other image references
+    entries_by_source = {key: images[site.hash(key)] for key in in_img_tags}
+    produced = {manifest_path}
+    produced.update(os.path.join(img_out, name) for entry in images.values() for name in entry_files(entry))
+    referenced = set()
+    texts = {}
+    pictures = refs = 0
+    for key in text_files:
+        text = sources[key]
+        if key in html_files:
+            text, count = rewrite_html(text, key, site, entries_by_source, formats)
+            pictures += count
+        if key.lower().endswith(".js"):
+            # Image paths in scripts are relative to the page that loads them, i.e. the site root
+            base_dir, prefix = "", f"{IMG_DIR}/"
+        else:
+            base_dir = os.path.dirname(key)
+            prefix = os.path.relpath(IMG_DIR, base_dir or ".").replace(os.sep, "/") + "/"
+        texts[key], count = rewrite_asset_refs(text, base_dir, site, prefix, referenced)
+        refs += count
+
+    # 4. Bundle each page's scripts and stylesheets, then write the text files
+    bundler = Bundler(out, texts, lambda base_dir, ref: site.resolve(base_dir, ref, CODE_EXTENSIONS))
+    bundled = written = 0
+    for key in html_files:
+        texts[key], count = bundler.rewrite_page(texts[key], key)
+        bundled += count
+    for key, text in texts.items():
+        dst = os.path.join(out, key)
+        written += write_if_changed(dst, text)
+        produced.add(dst)
+    produced |= bundler.produced
+
+    # 5. One fingerprinted copy per referenced image; everything else under its NFC path
+    copied = 0
+    for key in site.files:
+        if key in sources:
+            continue
+        dst = os.path.join(img_out, fingerprinted_name(site, key)) if key in referenced else os.path.join(out, key)
+        if dst not in produced:
+            copied += copy_if_changed(site.path(key), dst)
+            produced.add(dst)
+
+    # 6. Precompressed siblings for text assets, then drop whatever this build no longer produces
+    for path in list(produced):
+        produced.update(precompress(path))
+    removed = prune(out, produced)
+
+    dropped = sum(os.path.getsize(os.path.join(root, rel)) for rel in site.dropped)
+    by_hash = {}
+    for key in referenced:
+        by_hash.setdefault(site.hash(key), []).append(key)
+    duplicate = sum(os.path.getsize(site.path(keys[0])) * (len(keys) - 1) for keys in by_hash.values())
+    print(f"Rewrote {pictures} <img> tags, {refs} other image references and {bundled} script/stylesheet tags "
+          f"({len(bundler.produced)} bundles); "
+          f"{written} text files written, {copied} files copied, {removed} stale files removed.")
+    print(f"Deduplicated: {len(site.dropped)} NFC/NFD duplicate names ({dropped / 1e6:.1f} MB), "
+          f"{sum(len(k) - 1 for k in by_hash.values())} same-content images ({duplicate / 1e6:.1f} MB).")
+
+    original = sum(os.path.getsize(site.path(k)) for k in in_img_tags)
+    fallback = sum(os.path.getsize(os.path.join(img_out, e["fallback"])) for e in entries_by_source.values())
+    largest_modern = sum(
+        os.path.getsize(os.path.join(img_out, e["files"][formats[-1]][max(e["files"][formats[-1]], key=int)]))
+        for e in entries_by_source.values()
+    )
+    print(f"Images in <img> tags: {original / 1e6:.1f} MB originals -> {fallback / 1e6:.1f} MB fallbacks, "
+          f"{largest_modern / 1e6:.1f} MB largest {formats[-1].upper()} variants.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build dist/ with responsive images and fingerprinted bundles")
+    parser.add_argument("--root", default=SITE_ROOT)
+    parser.add_argument("--out", default=os.path.join(SITE_ROOT, "dist"))
+    parser.add_argument("--widths", default=",".join(map(str, DEFAULT_WIDTHS)))
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    widths = tuple(sorted(int(w) for w in args.widths.split(",") if w.strip()))
+    build(os.path.abspath(args.root), os.path.abspath(args.out), widths, args.workers)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""
+Streaming bulk import/export for orders, order_details, payments and
+warehouse_inventory.
+
+Exports read through a server-side cursor in chunks of EXPORT_CHUNK_ROWS,
+so memory stays flat regardless of table size. Imports parse CSV (with a
+header row) or NDJSON incrementally, validate each row against the model's
+columns and write IMPORT_CHUNK_ROWS at a time: via COPY ... FROM STDIN when
+the driver supports it (psycopg2, pg8000), otherwise a batched executemany
+INSERT. A whole import is one transaction, so a bad row leaves the table
+untouched.
+
+Usage:
+  python bulk_io.py export orders --format ndjson -o orders.ndjson
+  python bulk_io.py import warehouse_inventory inventory.csv --upsert
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+from datetime import datetime
+
+from sqlalchemy import select, text, Integer, Float, DateTime
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from db_utils import get_db_engine
+from models import Order, OrderDetail, Payment, WarehouseInventory
+
+EXPORT_CHUNK_ROWS = int(os.getenv("BULK_EXPORT_CHUNK_ROWS", "5000"))
+IMPORT_CHUNK_ROWS = int(os.getenv("BULK_IMPORT_CHUNK_ROWS", "5000"))
+
+# table name -> (database, model, natural key used by --upsert)
+TABLES = {
+    "orders": ('payment', Order, "id"),
+    "order_details": ('payment', OrderDetail, "id"),
+    "payments": ('payment', Payment, "id"),
+    "warehouse_inventory": ('admin', WarehouseInventory, "product_name"),
+}
+FORMATS = ("csv", "ndjson")
+
+
+class BulkImportError(ValueError):
+    """Input row that can't be imported; carries the 1-based row number."""
+
+    def __init__(self, row_number, message):
+        super().__init__(f"Row {row_number}: {message}")
+        self.row_number = row_number
+
+
+def _table(name):
+    if name not in TABLES:
+        raise ValueError(f"Unknown table '{name}'. Choose one of: {', '.join(TABLES)}")
+    return TABLES[name]
+
+
+# --- Export ---
+
+def _json_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def export_rows(table_name, fmt="csv"):
+    """Yield the table as CSV or NDJSON text chunks, one chunk per cursor batch."""
+    db_name, model, _ = _table(table_name)
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format '{fmt}'")
+    columns = [c.name for c in model.__table__.columns]
+    stmt = select(*model.__table__.columns).order_by(model.__table__.c.id)
+
+    with get_db_engine(db_name).connect() as conn:
+        # stream_results keeps the rows server-side; yield_per sets the fetch size
+        result = conn.execution_options(stream_results=True, yield_per=EXPORT_CHUNK_ROWS).execute(stmt)
+        if fmt == "csv":
+            buf = io.StringIO()
+            writer = csv.writer(buf, lineterminator="\n")
+            writer.writerow(columns)
+            yield buf.getvalue()
+        for rows in result.partitions():
+            buf = io.StringIO()
+            if fmt == "csv":
+                writer = csv.writer(buf, lineterminator="\n")
+                writer.writerows(rows)
+            else:
+                for row in rows:
+                    buf.write(json.dumps({k: _json_value(v) for k, v in zip(columns, row)}, ensure_ascii=False))
+                    buf.write("\n")
+            yield buf.getvalue()
+
+
+# --- Import ---
+
+def _converter(column):
+    if isinstance(column.type, Integer):
+        return int
+    if isinstance(column.type, Float):
+        return float
+    if isinstance(column.type, DateTime):
+        return lambda v: v if isinstance(v, datetime) else datetime.fromisoformat(str(v).replace("Z", "+00:00"))
+    return str
+
+def _read_records(stream, fmt):
+    """Yield dicts from a text stream without reading it all into memory."""
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+    elif fmt == "ndjson":
+        for line_no, line in enumerate(stream, start=1):
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError as e:
+                    raise BulkImportError(line_no, f"invalid JSON ({e})")
+    else:
+        raise ValueError(f"Unknown format '{fmt}'")
+
+def _typed_rows(model, records):
+    """Validate records against the model's columns and convert their values."""
+    table = model.__table__
+    converters = {c.name: _converter(c) for c in table.columns}
+    required = {c.name for c in table.columns
+                if not c.nullable and not c.primary_key and c.default is None}
+    for row_number, record in enumerate(records, start=1):
+        unknown = set(record) - set(converters)
+        if unknown:
+            raise BulkImportError(row_number, f"unknown column(s) {', '.join(sorted(unknown))}")
+        row = {}
+        for name, value in record.items():
+            if value is None or value == "":
+                continue  # Let column defaults / NULL apply
+            try:
+                row[name] = converters[name](value)
+            except (TypeError, ValueError):
+                raise BulkImportError(row_number, f"bad value for {name}: {value!r}")
+        missing = required - set(row)
+        if missing:
+            raise BulkImportError(row_number, f"missing {', '.join(sorted(missing))}")
+        yield row
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def copy_rows(conn, table, rows):
+    """Write rows (dicts sharing the same keys) with COPY FROM STDIN.
+
+    Falls back to an executemany INSERT on drivers without COPY support.
+    Runs inside the caller's transaction.
+    """
+    if not rows:
+        return
+    columns = list(rows[0])
+    driver = conn.dialect.driver
+    if driver not in ("psycopg2", "pg8000"):
+        conn.execute(table.insert(), rows)
+        return
+
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    for row in rows:
+        writer.writerow([_json_value(row[c]) for c in columns])
+    buf.seek(0)
+    sql = f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+
+    raw = conn.connection.driver_connection
+    cur = raw.cursor()
+    try:
+        if driver == "psycopg2":
+            cur.copy_expert(sql, buf)
+        else:
+            cur.execute(sql, stream=buf)
+    finally:
+        cur.close()
+
+def sync_id_sequence(conn, table):
+    """Move the table's id sequence past MAX(id) after inserting explicit ids."""
+    conn.execute(text(
+        f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+        f"COALESCE((SELECT MAX(id) FROM {table.name}), 0) + 1, false)"
+    ))
+
+def _complete_rows(table, chunk, keep_id):
+    """Give every row the same columns, applying Python-side defaults.
+
+    COPY and executemany both need a uniform column list, and COPY bypasses
+    SQLAlchemy's column defaults, so they are filled in here.
+    """
+    now = datetime.utcnow()
+    for row in chunk:
+        if not keep_id:
+            row.pop("id", None)
+        for column in table.columns:
+            if column.primary_key or column.name in row:
+                continue
+            default = column.default
+            if default is None:
+                row[column.name] = None
+            else:
+                row[column.name] = now if default.is_callable else default.arg
+
+def import_rows(table_name, stream, fmt="csv", upsert=False):
+    """Load rows from a text stream into a table in one transaction.
+
+    With upsert=True rows whose natural key already exists are updated
+    (only the columns present in the input) instead of failing the import.
+    Returns the number of rows written.
+    """
+    db_name, model, key = _table(table_name)
+    table = model.__table__
+    written = 0
+    explicit_ids = False
+
+    with get_db_engine(db_name).begin() as conn:
+        for chunk in _chunks(_typed_rows(model, _read_records(stream, fmt)), IMPORT_CHUNK_ROWS):
+            supplied = set().union(*chunk)
+            if upsert:
+                if key == "id" and any("id" not in r for r in chunk):
+                    raise ValueError("--upsert on this table needs an id on every row")
+                _complete_rows(table, chunk, keep_id=(key == "id"))
+                stmt = pg_insert(table)
+                update_cols = {name: stmt.excluded[name] for name in supplied if name not in (key, "id")}
+                if update_cols:
+                    stmt = stmt.on_conflict_do_update(index_elements=[table.c[key]], set_=update_cols)
+                else:
+                    stmt = stmt.on_conflict_do_nothing(index_elements=[table.c[key]])
+                conn.execute(stmt, chunk)
+            else:
+                # Rows without an id take the next value from the sequence
+                with_id = [r for r in chunk if "id" in r]
+                without_id = [r for r in chunk if "id" not in r]
+                _complete_rows(table, with_id, keep_id=True)
+                _complete_rows(table, without_id, keep_id=False)
+                copy_rows(conn, table, with_id)
+                copy_rows(conn, table, without_id)
+            explicit_ids = explicit_ids or ("id" in supplied and (key == "id" or not upsert))
+            written += len(chunk)
+
+        if explicit_ids:
+            # Explicit ids don't advance the serial
+            sync_id_sequence(conn, table)
+    return written
+
+
+# --- CLI ---
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import/export of order and inventory tables")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    exp = sub.add_parser("export", help="Stream a table to CSV/NDJSON")
+    exp.add_argument("table", choices=list(TABLES))
+    exp.add_argument("--format", choices=FORMATS, default="csv")
+    exp.add_argument("-o", "--output", help="Output file (default: stdout)")
+
+    imp = sub.add_parser("import", help="Load a CSV/NDJSON file into a table")
+    imp.add_argument("table", choices=list(TABLES))
+    imp.add_argument("file", help="Input file, or - for stdin")
+    imp.add_argument("--format", choices=FORMATS, help="Default: from the file extension")
+    imp.add_argument("--upsert", action="store_true", help="Update rows whose key already exists")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        out = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+        try:
+            for chunk in export_rows(args.table, args.format):
+                out.write(chunk)
+        finally:
+            if args.output:
+                out.close()
+        return
+
+    fmt = args.format or ("ndjson" if args.file.endswith((".ndjson", ".jsonl")) else "csv")
+    stream = sys.stdin if args.file == "-" else open(args.file, "r", encoding="utf-8-sig", newline="")
+    try:
+        count = import_rows(args.table, stream, fmt, upsert=args.upsert)
+    except BulkImportError as e:
+        print(f"Import aborted, nothing written. {e}")
+        sys.exit(1)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    print(f"Imported {count} rows into {args.table}.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+"""
+Server-side carts (payment_db.carts / cart_items).
+
+A cart line is compact: a product sku, a quantity and {option sku: quantity}.
+Names and prices are never taken from the client; lines are priced from
+`price_table`, an in-process copy of product_prices reloaded every
+PRICE_CACHE_TTL_SECONDS, so viewing or checking out a cart costs one small
+query for its lines.
+
+The cart id doubles as the stock reservation id (stock_reservations.cart_id).
+When a guest logs in, merge_carts() moves the guest's lines into the user's
+existing cart and re-keys the stock holds through a 'reservation.move'
+outbox event written in the same transaction.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import select, update, delete, insert, func
+from db_utils import get_db_session
+from models import ProductPrice, Cart, CartItem
+import outbox
+
+PRICE_CACHE_TTL_SECONDS = int(os.getenv("PRICE_CACHE_TTL_SECONDS", "300"))
+MAX_LINES_PER_CART = 50
+MAX_LINE_QUANTITY = 99
+
+
+class CartError(Exception):
+    """Client-facing cart failure; app.py turns it into an HTTPException."""
+
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class PriceTable:
+    """In-process map of sku -> active price row, reloaded once older than the TTL."""
+
+    def __init__(self, ttl_seconds):
+        self.ttl_seconds = ttl_seconds
+        self._rows = {}
+        self._lock = threading.Lock()
+        self.loaded_at = None
+
+    def load(self):
+        session = get_db_session('payment')
+        try:
+            rows = session.execute(
+                select(ProductPrice.sku, ProductPrice.name, ProductPrice.kind, ProductPrice.unit_price, ProductPrice.image)
+                .where(ProductPrice.active.is_(True))
+            ).all()
+        finally:
+            session.close()
+
+        fresh = {
+            r.sku: {"sku": r.sku, "name": r.name, "kind": r.kind, "unit_price": round(r.unit_price, 2), "image": r.image}
+            for r in rows
+        }
+        with self._lock:
+            self._rows = fresh
+            self.loaded_at = time.monotonic()
+
+    def invalidate(self):
+        """Force a reload on next access (e.g. after re-seeding prices)."""
+        with self._lock:
+            self.loaded_at = None
+
+    def get(self, sku):
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl_seconds:
+            self.load()
+        return self._rows.get(sku)
+
+
+price_table = PriceTable(PRICE_CACHE_TTL_SECONDS)
+
+
+def _product(sku):
+    price = price_table.get(sku)
+    if not price or price["kind"] != 'product':
+        raise CartError(400, f"Unknown product: {sku}")
+    return price
+
+def _normalize_options(options):
+    """Validate {option sku: quantity}; returns the JSON stored on the line (None if empty)."""
+    picked = {}
+    for sku, qty in (options or {}).items():
+        qty = int(qty or 0)
+        if qty <= 0:
+            continue
+        price = price_table.get(sku)
+        if not price or price["kind"] == 'product':
+            raise CartError(400, f"Unknown option: {sku}")
+        picked[sku] = min(qty, MAX_LINE_QUANTITY)
+    return json.dumps(picked, sort_keys=True, separators=(",", ":")) if picked else None
+
+def _check_quantity(quantity):
+    if quantity <= 0 or quantity > MAX_LINE_QUANTITY:
+        raise CartError(400, f"Quantity must be between 1 and {MAX_LINE_QUANTITY}")
+
+
+def price_line(row):
+    """Priced view of a cart_items row; `available` is False once its product is withdrawn."""
+    product = price_table.get(row.sku)
+    options = []
+    unit_price = product["unit_price"] if product else 0.0
+    available = product is not None
+    for sku, qty in json.loads(row.options or "{}").items():
+        option = price_table.get(sku)
+        if option is None:
+            available = False
+            continue
+        unit_price += option["unit_price"] * qty
+        options.append({
+            "sku": sku,
+            "name": option["name"],
+            "kind": option["kind"],
+            "image": option["image"],
+            "quantity": qty,
+            "unit_price": option["unit_price"]
+        })
+    unit_price = round(unit_price, 2)
+    return {
+        "id": row.id,
+        "sku": row.sku,
+        "name": row.label or (product["name"] if product else row.sku),
+        "image": product["image"] if product else None,
+        "quantity": row.quantity,
+        "options": options,
+        "unit_price": unit_price,
+        "subtotal": round(unit_price * row.quantity, 2),
+        "available": available,
+        "client_id": row.client_id
+    }
+
+def _lines(session, cart_id):
+    return session.execute(
+        select(CartItem.id, CartItem.sku, CartItem.label, CartItem.quantity, CartItem.options, CartItem.client_id)
+        .where(CartItem.cart_id == cart_id)
+        .order_by(CartItem.id)
+    ).all()
+
+def _cart(session, cart_id, user_id, lock=False):
+    """Load a cart the caller may use: guest carts are open to their id's holder, user carts to that user only."""
+    stmt = select(Cart).where(Cart.id == cart_id)
+    if lock:
+        stmt = stmt.with_for_update()
+    cart = session.execute(stmt).scalar_one_or_none()
+    if cart is None:
+        raise CartError(404, "Cart not found")
+    if cart.user_id is not None and cart.user_id != user_id:
+        raise CartError(403, "Cart belongs to another user")
+    return cart
+
+def _latest_user_cart(session, user_id):
+    return session.execute(
+        select(Cart).where(Cart.user_id == user_id).order_by(Cart.updated_at.desc()).limit(1)
+    ).scalar_one_or_none()
+
+
+def cart_view(cart_id, user_id=None):
+    """All lines of a cart, priced server-side."""
+    session = get_db_session('payment')
+    try:
+        cart = _cart(session, cart_id, user_id)
+        items = [price_line(row) for row in _lines(session, cart_id)]
+        return {
+            "cart_id": cart.id,
+            "user_id": cart.user_id,
+            "items": items,
+            "items_total": round(sum(i["subtotal"] for i in items if i["available"]), 2)
+        }
+    finally:
+        session.close()
+
+
+def add_item(cart_id, user_id, sku, quantity=1, options=None, label=None, client_id=None):
+    """Append a line and return it priced, with the (possibly new) cart id.
+
+    Without a cart id a logged-in user continues their latest cart and a guest
+    gets a fresh one. A cart id the server has not seen yet (e.g. one only used
+    for stock holds so far) is created under that id so the holds stay with it.
+    `client_id` is the browser's id for the line; it is stored with the line so
+    the browser can link the two even if it never saw this response.
+    """
+    _product(sku)
+    _check_quantity(quantity)
+    options_json = _normalize_options(options)
+    label = (label or "").strip()[:100] or None
+    client_id = (client_id or "").strip()[:64] or None
+
+    session = get_db_session('payment')
+    try:
+        now = datetime.utcnow()
+        cart = None
+        if cart_id:
+            cart_id = cart_id.strip()[:64]
+            try:
+                cart = _cart(session, cart_id, user_id, lock=True)
+            except CartError as e:
+                if e.status_code != 404:
+                    raise
+        elif user_id is not None:
+            cart = _latest_user_cart(session, user_id)
+
+        if cart is None:
+            cart = Cart(id=cart_id or uuid.uuid4().hex, user_id=user_id, created_at=now)
+            session.add(cart)
+            session.flush()
+        elif cart.user_id is None and user_id is not None:
+            cart.user_id = user_id  # A guest cart used after login becomes the user's
+
+        line_count = session.execute(
+            select(func.count(CartItem.id)).where(CartItem.cart_id == cart.id)
+        ).scalar_one()
+        if line_count >= MAX_LINES_PER_CART:
+            raise CartError(409, f"A cart holds at most {MAX_LINES_PER_CART} lines")
+
+        row = session.execute(
+            insert(CartItem).values(
+                cart_id=cart.id, sku=sku, label=label, quantity=quantity, options=options_json,
+                client_id=client_id, created_at=now
+            ).returning(CartItem.id, CartItem.sku, CartItem.label, CartItem.quantity, CartItem.options, CartItem.client_id)
+        ).first()
+        cart.updated_at = now
+        session.commit()
+        return {"cart_id": cart.id, "item": price_line(row)}
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def set_quantity(cart_id, user_id, item_id, quantity):
+    """Change one line's quantity and return it priced."""
+    _check_quantity(quantity)
+    session = get_db_session('payment')
+    try:
+        cart = _cart(session, cart_id, user_id, lock=True)
+        row = session.execute(
+            update(CartItem)
+            .where(CartItem.id == item_id, CartItem.cart_id == cart_id)
+            .values(quantity=quantity)
+            .returning(CartItem.id, CartItem.sku, CartItem.label, CartItem.quantity, CartItem.options, CartItem.client_id)
+        ).first()
+        if row is None:
+            raise CartError(404, "Cart item not found")
+        cart.updated_at = datetime.utcnow()
+        session.commit()
+        return price_line(row)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def remove_item(cart_id, user_id, item_id):
+    """Delete one line. Returns how many lines the cart has left."""
+    session = get_db_session('payment')
+    try:
+        cart = _cart(session, cart_id, user_id, lock=True)
+        deleted = session.execute(
+            delete(CartItem).where(CartItem.id == item_id, CartItem.cart_id == cart_id)
+        ).rowcount
+        if not deleted:
+            raise CartError(404, "Cart item not found")
+        cart.updated_at = datetime.utcnow()
+        remaining = session.execute(
+            select(func.count(CartItem.id)).where(CartItem.cart_id == cart_id)
+        ).scalar_one()
+        session.commit()
+        return remaining
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def merge_carts(guest_cart_id, user_id):
+    """Fold a guest cart into the user's cart at login. Returns the user's cart id, or None.
+
+    A user without a cart simply adopts the guest cart. Otherwise the guest's
+    lines move over unchanged (they may ship to different recipients, so equal
+    lines are not summed) and the guest cart is deleted.
+    """
+    session = get_db_session('payment')
+    try:
+        user_cart = _latest_user_cart(session, user_id)
+        guest = None
+        if guest_cart_id:
+            guest = session.execute(
+                select(Cart).where(Cart.id == guest_cart_id).with_for_update()
+            ).scalar_one_or_none()
+        if guest is None or guest.user_id not in (None, user_id):
+            return user_cart.id if user_cart else None
+
+        now = datetime.utcnow()
+        if user_cart is None or user_cart.id == guest.id:
+            guest.user_id = user_id
+            guest.updated_at = now
+            session.commit()
+            return guest.id
+
+        session.execute(
+            update(CartItem).where(CartItem.cart_id == guest.id).values(cart_id=user_cart.id)
+        )
+        session.execute(delete(Cart).where(Cart.id == guest.id))
+        user_cart.updated_at = now
+        session.add(outbox.new_event('reservation.move', {"from_cart_id": guest.id, "to_cart_id": user_cart.id}))
+        session.commit()
+        outbox.notify()
+        return user_cart.id
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def checkout_lines(session, cart_id, user_id):
+    """Lock a cart inside the /payment transaction and return its priced lines.
+
+    An id with no server cart (stock holds only) has no lines. Raises
+    CartError(409) if a line's product was withdrawn since it was added.
+    """
+    try:
+        _cart(session, cart_id, user_id, lock=True)
+    except CartError as e:
+        if e.status_code == 404:
+            return []
+        raise
+    lines = [price_line(row) for row in _lines(session, cart_id)]
+    withdrawn = [line["name"] for line in lines if not line["available"]]
+    if withdrawn:
+        raise CartError(409, f"No longer available: {', '.join(withdrawn)}")
+    return lines
+
+def delete_cart(session, cart_id):
+    """Remove a checked-out cart and its lines."""
+    session.execute(delete(CartItem).where(CartItem.cart_id == cart_id))
+    session.execute(delete(Cart).where(Cart.id == cart_id))
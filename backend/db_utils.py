@@ -2,6 +2,7 @@ import os
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
+from metrics import instrument_engine
 
 # Load environment variables from backend/.env
 load_dotenv()
@@ -38,6 +39,7 @@ def get_db_engine(db_name: str):
     else:
         raise ValueError("Invalid database name. Choose 'member', 'payment', or 'admin'.")
     
+    instrument_engine(engine, db_name)
     _db_engines[db_name] = engine
     return engine
 
@@ -19,26 +19,12 @@ def deploy_chat_widget():
             
             modified = False
             
-            # Check if chat is already present, but continue to verify Font Awesome
-            check_chat = 'src/scripts/chat.js' in content
-            
             # Inject Font Awesome if missing
             font_awesome = '<link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css" />\n'
             if 'font-awesome' not in content and '<head>' in content:
                 # Insert after <head>
                 content = content.replace('<head>', '<head>\n    ' + font_awesome)
                 modified = True
-            
-            if check_chat and not modified:
-                print(f"Skipping {os.path.basename(file_path)} - already has chat and font awesome")
-                continue
-                
-            # Inject CSS before </head>
-            font_awesome = '<link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css" />\n'
-            if 'font-awesome' not in content and '<head>' in content:
-                # Insert after <head>
-                content = content.replace('<head>', '<head>\n    ' + font_awesome)
-                modified = True
                 
             # Inject CSS before </head>
             if 'src/styles/chat.css' not in content and '</head>' in content:
@@ -51,12 +37,15 @@ def deploy_chat_widget():
                 modified = True
             
             if modified:
-                with open(file_path, 'w', encoding='utf-8') as f:
+                # Write to a temp file and swap it in, so a page is never left half-written
+                tmp_path = file_path + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
                     f.write(content)
+                os.replace(tmp_path, file_path)
                 print(f"Updated {os.path.basename(file_path)}")
                 count += 1
             else:
-                print(f"Skipping {os.path.basename(file_path)} - no head/body tags found?")
+                print(f"Skipping {os.path.basename(file_path)} - already has chat and font awesome")
                 
         except Exception as e:
             print(f"Error processing {file_path}: {e}")
@@ -0,0 +1,246 @@
+"""
+Content-addressed disk cache in front of the AI image provider.
+
+A design is identified by the SHA-256 of its normalized request
+(box name, sorted items), so the same box + assortment is generated once and
+served from disk afterwards. Concurrent requests for a design that is still
+being generated share one provider call (single-flight). The cache is
+bounded by DESIGN_CACHE_MAX_MB and evicts least recently used files.
+
+Provider calls go through one pooled httpx.AsyncClient, so they never block
+the event loop.
+
+Images are served by URL from /designs/<hash>.jpg. With Pillow installed,
+WebP/AVIF copies and thumbnails (/designs/<hash>-<width>.<ext>) are made on
+first request and stored next to the original.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from urllib.parse import quote
+
+import httpx
+
+import metrics
+
+try:
+    from PIL import Image
+except ImportError:  # Optional: only needed for WebP/AVIF variants and thumbnails
+    Image = None
+
+DESIGN_API_URL = os.getenv("DESIGN_API_URL", "https://image.pollinations.ai/prompt/")
+DESIGN_CACHE_DIR = os.getenv("DESIGN_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "design_cache"))
+DESIGN_CACHE_MAX_BYTES = int(float(os.getenv("DESIGN_CACHE_MAX_MB", "500")) * 1024 * 1024)
+DESIGN_TIMEOUT_SECONDS = float(os.getenv("DESIGN_TIMEOUT_SECONDS", "60"))
+THUMBNAIL_WIDTHS = tuple(int(w) for w in os.getenv("DESIGN_THUMBNAIL_WIDTHS", "320,640").split(",") if w.strip())
+
+# Output formats for variants, by file extension; AVIF needs a Pillow build with AVIF support
+VARIANT_FORMATS = {}
+if Image is not None:
+    _extensions = Image.registered_extensions()
+    VARIANT_FORMATS = {ext: (fmt, quality) for ext, fmt, quality in
+                       (("jpg", "JPEG", 85), ("webp", "WEBP", 80), ("avif", "AVIF", 60))
+                       if _extensions.get(f".{ext}") == fmt}
+MEDIA_TYPES = {"jpg": "image/jpeg", "webp": "image/webp", "avif": "image/avif"}
+
+logger = logging.getLogger("design_cache")
+cache_requests = metrics.Counter("design_cache_requests_total", "Design lookups by result", ("result",))
+
+
+class ProviderError(Exception):
+    """The image provider answered with an error status."""
+
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+
+
+def normalize(box_name, items):
+    """Canonical (box_name, items) so equivalent requests share a cache entry."""
+    box = " ".join(box_name.split())
+    return box, sorted(" ".join(item.split()) for item in items if item and item.strip())
+
+def design_hash(box_name, items):
+    box, items = normalize(box_name, items)
+    key = json.dumps([box.casefold(), [i.casefold() for i in items]], ensure_ascii=False)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def build_prompt(box_name, items):
+    box, items = normalize(box_name, items)
+    items_str = ", ".join(items) if items else "assorted premium cakes"
+    # Prompt optimized for Pollinations
+    return f"product photography of a open {box} gift box filled with {items_str}, delicious, cinematic lighting, 8k, highly detailed, photorealistic"
+
+
+class DesignCache:
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._index = None  # hash -> (size, last_used)
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._client = None
+
+    # --- Disk ---
+    def path(self, digest, width=None, ext="jpg"):
+        suffix = f"-{width}" if width else ""
+        return os.path.join(self.directory, digest[:2], f"{digest}{suffix}.{ext}")
+
+    def _load_index(self):
+        index = {}
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                # Originals only; variants are removed together with their original
+                if name.endswith(".jpg") and "-" not in name:
+                    st = os.stat(os.path.join(root, name))
+                    index[name[:-4]] = (st.st_size, st.st_mtime)
+        return index
+
+    def _ensure_index(self):
+        with self._lock:
+            if self._index is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._index = self._load_index()
+
+    def touch(self, digest):
+        """True if the design is cached; a hit refreshes its LRU position."""
+        self._ensure_index()
+        with self._lock:
+            entry = self._index.get(digest)
+            if entry is None:
+                return False
+            self._index[digest] = (entry[0], time.time())
+        try:
+            os.utime(self.path(digest))  # Keeps LRU order across restarts
+            return True
+        except FileNotFoundError:
+            with self._lock:
+                self._index.pop(digest, None)
+            return False
+
+    def write(self, digest, data):
+        self._ensure_index()
+        path = self.path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._index[digest] = (len(data), time.time())
+            victims = self._evictions()
+        for victim in victims:
+            folder = os.path.dirname(self.path(victim))
+            for name in os.listdir(folder):
+                if name.startswith(victim):
+                    try:
+                        os.remove(os.path.join(folder, name))
+                    except FileNotFoundError:
+                        pass
+
+    def _evictions(self):
+        """Drop least recently used entries until under max_bytes (lock held)."""
+        total = sum(size for size, _ in self._index.values())
+        victims = []
+        for digest, (size, _) in sorted(self._index.items(), key=lambda kv: kv[1][1]):
+            if total <= self.max_bytes:
+                break
+            total -= size
+            victims.append(digest)
+            del self._index[digest]
+        return victims
+
+    def exists(self, digest):
+        self._ensure_index()
+        with self._lock:
+            return digest in self._index
+
+    def variant_file(self, digest, width=None, ext="jpg"):
+        """Path of the original or a variant, creating the variant if needed. None if unavailable."""
+        if not width and ext == "jpg":
+            return self.path(digest) if self.exists(digest) else None
+        if ext not in VARIANT_FORMATS or (width and width not in THUMBNAIL_WIDTHS) or not self.exists(digest):
+            return None
+        path = self.path(digest, width, ext)
+        if os.path.exists(path):
+            return path
+
+        fmt, quality = VARIANT_FORMATS[ext]
+        with Image.open(self.path(digest)) as img:
+            img = img.convert("RGB")
+            if width and img.width > width:
+                img = img.resize((width, round(img.height * width / img.width)), Image.LANCZOS)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            img.save(tmp, format=fmt, quality=quality)
+        os.replace(tmp, path)
+        return path
+
+    def urls(self, digest, url_for):
+        """Public URLs of a design and its variants; url_for(name) maps a file name to a URL."""
+        urls = {"image": url_for(f"{digest}.jpg"), "sources": {}, "thumbnails": {}}
+        for ext in VARIANT_FORMATS:
+            if ext != "jpg":
+                urls["sources"][ext] = url_for(f"{digest}.{ext}")
+        if Image is not None:
+            ext = "webp" if "webp" in VARIANT_FORMATS else "jpg"
+            urls["thumbnails"] = {str(w): url_for(f"{digest}-{w}.{ext}") for w in THUMBNAIL_WIDTHS}
+        return urls
+
+    # --- Provider ---
+    def _http(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=DESIGN_TIMEOUT_SECONDS,
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+                follow_redirects=True
+            )
+        return self._client
+
+    async def _fetch(self, prompt):
+        url = f"{DESIGN_API_URL}{quote(prompt)}?nologo=true"
+        started = time.perf_counter()
+        try:
+            response = await self._http().get(url)
+        except httpx.HTTPError:
+            metrics.image_latency.observe(time.perf_counter() - started, outcome="error")
+            raise
+        if response.status_code != 200:
+            metrics.image_latency.observe(time.perf_counter() - started, outcome="error")
+            raise ProviderError(response.status_code, f"Error from AI provider: {response.text[:500]}")
+        metrics.image_latency.observe(time.perf_counter() - started, outcome="ok")
+        return response.content
+
+    async def _generate(self, digest, box_name, items):
+        data = await self._fetch(build_prompt(box_name, items))
+        await asyncio.to_thread(self.write, digest, data)
+
+    async def ensure(self, box_name, items):
+        """Return the design's hash, generating the image only on a cache miss."""
+        digest = design_hash(box_name, items)
+        if await asyncio.to_thread(self.touch, digest):
+            cache_requests.inc(result="hit")
+            return digest
+
+        task = self._inflight.get(digest)
+        if task is not None:
+            cache_requests.inc(result="shared")
+        else:
+            cache_requests.inc(result="miss")
+            task = asyncio.ensure_future(self._generate(digest, box_name, items))
+            self._inflight[digest] = task
+            task.add_done_callback(lambda _: self._inflight.pop(digest, None))
+        # shield: one waiter disconnecting must not cancel the others' generation
+        await asyncio.shield(task)
+        return digest
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+design_cache = DesignCache(DESIGN_CACHE_DIR, DESIGN_CACHE_MAX_BYTES)
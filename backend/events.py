@@ -0,0 +1,92 @@
+"""
+Server-Sent Events broker.
+
+Pages subscribe to channels ("inventory", "shipping") on GET /api/events and
+receive only changed rows. Deltas published in quick succession are merged
+per channel and flushed together, so a rush of add-to-carts becomes one
+small message instead of one per write.
+"""
+import asyncio
+import json
+
+FLUSH_DELAY_SECONDS = 0.25
+SUBSCRIBER_QUEUE_SIZE = 100
+HEARTBEAT_SECONDS = 15
+
+
+class EventBroker:
+    def __init__(self):
+        self._subscribers = {}  # queue -> set of channels
+        self._pending = {}      # channel -> merged {key: value} delta
+        self._flush_scheduled = False
+        self._loop = None
+
+    def bind(self, loop):
+        """Remember the event loop so publish() can be called from worker threads."""
+        self._loop = loop
+
+    def subscribe(self, channels):
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers[queue] = set(channels)
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.pop(queue, None)
+
+    def publish(self, channel, changes):
+        """Queue a {key: value} delta for a channel. Safe to call from any thread."""
+        if self._loop is None or not changes:
+            return
+        self._loop.call_soon_threadsafe(self._merge, channel, dict(changes))
+
+    def _merge(self, channel, changes):
+        self._pending.setdefault(channel, {}).update(changes)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self._loop.call_later(FLUSH_DELAY_SECONDS, self._flush)
+
+    def _flush(self):
+        self._flush_scheduled = False
+        pending, self._pending = self._pending, {}
+        for channel, changes in pending.items():
+            message = f"event: {channel}\ndata: {json.dumps(changes, ensure_ascii=False, default=str)}\n\n"
+            for queue, channels in list(self._subscribers.items()):
+                if channel not in channels:
+                    continue
+                try:
+                    queue.put_nowait(message)
+                except asyncio.QueueFull:
+                    # Slow consumer: drop it, the browser reconnects and refetches a snapshot
+                    self.unsubscribe(queue)
+                    while not queue.empty():
+                        queue.get_nowait()
+                    queue.put_nowait(None)
+
+    def close(self):
+        for queue in list(self._subscribers):
+            self.unsubscribe(queue)
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(None)
+
+    async def stream(self, channels, is_disconnected):
+        """Yield SSE frames for one subscriber until it disconnects."""
+        queue = self.subscribe(channels)
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await is_disconnected():
+                        break
+                    yield ": ping\n\n"
+                    continue
+                if message is None:
+                    break
+                yield message
+        finally:
+            self.unsubscribe(queue)
+
+
+broker = EventBroker()
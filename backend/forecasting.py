@@ -0,0 +1,284 @@
+"""
+Demand forecast and restock suggestions for the whole warehouse at once.
+
+Daily demand of the last FORECAST_HISTORY_DAYS is what paid carts took from
+the warehouse: committed (and oversold) stock_reservations summed per
+warehouse product and local day, so assortment components count as well as
+the boxes they go in. It is laid out as one products x days matrix, so every
+product is forecast by the same few NumPy operations:
+
+  - level: exponentially weighted mean of recent ordinary days
+    (half-life FORECAST_HALF_LIFE_DAYS), peak days and days before a
+    product's first sale left out;
+  - peaks: each product's uplift in the run-up to Tết and to Noel over its
+    ordinary days in past years, shrunk toward the shop-wide uplift while it
+    has seen few peak days;
+  - forecast: level x the uplift of each day's season, for the next
+    FORECAST_HORIZON_DAYS days.
+
+The forecast is cached per process until another cart is paid (the latest
+settled_at moves) or the local day changes; the 'analytics.forecast' job
+recomputes it after each sales rollup. Stock is read fresh on every call:
+a product runs out on the first day its cumulative forecast passes its
+available stock, and the suggested restock covers RESTOCK_LEAD_DAYS +
+RESTOCK_COVER_DAYS of demand plus safety stock for the service level
+RESTOCK_Z.
+"""
+import math
+import os
+import threading
+from datetime import date, datetime, time, timedelta
+
+try:
+    import numpy as np
+except ImportError:  # Optional: the forecast endpoint answers 503 without it
+    np = None
+
+from sqlalchemy import select, func
+from db_utils import get_db_session
+from models import StockReservation, WarehouseInventory
+import sales_rollups
+
+HISTORY_DAYS = int(os.getenv("FORECAST_HISTORY_DAYS", "730"))
+HALF_LIFE_DAYS = float(os.getenv("FORECAST_HALF_LIFE_DAYS", "14"))
+LEAD_DAYS = int(os.getenv("RESTOCK_LEAD_DAYS", "3"))
+COVER_DAYS = int(os.getenv("RESTOCK_COVER_DAYS", "14"))
+HORIZON_DAYS = max(int(os.getenv("FORECAST_HORIZON_DAYS", "60")), LEAD_DAYS + COVER_DAYS, 7)
+SERVICE_Z = float(os.getenv("RESTOCK_Z", "1.65"))
+PRIOR_PEAK_DAYS = 7  # Peak days of evidence at which a product's own uplift gets half the weight
+MIN_UPLIFT, MAX_UPLIFT = 0.5, 10.0
+
+DEMAND_STATUSES = ('committed', 'oversold')  # Reservation lines of paid carts
+
+SEASONS = ('normal', 'tet', 'noel')
+NORMAL, TET, NOEL = range(len(SEASONS))
+# First day of the Lunar New Year in Vietnam; extend when the table runs out
+TET_DATES = [
+    date(2020, 1, 25), date(2021, 2, 12), date(2022, 2, 1), date(2023, 1, 22),
+    date(2024, 2, 10), date(2025, 1, 29), date(2026, 2, 17), date(2027, 2, 6),
+    date(2028, 1, 26), date(2029, 2, 13), date(2030, 2, 3), date(2031, 1, 23),
+    date(2032, 2, 11), date(2033, 1, 31), date(2034, 2, 19), date(2035, 2, 8),
+]
+TET_RUNUP_DAYS = 14  # Gift boxes sell in the two weeks before Tết; shops close on the day
+NOEL_FIRST_DAY = 15  # December 15-25
+
+
+def available():
+    return np is not None
+
+
+def season_codes(first_day, days):
+    """SEASONS index of each of `days` consecutive days starting at first_day."""
+    ordinals = first_day.toordinal() + np.arange(days)
+    codes = np.full(days, NORMAL, dtype=np.int8)
+    last_day = first_day + timedelta(days=days)
+    for year in range(first_day.year, last_day.year + 1):
+        noel = date(year, 12, NOEL_FIRST_DAY).toordinal()
+        codes[(ordinals >= noel) & (ordinals <= noel + 25 - NOEL_FIRST_DAY)] = NOEL
+    for tet in TET_DATES:
+        codes[(ordinals >= tet.toordinal() - TET_RUNUP_DAYS) & (ordinals < tet.toordinal())] = TET
+    return codes
+
+
+def _ratio(numerator, denominator):
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator, dtype=float), where=denominator > 0)
+
+def _history(today):
+    """(warehouse product names, products x HISTORY_DAYS units matrix) ending yesterday."""
+    first_day = today - timedelta(days=HISTORY_DAYS)
+    offset = timedelta(hours=sales_rollups.UTC_OFFSET_HOURS)
+    local_day = func.date_trunc('day', StockReservation.settled_at + offset)
+    session = get_db_session('admin')
+    try:
+        rows = session.execute(
+            select(StockReservation.product_name, local_day.label('day'), func.sum(StockReservation.quantity).label('units'))
+            .where(
+                StockReservation.status.in_(DEMAND_STATUSES),
+                StockReservation.settled_at >= datetime.combine(first_day, time()) - offset,
+                StockReservation.settled_at < datetime.combine(today, time()) - offset
+            )
+            .group_by(StockReservation.product_name, local_day)
+        ).all()
+    finally:
+        session.close()
+
+    names = sorted({r.product_name for r in rows})
+    index = {name: i for i, name in enumerate(names)}
+    sales = np.zeros((len(names), HISTORY_DAYS))
+    if rows:
+        sales[
+            np.fromiter((index[r.product_name] for r in rows), dtype=np.int64, count=len(rows)),
+            np.fromiter(((r.day.date() - first_day).days for r in rows), dtype=np.int64, count=len(rows))
+        ] = np.fromiter((r.units for r in rows), dtype=float, count=len(rows))
+    return names, sales
+
+
+def compute(today):
+    """Forecast every product with sales history. Pure NumPy after one query."""
+    names, sales = _history(today)
+    seasons = season_codes(today - timedelta(days=HISTORY_DAYS), HISTORY_DAYS)
+    normal = seasons == NORMAL
+
+    # Days before a product's first sale are not zero demand, just no data
+    sold = sales > 0
+    first_sale = np.where(sold.any(axis=1), sold.argmax(axis=1), HISTORY_DAYS)
+    live = np.arange(HISTORY_DAYS)[None, :] >= first_sale[:, None]
+
+    # Level and spread from recent ordinary days
+    age = np.arange(HISTORY_DAYS)[::-1]
+    weights = (0.5 ** (age / HALF_LIFE_DAYS))[None, :] * (live & normal[None, :])
+    weight_sum = weights.sum(axis=1)
+    level = _ratio((sales * weights).sum(axis=1), weight_sum)
+    sigma = np.sqrt(_ratio((weights * (sales - level[:, None]) ** 2).sum(axis=1), weight_sum))
+
+    # Peak uplift per product, shrunk toward the shop-wide uplift
+    ordinary = live & normal[None, :]
+    ordinary_mean = _ratio((sales * ordinary).sum(axis=1), ordinary.sum(axis=1))
+    shop_ordinary = sales[:, normal].sum(axis=0).mean() if normal.any() else 0.0
+    uplift = np.ones((len(names), len(SEASONS)))
+    for season in (TET, NOEL):
+        in_season = live & (seasons == season)[None, :]
+        peak_days = in_season.sum(axis=1)
+        own = _ratio(_ratio((sales * in_season).sum(axis=1), peak_days), ordinary_mean)
+        shop_peak = sales[:, seasons == season].sum(axis=0)
+        shop = shop_peak.mean() / shop_ordinary if shop_peak.size and shop_ordinary > 0 else 1.0
+        trust = np.where((peak_days > 0) & (ordinary_mean > 0), peak_days / (peak_days + PRIOR_PEAK_DAYS), 0.0)
+        uplift[:, season] = np.clip(trust * own + (1 - trust) * shop, MIN_UPLIFT, MAX_UPLIFT)
+
+    horizon = season_codes(today, HORIZON_DAYS)
+    return {
+        "today": today,
+        "names": names,
+        "index": {name: i for i, name in enumerate(names)},
+        "level": level,
+        "sigma": sigma,
+        "uplift": uplift,
+        "horizon": horizon,
+        "forecast": level[:, None] * uplift[:, horizon],
+        "computed_at": datetime.utcnow()
+    }
+
+
+class ForecastCache:
+    """Last forecast of this process, keyed by (latest paid cart, local day)."""
+
+    def __init__(self):
+        self._key = None
+        self._forecast = None
+        self._lock = threading.Lock()
+
+    def get(self, watermark, today):
+        with self._lock:
+            if self._key != (watermark, today):
+                self._forecast = compute(today)
+                self._key = (watermark, today)
+            return self._forecast
+
+
+forecast_cache = ForecastCache()
+
+
+def _watermark():
+    """settled_at of the latest paid reservation line, None before the first."""
+    session = get_db_session('admin')
+    try:
+        return session.execute(
+            select(func.max(StockReservation.settled_at)).where(StockReservation.status.in_(DEMAND_STATUSES))
+        ).scalar_one_or_none()
+    finally:
+        session.close()
+
+def _stock():
+    session = get_db_session('admin')
+    try:
+        return session.execute(
+            select(WarehouseInventory.product_name, WarehouseInventory.quantity,
+                   WarehouseInventory.reserved_quantity, WarehouseInventory.last_restock)
+            .order_by(WarehouseInventory.product_name)
+        ).all()
+    finally:
+        session.close()
+
+
+def _iso(moment):
+    return moment.isoformat() + "Z" if moment else None
+
+def warm():
+    """Recompute the cached forecast if carts were paid since (the 'analytics.forecast' job)."""
+    watermark = _watermark()
+    forecast_cache.get(watermark, sales_rollups.local_now().date())
+    return _iso(watermark)
+
+
+def restock_plan():
+    """Forecast, projected stock-out and suggested restock for every warehouse product.
+
+    Products are ordered by how soon they run out; ones that last the whole
+    horizon come last, largest suggestion first.
+    """
+    watermark = _watermark()
+    today = sales_rollups.local_now().date()
+    forecast = forecast_cache.get(watermark, today)
+    stock = _stock()
+
+    # Align the forecast rows to the warehouse rows; products never sold forecast zero
+    rows = np.array([forecast["index"].get(r.product_name, -1) for r in stock], dtype=np.int64)
+    known = rows >= 0
+    demand = np.zeros((len(stock), HORIZON_DAYS))
+    demand[known] = forecast["forecast"][rows[known]]
+    sigma = np.zeros(len(stock))
+    sigma[known] = forecast["sigma"][rows[known]]
+    uplift = np.ones((len(stock), len(SEASONS)))
+    uplift[known] = forecast["uplift"][rows[known]]
+
+    on_hand = np.array([r.quantity or 0 for r in stock], dtype=float)
+    reserved = np.array([r.reserved_quantity or 0 for r in stock], dtype=float)
+    free = np.maximum(on_hand - reserved, 0)
+
+    cumulative = np.cumsum(demand, axis=1)
+    stockout_day = np.where(cumulative[:, -1] > free, (cumulative > free[:, None]).argmax(axis=1), -1)
+    # Enough for the delivery lead time plus the cover period, with safety stock
+    # scaled like the demand when that stretch falls in a peak
+    window = max(LEAD_DAYS + COVER_DAYS, 1)
+    covered = cumulative[:, window - 1]
+    peak_scale = uplift[:, forecast["horizon"][:window]].mean(axis=1)
+    needed = covered + SERVICE_Z * sigma * peak_scale * math.sqrt(window)
+    recommended = np.ceil(np.maximum(needed - free, 0)).astype(int)
+
+    def day(offset):
+        return (today + timedelta(days=int(offset))).isoformat()
+
+    products = []
+    for i, r in enumerate(stock):
+        out = int(stockout_day[i])
+        products.append({
+            "product_name": r.product_name,
+            "on_hand": int(on_hand[i]),
+            "reserved": int(reserved[i]),
+            "available": int(free[i]),
+            "daily_demand": round(float(demand[i, 0]), 2),
+            "demand_7d": round(float(cumulative[i, 6]), 1),
+            "demand_cover": round(float(covered[i]), 1),
+            "tet_uplift": round(float(uplift[i, TET]), 2),
+            "noel_uplift": round(float(uplift[i, NOEL]), 2),
+            "stockout_date": day(out) if out >= 0 else None,
+            "restock_by": day(max(out - LEAD_DAYS, 0)) if out >= 0 else None,
+            "recommended_quantity": int(recommended[i]),
+            "last_restock": r.last_restock.isoformat() if r.last_restock else None
+        })
+    products.sort(key=lambda p: (p["stockout_date"] is None, p["stockout_date"] or "", -p["recommended_quantity"]))
+
+    horizon = forecast["horizon"]
+    return {
+        "today": today.isoformat(),
+        "demand_through": _iso(watermark),
+        "computed_at": _iso(forecast["computed_at"]),
+        "horizon_days": HORIZON_DAYS,
+        "lead_days": LEAD_DAYS,
+        "cover_days": COVER_DAYS,
+        "upcoming_peaks": [
+            {"season": SEASONS[season], "starts": day(np.flatnonzero(horizon == season)[0])}
+            for season in (TET, NOEL) if (horizon == season).any()
+        ],
+        "products": products
+    }
@@ -0,0 +1,353 @@
+"""
+Synthetic data generator for load and capacity testing.
+
+Fills member_db, payment_db and admin_db with referentially consistent
+users, workshop registrations, inventory, orders, order details, payments,
+shipping statuses (with their event history), the committed stock
+reservations paid orders leave behind (restock forecast history) and
+customer profiles, at any scale.
+
+- Deterministic: chunk k of an entity is always generated from
+  Random(f"{seed}:{entity}:{k}"), so the same seed gives the same data.
+  Seasonal timestamps take a calendar-dependent number of draws, so they
+  come from a stream of their own (f"{seed}:{entity}.time:{k}") and never
+  shift the other fields; pass the same --start to get the same timestamps.
+- Bulk: every chunk is written with COPY FROM STDIN (see bulk_io.copy_rows).
+- Resumable: progress is kept in a JSON checkpoint. Each chunk first deletes
+  its own id range and then inserts it in one transaction, so re-running a
+  chunk that was interrupted after commit is harmless.
+
+Generated rows use ids starting after the data present at the first run,
+and `lt_`-prefixed usernames / cart ids and `LT ` product names, so they are
+easy to tell apart from seed data.
+
+Usage:
+  python generate_data.py --users 200000 --orders 1000000 --seed 42
+  python generate_data.py --seed 42 --start 2024-01-01 --days 730   # same data on any day
+  python generate_data.py --resume            # continue an interrupted run
+"""
+import argparse
+import json
+import os
+import random
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+from db_utils import get_db_engine
+from bulk_io import copy_rows, sync_id_sequence
+from models import (
+    User, WorkshopRegistration, Order, OrderDetail, Payment,
+    WarehouseInventory, ShippingStatus, ShippingEvent, CustomerProfile, StockReservation
+)
+from passwords import get_password_hash
+from reservations import RESERVATION_TTL_MINUTES
+from tracking import normalize_phone
+
+DEFAULT_CHECKPOINT = "generate_data.checkpoint.json"
+PASSWORD = "password123"
+
+FIRST_NAMES = ["An", "Binh", "Chi", "Dung", "Giang", "Ha", "Hieu", "Hoa", "Huong", "Khanh",
+               "Lan", "Linh", "Mai", "Minh", "Nam", "Ngoc", "Phuong", "Quang", "Thao", "Trang",
+               "Tuan", "Van", "Vy", "Yen"]
+LAST_NAMES = ["Nguyen", "Tran", "Le", "Pham", "Hoang", "Phan", "Vu", "Vo", "Dang", "Bui", "Do", "Ngo"]
+MIDDLE_NAMES = ["Van", "Thi", "Minh", "Thanh", "Ngoc", "Duc", "Hoai", "Gia"]
+STREETS = ["Le Loi", "Nguyen Hue", "Tran Hung Dao", "Hai Ba Trung", "Ly Thuong Kiet",
+           "Pasteur", "Dien Bien Phu", "Cach Mang Thang 8", "Vo Van Tan", "Nam Ky Khoi Nghia"]
+CITIES = ["Ho Chi Minh City", "Ha Noi", "Da Nang", "Can Tho", "Hai Phong", "Nha Trang"]
+FLAVORS = ["Matcha", "Chocolate", "Strawberry", "Mango", "Coconut", "Durian", "Taro", "Pandan",
+           "Tiramisu", "Red Velvet", "Lemon", "Coffee", "Passion Fruit", "Black Sesame"]
+KINDS = ["Mousse", "Cheesecake", "Roll", "Tart", "Sponge Cake", "Mochi", "Cupcake", "Gift Box"]
+COURSES = ["Basic Baking", "French Pastry", "Cake Decorating", "Mooncake Workshop", "Bread Making"]
+PAYMENT_METHODS = ["credit_card", "cash", "bank_transfer"]
+SHIPPING_STATUSES = ["Pending", "Shipped", "Delivered", "Cancelled"]
+
+# Relative order volume per month (Jan..Dec): Tet around Jan/Feb, Mid-Autumn, Christmas
+MONTH_WEIGHTS = [1.8, 1.6, 0.9, 0.8, 0.8, 0.9, 0.9, 1.0, 1.3, 1.0, 1.1, 1.7]
+
+
+def _rng(seed, entity, chunk):
+    return random.Random(f"{seed}:{entity}:{chunk}")
+
+
+def product_name(index):
+    """Deterministic unique name for generated product #index."""
+    flavor = FLAVORS[index % len(FLAVORS)]
+    kind = KINDS[(index // len(FLAVORS)) % len(KINDS)]
+    return f"LT {flavor} {kind} #{index}"
+
+def cart_id(order_id):
+    """Cart id of a generated order; zero-padded so an order id range is a cart id range."""
+    return f"lt_order_{order_id:012d}"
+
+def product_price(seed, index):
+    return round(random.Random(f"{seed}:price:{index}").uniform(5.0, 60.0), 2)
+
+def _seasonal_datetime(rng, start, days):
+    """Random timestamp in [start, start+days), weighted by MONTH_WEIGHTS."""
+    top = max(MONTH_WEIGHTS)
+    while True:
+        moment = start + timedelta(seconds=rng.randrange(days * 86400))
+        if rng.random() * top < MONTH_WEIGHTS[moment.month - 1]:
+            return moment
+
+
+class Generator:
+    def __init__(self, state):
+        self.state = state
+        self.params = state["params"]
+        self.seed = self.params["seed"]
+        self.offsets = state["offsets"]
+        self.start = datetime.fromisoformat(self.params["start"])
+        self.password_hash = state["password_hash"]
+
+    # Users are skewed towards low ids so some customers order far more than others
+    def _pick_user(self, rng):
+        return self.offsets["users"] + int(self.params["users"] * rng.random() ** 2)
+
+    def _user_fields(self, user_index):
+        rng = _rng(self.seed, "user", user_index)
+        first, middle, last = rng.choice(FIRST_NAMES), rng.choice(MIDDLE_NAMES), rng.choice(LAST_NAMES)
+        return {
+            "full_name": f"{last} {middle} {first}",
+            "phone_number": "09" + "".join(str(rng.randrange(10)) for _ in range(8)),
+            "address": f"{rng.randint(1, 999)} {rng.choice(STREETS)}, {rng.choice(CITIES)}",
+        }
+
+    def users(self, chunk, lo, hi):
+        rng = _rng(self.seed, "users", chunk)
+        users, profiles = [], []
+        for i in range(lo, hi):
+            user_id = self.offsets["users"] + i
+            fields = self._user_fields(i)
+            created_at = self.start + timedelta(seconds=rng.randrange(self.params["days"] * 86400))
+            users.append({
+                "id": user_id,
+                "username": f"lt_user_{user_id}",
+                "password_hash": self.password_hash,
+                "email": f"lt_user_{user_id}@example.test",
+                **fields,
+                "status": "Active" if rng.random() > 0.02 else "Inactive",
+                "created_at": created_at,
+            })
+            profiles.append({
+                "user_id": user_id,
+                "full_name": fields["full_name"],
+                "email": f"lt_user_{user_id}@example.test",
+                "vip_level": rng.choice(["New", "New", "Bronze", "Silver", "Gold"]),
+                "status": "Active",
+                "total_spend": round(rng.uniform(0, 2000), 2),
+                "created_at": created_at,
+            })
+        first, last = self.offsets["users"] + lo, self.offsets["users"] + hi - 1
+        return [
+            ("member", User, users, f"id BETWEEN {first} AND {last}"),
+            ("admin", CustomerProfile, profiles, f"user_id BETWEEN {first} AND {last}"),
+        ]
+
+    def products(self, chunk, lo, hi):
+        rng = _rng(self.seed, "products", chunk)
+        rows = [{
+            "id": self.offsets["products"] + i,
+            "product_name": product_name(i),
+            "quantity": rng.randint(50, 5000),
+            "reserved_quantity": 0,
+            "last_restock": self.start + timedelta(days=rng.randrange(self.params["days"])),
+        } for i in range(lo, hi)]
+        first, last = self.offsets["products"] + lo, self.offsets["products"] + hi - 1
+        return [("admin", WarehouseInventory, rows, f"id BETWEEN {first} AND {last}")]
+
+    def workshops(self, chunk, lo, hi):
+        rng = _rng(self.seed, "workshops", chunk)
+        clock = _rng(self.seed, "workshops.time", chunk)
+        rows = []
+        for i in range(lo, hi):
+            row = {
+                "id": self.offsets["workshops"] + i,
+                "user_id": None, "guest_name": None, "guest_phone": None, "guest_email": None,
+                "course_name": rng.choice(COURSES),
+                "created_at": _seasonal_datetime(clock, self.start, self.params["days"]),
+            }
+            if rng.random() < 0.7:
+                row["user_id"] = self._pick_user(rng)
+            else:
+                fields = self._user_fields(-1 - i)  # Guests get their own deterministic identity
+                row.update(guest_name=fields["full_name"], guest_phone=fields["phone_number"],
+                           guest_email=f"guest_{row['id']}@example.test")
+            rows.append(row)
+        first, last = self.offsets["workshops"] + lo, self.offsets["workshops"] + hi - 1
+        return [("member", WorkshopRegistration, rows, f"id BETWEEN {first} AND {last}")]
+
+    def orders(self, chunk, lo, hi):
+        rng = _rng(self.seed, "orders", chunk)
+        clock = _rng(self.seed, "orders.time", chunk)
+        n_products = self.params["products"]
+        orders, details, payments, shipping, events, reservations = [], [], [], [], [], []
+        for i in range(lo, hi):
+            order_id = self.offsets["orders"] + i
+            user_index = self._pick_user(rng) - self.offsets["users"]
+            created_at = _seasonal_datetime(clock, self.start, self.params["days"])
+
+            total = 0.0
+            lines = []
+            # Popular products dominate, like real sales
+            for p in {int(n_products * rng.random() ** 3) for _ in range(rng.choice([1, 1, 2, 2, 3, 4]))}:
+                qty = rng.choice([1, 1, 1, 2, 2, 3])
+                unit_price = product_price(self.seed, p)
+                subtotal = round(qty * unit_price, 2)
+                total += subtotal
+                lines.append((product_name(p), qty))
+                details.append({"order_id": order_id, "product_name": product_name(p),
+                                 "quantity": qty, "unit_price": unit_price, "subtotal": subtotal})
+            total = round(total, 2)
+
+            status = "completed" if rng.random() > 0.05 else rng.choice(["pending", "failed"])
+            orders.append({
+                "id": order_id,
+                "user_id": self.offsets["users"] + user_index,
+                "total_amount": total,
+                "status": status,
+                "payment_method": rng.choice(PAYMENT_METHODS),
+                "idempotency_key": None,
+                "created_at": created_at,
+            })
+            payments.append({"order_id": order_id, "user_id": self.offsets["users"] + user_index,
+                             "amount": total, "status": status, "timestamp": created_at})
+            if status == "completed":
+                fields = self._user_fields(user_index)
+                shipping_status = rng.choice(SHIPPING_STATUSES)
+                updated_at = created_at + timedelta(hours=rng.randint(1, 96))
+                shipping.append({
+                    "order_id": order_id,
+                    "customer_name": fields["full_name"],
+                    "phone_number": fields["phone_number"],
+                    "phone_key": normalize_phone(fields["phone_number"]),
+                    "status": shipping_status,
+                    "updated_at": updated_at,
+                })
+                events.append({"order_id": order_id, "status": "Pending", "note": "Order placed", "created_at": created_at})
+                # The holds placed during checkout, committed by the payment
+                for name, qty in lines:
+                    reservations.append({
+                        "cart_id": cart_id(order_id), "product_name": name, "quantity": qty, "status": "committed",
+                        "expires_at": created_at + timedelta(minutes=RESERVATION_TTL_MINUTES),
+                        "created_at": created_at, "settled_at": created_at,
+                    })
+                if shipping_status != "Pending":
+                    events.append({"order_id": order_id, "status": shipping_status, "note": None, "created_at": updated_at})
+        first, last = self.offsets["orders"] + lo, self.offsets["orders"] + hi - 1
+        in_range = f"order_id BETWEEN {first} AND {last}"
+        # Children first on delete, parents first on insert (see _write_chunk)
+        return [
+            ("payment", Order, orders, f"id BETWEEN {first} AND {last}"),
+            ("payment", OrderDetail, details, in_range),
+            ("payment", Payment, payments, in_range),
+            ("admin", ShippingStatus, shipping, in_range),
+            ("admin", ShippingEvent, events, in_range),
+            ("admin", StockReservation, reservations, f"cart_id BETWEEN '{cart_id(first)}' AND '{cart_id(last)}'"),
+        ]
+
+
+# entity -> (count parameter, offset table)
+ENTITIES = {
+    "users": ("users", User),
+    "products": ("products", WarehouseInventory),
+    "workshops": ("workshops", WorkshopRegistration),
+    "orders": ("orders", Order),
+}
+
+
+def _write_chunk(batches):
+    """Replace each batch's id range with the generated rows, one transaction per database."""
+    for db_name in dict.fromkeys(db for db, _, _, _ in batches):
+        mine = [b for b in batches if b[0] == db_name]
+        with get_db_engine(db_name).begin() as conn:
+            for _, model, _, where in reversed(mine):
+                conn.execute(text(f"DELETE FROM {model.__tablename__} WHERE {where}"))
+            for _, model, rows, _ in mine:
+                copy_rows(conn, model.__table__, rows)
+
+
+def _next_id(model):
+    db_name = {User: "member", WorkshopRegistration: "member", Order: "payment"}.get(model, "admin")
+    with get_db_engine(db_name).connect() as conn:
+        return conn.execute(text(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {model.__tablename__}")).scalar_one()
+
+
+def _save(state, path):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+
+def run(params, checkpoint_path, resume=False):
+    if resume:
+        with open(checkpoint_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        print(f"Resuming from {checkpoint_path}: {state['progress']}")
+    else:
+        state = {
+            "params": params,
+            "offsets": {name: _next_id(model) for name, (_, model) in ENTITIES.items()},
+            "progress": {name: 0 for name in ENTITIES},
+            # One hash shared by all generated users; bcrypt per row would dominate the run
+            "password_hash": get_password_hash(PASSWORD),
+        }
+        _save(state, checkpoint_path)
+        print(f"Id offsets: {state['offsets']}")
+
+    gen = Generator(state)
+    chunk_size = state["params"]["chunk_size"]
+    for entity, (count_param, _) in ENTITIES.items():
+        total = state["params"][count_param]
+        done = state["progress"][entity]
+        while done < total:
+            chunk = done // chunk_size
+            hi = min(done + chunk_size, total)
+            _write_chunk(getattr(gen, entity)(chunk, done, hi))
+            done = hi
+            state["progress"][entity] = done
+            _save(state, checkpoint_path)
+            print(f"  {entity}: {done}/{total}")
+
+    # Explicit ids were inserted; move every touched sequence past them
+    for db_name, models in (("member", [User, WorkshopRegistration]),
+                            ("payment", [Order, OrderDetail, Payment]),
+                            ("admin", [WarehouseInventory, ShippingStatus, ShippingEvent, CustomerProfile])):
+        with get_db_engine(db_name).begin() as conn:
+            for model in models:
+                sync_id_sequence(conn, model.__table__)
+    print(f"Generation complete. Log in as lt_user_{state['offsets']['users']} / {PASSWORD}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate large synthetic datasets for load testing")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--workshops", type=int, default=2000)
+    parser.add_argument("--orders", type=int, default=50000)
+    parser.add_argument("--days", type=int, default=730, help="History length")
+    parser.add_argument("--start", type=datetime.fromisoformat, default=None,
+                        help="First day of the history (YYYY-MM-DD); default --days before today")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT)
+    parser.add_argument("--resume", action="store_true", help="Continue the run recorded in --checkpoint")
+    args = parser.parse_args()
+
+    if args.orders and args.products < 1:
+        parser.error("--orders needs at least one product")
+    if not args.resume and os.path.exists(args.checkpoint):
+        parser.error(f"{args.checkpoint} exists; pass --resume to continue it or delete it to start over")
+
+    start = args.start or datetime.utcnow() - timedelta(days=args.days)
+    start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    params = {
+        "users": args.users, "products": args.products, "workshops": args.workshops,
+        "orders": args.orders, "days": args.days, "seed": args.seed,
+        "chunk_size": args.chunk_size, "start": start.isoformat(),
+    }
+    run(params, args.checkpoint, resume=args.resume)
+
+if __name__ == "__main__":
+    main()
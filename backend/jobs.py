@@ -0,0 +1,410 @@
+"""
+Background job queue for slow work that should not hold up a request.
+
+Handlers are registered per kind, each with its own concurrency limit and
+retry policy:
+
+    @job('design.generate', concurrency=2, timeout=90)
+    async def generate_design(payload): ...
+
+    job_id = await queue.enqueue('design.generate', {...}, key=digest)
+    await queue.status(job_id)  # {"status": "pending" | "running" | "done" | "failed", ...}
+
+Handlers may be coroutines or plain functions (run in a worker thread); they
+get the JSON payload and return a JSON-serializable result. A failing job is
+retried with exponential backoff up to max_attempts, so handlers must be safe
+to repeat; raise PermanentJobError to fail at once. A `key` collapses
+duplicate requests into the job already pending or running for that key.
+
+Kinds registered with local=True act on state of the process that queued
+them (its analytics buffer, SSE clients, RAG index, caches); they always
+use an in-process queue, whatever the backend, so no other worker can
+claim them.
+
+Backends (JOBS_BACKEND):
+  - memory (default): jobs live in this process and are lost on restart.
+  - postgres: rows in payment_db.background_jobs claimed with
+    FOR UPDATE SKIP LOCKED, so all worker processes share one queue and
+    pending jobs survive restarts. A claim older than JOBS_LEASE_SECONDS
+    (worker died mid-job) is handed out again, or failed once it has used
+    all its attempts; a worker that finishes after losing its lease has its
+    result dropped. A partial unique index on dedupe_key keeps one
+    pending/running job per key even across processes.
+"""
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, update, delete, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from db_utils import get_db_session
+from models import BackgroundJob
+
+JOBS_BACKEND = os.getenv("JOBS_BACKEND", "memory").strip().lower()
+POLL_INTERVAL_SECONDS = float(os.getenv("JOBS_POLL_SECONDS", "1"))
+DEFAULT_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "5"))
+LEASE_SECONDS = int(os.getenv("JOBS_LEASE_SECONDS", "300"))
+RETENTION_SECONDS = int(os.getenv("JOBS_RETENTION_HOURS", "24")) * 3600
+MAINTENANCE_INTERVAL_SECONDS = 60
+MAX_BACKOFF_SECONDS = 300
+
+logger = logging.getLogger("jobs")
+
+HANDLERS = {}
+# Matches the partial unique index on background_jobs.dedupe_key
+ACTIVE_KEY_WHERE = text("status IN ('pending', 'running')")
+
+
+class PermanentJobError(Exception):
+    """Raised by a handler when retrying cannot help (e.g. a rejected request)."""
+
+
+def job(kind, concurrency=1, max_attempts=DEFAULT_MAX_ATTEMPTS, timeout=None, local=False):
+    """Register the handler for a job kind; local=True keeps its jobs in this process."""
+    def register(func):
+        HANDLERS[kind] = {
+            "func": func, "concurrency": concurrency, "max_attempts": max_attempts,
+            "timeout": timeout, "local": local
+        }
+        return func
+    return register
+
+
+def _public(row):
+    """Status view of a job, shared by both backends."""
+    return {
+        "id": row["id"],
+        "kind": row["kind"],
+        "status": row["status"],
+        "attempts": row["attempts"],
+        "result": row["result"],
+        "error": row["error"],
+        "created_at": row["created_at"].isoformat(),
+        "finished_at": row["finished_at"].isoformat() if row["finished_at"] else None
+    }
+
+
+class MemoryBackend:
+    """Jobs kept in this process, in insertion order."""
+
+    def __init__(self):
+        self._jobs = OrderedDict()  # id -> job dict
+        self._active_keys = {}      # dedupe key -> id of its pending/running job
+        self._ready = {}            # kind -> heap of (available_at, seq, id) for its pending jobs
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def _push(self, row):
+        heapq.heappush(self._ready.setdefault(row["kind"], []), (row["available_at"], next(self._seq), row["id"]))
+
+    def add(self, kind, payload, key, max_attempts, delay_seconds):
+        now = datetime.utcnow()
+        with self._lock:
+            if key and key in self._active_keys:
+                return self._active_keys[key]
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                "id": job_id, "kind": kind, "payload": payload, "key": key, "status": "pending",
+                "attempts": 0, "max_attempts": max_attempts, "result": None, "error": None,
+                "available_at": now + timedelta(seconds=delay_seconds), "created_at": now, "finished_at": None
+            }
+            if key:
+                self._active_keys[key] = job_id
+            self._push(self._jobs[job_id])
+            return job_id
+
+    def claim(self, free):
+        """Mark up to free[kind] due jobs of each kind running and return them."""
+        now = datetime.utcnow()
+        claimed = []
+        with self._lock:
+            for kind, slots in free.items():
+                heap = self._ready.get(kind)
+                while heap and slots > 0 and heap[0][0] <= now:
+                    _, _, job_id = heapq.heappop(heap)
+                    row = self._jobs.get(job_id)
+                    if row is None or row["status"] != "pending":
+                        continue
+                    slots -= 1
+                    row["status"] = "running"
+                    row["attempts"] += 1
+                    claimed.append(dict(row))
+        return claimed
+
+    def finish(self, job_id, result, error, retry_at):
+        with self._lock:
+            row = self._jobs.get(job_id)
+            if row is None:
+                return
+            row["error"] = error
+            if error and retry_at:
+                row["status"] = "pending"
+                row["available_at"] = retry_at
+                self._push(row)
+                return
+            row["status"] = "failed" if error else "done"
+            row["result"] = result
+            row["finished_at"] = datetime.utcnow()
+            if row["key"] and self._active_keys.get(row["key"]) == job_id:
+                del self._active_keys[row["key"]]
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._jobs.get(job_id)
+            return _public(row) if row else None
+
+    def maintain(self):
+        """Forget finished jobs past the retention period."""
+        cutoff = datetime.utcnow() - timedelta(seconds=RETENTION_SECONDS)
+        with self._lock:
+            expired = [job_id for job_id, row in self._jobs.items() if row["finished_at"] and row["finished_at"] < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+
+class PostgresBackend:
+    """Jobs in payment_db.background_jobs, shared by every worker process."""
+
+    def __init__(self):
+        self.worker_id = uuid.uuid4().hex  # Recorded on claims so a lost lease can be detected
+
+    def add(self, kind, payload, key, max_attempts, delay_seconds):
+        now = datetime.utcnow()
+        session = get_db_session('payment')
+        try:
+            # The partial unique index decides between concurrent adds; retried in
+            # case the job holding the key finishes between the insert and the lookup
+            for _ in range(3):
+                job_id = session.execute(
+                    pg_insert(BackgroundJob).values(
+                        id=uuid.uuid4().hex, kind=kind, payload=json.dumps(payload, default=str), dedupe_key=key,
+                        status='pending', attempts=0, max_attempts=max_attempts,
+                        available_at=now + timedelta(seconds=delay_seconds), created_at=now
+                    ).on_conflict_do_nothing(
+                        index_elements=[BackgroundJob.dedupe_key], index_where=ACTIVE_KEY_WHERE
+                    ).returning(BackgroundJob.id)
+                ).scalar_one_or_none()
+                if job_id is None:
+                    job_id = session.execute(
+                        select(BackgroundJob.id)
+                        .where(BackgroundJob.dedupe_key == key, BackgroundJob.status.in_(('pending', 'running')))
+                        .limit(1)
+                    ).scalar_one_or_none()
+                if job_id is not None:
+                    session.commit()
+                    return job_id
+            raise RuntimeError(f"Could not queue {kind} job for key {key}")
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def claim(self, free):
+        """Lock up to free[kind] due jobs per kind (SKIP LOCKED), mark them running and return them."""
+        now = datetime.utcnow()
+        session = get_db_session('payment')
+        try:
+            rows = []
+            for kind, slots in free.items():
+                rows += session.execute(
+                    select(BackgroundJob)
+                    .where(BackgroundJob.status == 'pending', BackgroundJob.kind == kind, BackgroundJob.available_at <= now)
+                    .order_by(BackgroundJob.available_at)
+                    .limit(slots)
+                    .with_for_update(skip_locked=True)
+                ).scalars().all()
+            claimed = []
+            for row in rows:
+                row.status = 'running'
+                row.attempts = (row.attempts or 0) + 1
+                row.locked_at = now
+                row.locked_by = self.worker_id
+                claimed.append({
+                    "id": row.id, "kind": row.kind, "payload": json.loads(row.payload),
+                    "attempts": row.attempts, "max_attempts": row.max_attempts or DEFAULT_MAX_ATTEMPTS
+                })
+            session.commit()
+            return claimed
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def finish(self, job_id, result, error, retry_at):
+        """Record the outcome, unless the lease expired and the job was requeued or failed meanwhile."""
+        values = {"last_error": error[:1000] if error else None, "locked_at": None, "locked_by": None}
+        if error and retry_at:
+            values.update(status='pending', available_at=retry_at)
+        else:
+            values.update(
+                status='failed' if error else 'done',
+                result=json.dumps(result, default=str) if result is not None else None,
+                finished_at=datetime.utcnow()
+            )
+        session = get_db_session('payment')
+        try:
+            updated = session.execute(
+                update(BackgroundJob)
+                .where(BackgroundJob.id == job_id, BackgroundJob.status == 'running',
+                       BackgroundJob.locked_by == self.worker_id)
+                .values(**values)
+            ).rowcount
+            session.commit()
+            if not updated:
+                logger.warning("Job %s lease lost before it finished; result dropped", job_id)
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def get(self, job_id):
+        session = get_db_session('payment')
+        try:
+            row = session.get(BackgroundJob, job_id)
+            if row is None:
+                return None
+            return _public({
+                "id": row.id, "kind": row.kind, "status": row.status, "attempts": row.attempts or 0,
+                "result": json.loads(row.result) if row.result else None, "error": row.last_error,
+                "created_at": row.created_at, "finished_at": row.finished_at
+            })
+        finally:
+            session.close()
+
+    def maintain(self):
+        """Requeue or fail claims whose worker died and delete finished jobs past the retention period."""
+        now = datetime.utcnow()
+        expired = (BackgroundJob.status == 'running', BackgroundJob.locked_at < now - timedelta(seconds=LEASE_SECONDS))
+        session = get_db_session('payment')
+        try:
+            session.execute(
+                update(BackgroundJob)
+                .where(*expired, BackgroundJob.attempts >= BackgroundJob.max_attempts)
+                .values(status='failed', locked_at=None, locked_by=None, finished_at=now,
+                        last_error=f"Lease expired after {LEASE_SECONDS}s on the last attempt")
+            )
+            session.execute(
+                update(BackgroundJob)
+                .where(*expired)
+                .values(status='pending', locked_at=None, locked_by=None, available_at=now)
+            )
+            session.execute(
+                delete(BackgroundJob)
+                .where(BackgroundJob.status.in_(('done', 'failed')),
+                       BackgroundJob.finished_at < now - timedelta(seconds=RETENTION_SECONDS))
+            )
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+
+class JobQueue:
+    def __init__(self, backend):
+        self.backend = backend
+        # Process-local kinds; the same object as `backend` with the memory backend
+        self.local_backend = backend if isinstance(backend, MemoryBackend) else MemoryBackend()
+        self._running = {}  # kind -> jobs executing in this process
+        self._tasks = set()
+        self._wakeup = None
+        self._maintained_at = 0.0
+
+    async def enqueue(self, kind, payload=None, key=None, delay_seconds=0):
+        """Queue a job and return its id (the existing job's id if `key` is already queued)."""
+        spec = HANDLERS[kind]
+        job_id = await asyncio.to_thread(
+            self._backend(kind).add, kind, payload or {}, key, spec["max_attempts"], delay_seconds
+        )
+        self.notify()
+        return job_id
+
+    async def status(self, job_id):
+        status = self.local_backend.get(job_id)
+        if status is None and self.backend is not self.local_backend:
+            status = await asyncio.to_thread(self.backend.get, job_id)
+        return status
+
+    def _backend(self, kind):
+        return self.local_backend if HANDLERS[kind]["local"] else self.backend
+
+    def _backends(self):
+        return (self.backend,) if self.backend is self.local_backend else (self.local_backend, self.backend)
+
+    def notify(self):
+        """Dispatch now instead of waiting for the next poll."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        while True:
+            try:
+                await self._dispatch()
+            except Exception as e:
+                logger.error("Job queue error: %s", e)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=POLL_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _dispatch(self):
+        if time.monotonic() - self._maintained_at > MAINTENANCE_INTERVAL_SECONDS:
+            self._maintained_at = time.monotonic()
+            for backend in self._backends():
+                await asyncio.to_thread(backend.maintain)
+
+        free = {kind: spec["concurrency"] - self._running.get(kind, 0) for kind, spec in HANDLERS.items()}
+        free = {kind: slots for kind, slots in free.items() if slots > 0}
+        for backend in self._backends():
+            wanted = {kind: slots for kind, slots in free.items() if self._backend(kind) is backend}
+            if not wanted:
+                continue
+            for claimed in await asyncio.to_thread(backend.claim, wanted):
+                self._running[claimed["kind"]] = self._running.get(claimed["kind"], 0) + 1
+                task = asyncio.create_task(self._execute(claimed))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, claimed):
+        kind = claimed["kind"]
+        spec = HANDLERS[kind]
+        result, error, retry_at, permanent = None, None, None, False
+        try:
+            if asyncio.iscoroutinefunction(spec["func"]):
+                work = spec["func"](claimed["payload"])
+            else:
+                work = asyncio.to_thread(spec["func"], claimed["payload"])
+            try:
+                result = await asyncio.wait_for(work, timeout=spec["timeout"])
+            except PermanentJobError as e:
+                error, permanent = str(e) or e.__class__.__name__, True
+            except asyncio.TimeoutError:
+                error = f"Timed out after {spec['timeout']}s"
+            except Exception as e:
+                error = str(e) or e.__class__.__name__
+
+            if error and not permanent and claimed["attempts"] < claimed["max_attempts"]:
+                retry_at = datetime.utcnow() + timedelta(seconds=min(2 ** claimed["attempts"], MAX_BACKOFF_SECONDS))
+            if error:
+                logger.warning("Job %s (%s) failed, attempt %s: %s", claimed["id"], kind, claimed["attempts"], error)
+            await asyncio.to_thread(self._backend(kind).finish, claimed["id"], result, error, retry_at)
+        finally:
+            self._running[kind] -= 1
+            self.notify()
+
+
+queue = JobQueue(PostgresBackend() if JOBS_BACKEND == 'postgres' else MemoryBackend())
@@ -0,0 +1,383 @@
+"""
+HTTP load test and latency benchmark for the backend API.
+
+Drives /register, /login, /api/cart/items + /payment, /api/inventory/check,
+/admin/*, /chat and /api/generate-design with a weighted mix at a fixed concurrency, then
+reports throughput and p50/p95/p99 latency per endpoint. Results can be
+saved as a JSON baseline and later runs compared against it.
+
+Run against a local PostgreSQL with the external providers stubbed:
+
+  # terminal 1: fake image provider
+  python loadtest.py stub-image --port 8089
+  # terminal 2: backend with a stubbed LLM
+  LLM_STUB=1 DESIGN_API_URL=http://127.0.0.1:8089/prompt/ uvicorn app:app --port 8000
+  # terminal 3
+  python loadtest.py run --concurrency 32 --duration 60 --out baseline.json
+  python loadtest.py run --concurrency 32 --duration 60 --compare baseline.json
+
+Use generate_data.py first for realistic table sizes, and seed_prices.py so
+checkout has a product to put in the cart.
+"""
+import argparse
+import base64
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+DEFAULT_MIX = {
+    "inventory_check": 30,
+    "inventory_snapshot": 15,
+    "login": 10,
+    "payment": 10,
+    "admin_customers": 5,
+    "admin_shipping": 5,
+    "admin_warehouse": 5,
+    "register": 5,
+    "chat": 3,
+    "generate_design": 2,
+}
+PASSWORD = "loadtest-password"
+CART_SKU = "cupcake-box-001"  # PRODUCT.id in js/product.js, priced by seed_prices.py
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+class Recorder:
+    """Thread-safe per-endpoint latency samples and error counts."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, name, seconds, ok):
+        with self._lock:
+            self.latencies.setdefault(name, []).append(seconds)
+            if not ok:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def summary(self, elapsed):
+        endpoints = {}
+        for name, samples in sorted(self.latencies.items()):
+            samples = sorted(samples)
+            ms = lambda v: round(v * 1000, 2)
+            endpoints[name] = {
+                "requests": len(samples),
+                "errors": self.errors.get(name, 0),
+                "rps": round(len(samples) / elapsed, 2),
+                "mean_ms": ms(sum(samples) / len(samples)),
+                "p50_ms": ms(percentile(samples, 50)),
+                "p95_ms": ms(percentile(samples, 95)),
+                "p99_ms": ms(percentile(samples, 99)),
+                "max_ms": ms(samples[-1]),
+            }
+        total = sum(e["requests"] for e in endpoints.values())
+        return {
+            "total_requests": total,
+            "total_errors": sum(e["errors"] for e in endpoints.values()),
+            "rps": round(total / elapsed, 2),
+            "endpoints": endpoints,
+        }
+
+
+class Client:
+    """One virtual user: its own connection pool, account and session token."""
+
+    def __init__(self, base_url, recorder, products, timeout):
+        self.base_url = base_url.rstrip("/")
+        self.recorder = recorder
+        self.products = products
+        self.timeout = timeout
+        self.http = requests.Session()
+        self.username = None
+        self.token = None
+        self.rng = random.Random()
+
+    def call(self, name, method, path, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.http.request(method, self.base_url + path, timeout=self.timeout, **kwargs)
+            ok = response.status_code < 400
+        except requests.RequestException:
+            response, ok = None, False
+        self.recorder.record(name, time.perf_counter() - started, ok)
+        return response if ok else None
+
+    def register(self):
+        username = f"lt_{uuid.uuid4().hex[:12]}"
+        response = self.call("register", "POST", "/register", json={
+            "username": username, "password": PASSWORD,
+            "email": f"{username}@example.test", "full_name": "Load Test",
+        })
+        if response is not None:
+            self.username = username
+        return response
+
+    def login(self):
+        if not self.username:
+            return self.register()
+        response = self.call("login", "POST", "/login", json={"username": self.username, "password": PASSWORD})
+        if response is not None:
+            self.token = response.json().get("token")
+        return response
+
+    def payment(self):
+        if not self.token:
+            return self.login()
+        # Checkout charges the server cart only, so the lines go there first
+        headers = {"Authorization": f"Bearer {self.token}"}
+        cart_id, lines = None, []
+        for name in self.rng.sample(self.products, k=min(len(self.products), self.rng.randint(1, 3))):
+            response = self.call("cart_add", "POST", "/api/cart/items", headers=headers, json={
+                "cart_id": cart_id, "sku": CART_SKU, "quantity": self.rng.randint(1, 3), "label": name,
+            })
+            if response is None:
+                return None
+            result = response.json()
+            cart_id = result["cart_id"]
+            lines.append(result["item"])
+        amount = round(sum(line["subtotal"] for line in lines) + 8.99, 2)
+        return self.call("payment", "POST", "/payment",
+                         json={"amount": amount, "status": "completed", "cart_id": cart_id,
+                               "line_ids": [line["id"] for line in lines],
+                               "order_info": json.dumps({"checkout": {"paymentMethod": "card"}})},
+                         headers={**headers, "Idempotency-Key": uuid.uuid4().hex})
+
+    def inventory_check(self):
+        names = self.rng.sample(self.products, k=min(len(self.products), self.rng.randint(1, 8)))
+        return self.call("inventory_check", "POST", "/api/inventory/check", json={"product_names": names})
+
+    def inventory_snapshot(self):
+        return self.call("inventory_snapshot", "GET", "/api/inventory")
+
+    def admin_customers(self):
+        return self.call("admin_customers", "GET", "/admin/customers")
+
+    def admin_shipping(self):
+        return self.call("admin_shipping", "GET", "/admin/shipping")
+
+    def admin_warehouse(self):
+        return self.call("admin_warehouse", "GET", "/admin/warehouse")
+
+    def chat(self):
+        return self.call("chat", "POST", "/chat", json={"message": "Which cake would you recommend for a birthday?"})
+
+    def generate_design(self):
+        return self.call("generate_design", "POST", "/api/generate-design",
+                         json={"box_name": "Gift Box", "items": self.rng.sample(self.products, k=min(2, len(self.products)))})
+
+
+def _fetch_products(base_url, timeout):
+    response = requests.get(f"{base_url.rstrip('/')}/api/inventory", timeout=timeout)
+    response.raise_for_status()
+    names = list(response.json())
+    if not names:
+        raise SystemExit("No products in inventory; run seed_inventory.py or generate_data.py first.")
+    return names
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_load(base_url, concurrency, duration, warmup, mix, timeout, seed):
+    products = _fetch_products(base_url, timeout)
+    names, weights = zip(*mix.items())
+
+    recorder = Recorder()
+    clients = [Client(base_url, recorder, products, timeout) for _ in range(concurrency)]
+    # Every virtual user starts with an account and a session, outside the measured window
+    for client in clients:
+        client.register()
+        client.login()
+
+    measured = Recorder()
+    stop_at = time.perf_counter() + warmup + duration
+    measure_from = time.perf_counter() + warmup
+
+    def worker(client, worker_seed):
+        rng = client.rng = random.Random(worker_seed)
+        while True:
+            now = time.perf_counter()
+            if now >= stop_at:
+                return
+            client.recorder = measured if now >= measure_from else recorder
+            getattr(client, rng.choices(names, weights)[0])()
+
+    threads = [threading.Thread(target=worker, args=(c, seed * 1000 + i), daemon=True) for i, c in enumerate(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    result = measured.summary(duration)
+    result["config"] = {
+        "base_url": base_url, "concurrency": concurrency, "duration_s": duration,
+        "warmup_s": warmup, "mix": mix, "seed": seed, "products": len(products),
+    }
+    result["git_commit"] = _git_commit()
+    result["recorded_at"] = datetime.utcnow().isoformat() + "Z"
+    return result
+
+
+def print_report(result, baseline=None):
+    header = f"{'endpoint':<20}{'reqs':>8}{'err':>6}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}"
+    if baseline:
+        header += f"{'p95 vs base':>14}"
+    print(header)
+    print("-" * len(header))
+    for name, e in result["endpoints"].items():
+        line = (f"{name:<20}{e['requests']:>8}{e['errors']:>6}{e['rps']:>9.1f}"
+                f"{e['p50_ms']:>9.1f}{e['p95_ms']:>9.1f}{e['p99_ms']:>9.1f}")
+        base = (baseline or {}).get("endpoints", {}).get(name)
+        if base:
+            line += f"{(e['p95_ms'] / base['p95_ms'] - 1) * 100:>+13.1f}%"
+        print(line)
+    print(f"\nTotal: {result['total_requests']} requests, {result['total_errors']} errors, {result['rps']} req/s")
+
+
+def regressions(result, baseline, max_regression, min_ms=5.0):
+    """Endpoints whose p95/p99 got worse than the baseline by more than max_regression."""
+    found = []
+    for name, base in baseline.get("endpoints", {}).items():
+        current = result["endpoints"].get(name)
+        if not current:
+            continue
+        for key in ("p95_ms", "p99_ms"):
+            # Ignore jitter on very fast endpoints
+            if current[key] > max(base[key], min_ms) * (1 + max_regression):
+                found.append(f"{name} {key}: {base[key]} -> {current[key]}")
+        if current["errors"] > base["errors"] and current["errors"] / current["requests"] > 0.01:
+            found.append(f"{name} errors: {base['errors']} -> {current['errors']}")
+    return found
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown scenario '{name}'; choose from {', '.join(DEFAULT_MIX)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+# 64x64 single-colour baseline JPEG
+STUB_JPEG = base64.b64decode(
+    "/9j/4AAQSkZJRgABAQAAAQABAAD/2wBDABALDA4MChAODQ4SERATGCgaGBYWGDEjJR0oOjM9PDkzODdASFxOQERXRTc4UG1RV19i"
+    "Z2hnPk1xeXBkeFxlZ2P/2wBDARESEhgVGC8aGi9jQjhCY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2NjY2Nj"
+    "Y2NjY2NjY2P/wAARCABAAEADASIAAhEBAxEB/8QAFQABAQAAAAAAAAAAAAAAAAAAAAb/xAAUEAEAAAAAAAAAAAAAAAAAAAAA/8QA"
+    "FQEBAQAAAAAAAAAAAAAAAAAAAAT/xAAUEQEAAAAAAAAAAAAAAAAAAAAA/9oADAMBAAIRAxEAPwCoASqQAAAAAAAAAAAAAAAAAAAA"
+    "AAAAAAAAAH//2Q=="
+)
+
+
+def stub_jpeg(size_kb):
+    """A decodable JPEG of about size_kb, padded with comment (COM) segments after SOI."""
+    padding = []
+    missing = size_kb * 1024 - len(STUB_JPEG)
+    while missing > 4:
+        chunk = min(missing - 4, 65533)
+        padding.append(b"\xff\xfe" + (chunk + 2).to_bytes(2, "big") + os.urandom(chunk))
+        missing -= chunk + 4
+    return STUB_JPEG[:2] + b"".join(padding) + STUB_JPEG[2:]
+
+
+def serve_stub_image(port, delay_ms, size_kb):
+    """Minimal stand-in for the image provider: a fixed-size JPEG after a delay.
+
+    The picture is a small solid tile padded to size_kb, so the cache can
+    decode it for the WebP/AVIF and thumbnail variants while the benchmark
+    still moves realistic payloads.
+    """
+    body = stub_jpeg(size_kb)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(delay_ms / 1000)
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    print(f"Stub image provider on http://127.0.0.1:{port}/prompt/ ({delay_ms} ms, {size_kb} KB per image)")
+    ThreadingHTTPServer(("127.0.0.1", port), Handler).serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the backend API")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="Run the load test")
+    run.add_argument("--base-url", default="http://localhost:8000")
+    run.add_argument("--concurrency", type=int, default=16)
+    run.add_argument("--duration", type=float, default=30, help="Measured seconds")
+    run.add_argument("--warmup", type=float, default=5, help="Unmeasured seconds before measuring")
+    run.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                     help="Scenario weights, e.g. payment=5,inventory_check=20")
+    run.add_argument("--timeout", type=float, default=30)
+    run.add_argument("--seed", type=int, default=1)
+    run.add_argument("--out", help="Write results to this JSON file")
+    run.add_argument("--compare", help="Baseline JSON to diff against")
+    run.add_argument("--max-regression", type=float, default=0.2,
+                     help="Allowed p95/p99 slowdown vs baseline before failing (0.2 = 20%%)")
+
+    stub = sub.add_parser("stub-image", help="Serve a fake image provider for /api/generate-design")
+    stub.add_argument("--port", type=int, default=8089)
+    stub.add_argument("--delay-ms", type=int, default=500)
+    stub.add_argument("--size-kb", type=int, default=80)
+
+    args = parser.parse_args()
+    if args.command == "stub-image":
+        serve_stub_image(args.port, args.delay_ms, args.size_kb)
+        return
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    result = run_load(args.base_url, args.concurrency, args.duration, args.warmup, args.mix, args.timeout, args.seed)
+    print_report(result, baseline)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"Results written to {args.out}")
+
+    if baseline:
+        found = regressions(result, baseline, args.max_regression)
+        if found:
+            print("\nREGRESSIONS vs baseline:")
+            for line in found:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nNo regressions vs baseline.")
+
+if __name__ == "__main__":
+    main()
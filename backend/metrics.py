@@ -0,0 +1,225 @@
+"""
+In-process metrics in the Prometheus text exposition format, plus logging setup.
+
+Counters, gauges and histograms live in a module-level registry and are
+served by GET /metrics. Request timing comes from the middleware in app.py,
+DB time from SQLAlchemy cursor events on every engine created by db_utils,
+and LLM / image-generation time from rag_engine.py and app.py.
+
+Label values must come from small fixed sets (route templates, db names),
+never from user input, to keep series counts bounded.
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from sqlalchemy import event
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+_registry = []
+
+
+def _label_str(names, values, extra=None):
+    pairs = list(zip(names, values)) + (extra or [])
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in sorted(items):
+            lines.extend(self._render_series(key, value))
+        return lines
+
+    def _render_series(self, key, value):
+        return [f"{self.name}{_label_str(self.labelnames, key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # [per-bucket counts..., +Inf count, sum]
+                series = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def _render_series(self, key, series):
+        lines = []
+        for bound, count in zip(self.buckets, series):
+            lines.append(f"{self.name}_bucket{_label_str(self.labelnames, key, [('le', bound)])} {count}")
+        lines.append(f"{self.name}_bucket{_label_str(self.labelnames, key, [('le', '+Inf')])} {series[-2]}")
+        lines.append(f"{self.name}_sum{_label_str(self.labelnames, key)} {series[-1]}")
+        lines.append(f"{self.name}_count{_label_str(self.labelnames, key)} {series[-2]}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self.started
+        self.histogram.observe(self.elapsed, **self.labels)
+
+
+def render():
+    """All metrics in the Prometheus text format (version 0.0.4)."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Metric definitions ---
+http_requests = Counter("http_requests_total", "HTTP requests handled", ("method", "route", "status"))
+http_latency = Histogram("http_request_duration_seconds", "Time to response headers", ("method", "route"))
+http_in_flight = Gauge("http_requests_in_flight", "Requests currently being handled")
+
+db_queries = Counter("db_queries_total", "SQL statements executed", ("db",))
+db_latency = Histogram("db_query_duration_seconds", "SQL statement execution time", ("db",))
+
+llm_latency = Histogram("llm_request_duration_seconds", "LLM completion time", ("model",), buckets=SLOW_BUCKETS)
+llm_tokens = Counter("llm_tokens_total", "LLM tokens used", ("model", "type"))
+rag_retrieval_latency = Histogram("rag_retrieval_duration_seconds", "Vector store retrieval time")
+
+image_latency = Histogram("image_generation_duration_seconds", "Image provider round trip", ("outcome",),
+                          buckets=SLOW_BUCKETS)
+
+
+# --- SQLAlchemy hooks ---
+# Callables (db_name, statement, elapsed_seconds) run after every statement, e.g. the profiler
+statement_observers = []
+
+def instrument_engine(engine, db_name):
+    """Time every statement on this engine under db=<db_name>."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        elapsed = time.perf_counter() - started
+        db_queries.inc(db=db_name)
+        db_latency.observe(elapsed, db=db_name)
+        for observer in statement_observers:
+            observer(db_name, statement, elapsed)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(exception_context):
+        # A failed statement never reaches after_cursor_execute
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_started"):
+            conn.info["query_started"].pop()
+
+
+def record_llm_usage(model, response, elapsed):
+    """Record completion time and token counts from a LangChain chat response."""
+    llm_latency.observe(elapsed, model=model)
+    usage = getattr(response, "usage_metadata", None) or {}
+    if usage:
+        prompt_tokens, completion_tokens = usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+    else:
+        usage = (getattr(response, "response_metadata", None) or {}).get("token_usage", {}) or {}
+        prompt_tokens, completion_tokens = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    if prompt_tokens:
+        llm_tokens.inc(prompt_tokens, model=model, type="prompt")
+    if completion_tokens:
+        llm_tokens.inc(completion_tokens, model=model, type="completion")
+
+
+# --- Logging ---
+_RESERVED_LOG_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; `extra={...}` fields become top-level keys."""
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED_LOG_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+def configure_logging():
+    """LOG_FORMAT=json|text, LOG_LEVEL=INFO by default."""
+    handler = logging.StreamHandler(sys.stdout)
+    if os.getenv("LOG_FORMAT", "json").lower() == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
@@ -0,0 +1,56 @@
+"""
+Migration script: Align PostgreSQL schema with models.py v3.0
+Adds:
+  1. warehouse_inventory.reserved_quantity (stock held by open carts)
+  2. stock_reservations table (created via metadata if missing)
+  3. orders.idempotency_key, unique per user (safe checkout retries)
+  4. outbox_events table (deferred cross-database side effects of checkout)
+Safe to re-run; every step is idempotent.
+"""
+from db_utils import get_db_engine
+from models import PaymentBase, AdminBase
+from sqlalchemy import text
+
+def migrate_payment_db():
+    print("\n--- Migrating PAYMENT_DB ---")
+    eng = get_db_engine('payment')
+    with eng.connect() as conn:
+        migrations = [
+            "ALTER TABLE orders ADD COLUMN IF NOT EXISTS idempotency_key VARCHAR(64)",
+            # Keys are chosen by clients, so they only need to be unique per user
+            "CREATE UNIQUE INDEX IF NOT EXISTS ux_orders_user_idempotency_key ON orders (user_id, idempotency_key)",
+        ]
+        for sql in migrations:
+            try:
+                conn.execute(text(sql))
+                print(f"  OK: {sql[:70]}")
+            except Exception as e:
+                print(f"  SKIP: {sql[:70]} -> {e}")
+        conn.commit()
+
+    PaymentBase.metadata.create_all(eng)
+    print("  PAYMENT_DB migration complete.")
+
+def migrate_admin_db():
+    print("\n--- Migrating ADMIN_DB ---")
+    eng = get_db_engine('admin')
+    with eng.connect() as conn:
+        migrations = [
+            "ALTER TABLE warehouse_inventory ADD COLUMN IF NOT EXISTS reserved_quantity INTEGER NOT NULL DEFAULT 0",
+        ]
+        for sql in migrations:
+            try:
+                conn.execute(text(sql))
+                print(f"  OK: {sql[:70]}")
+            except Exception as e:
+                print(f"  SKIP: {sql[:70]} -> {e}")
+        conn.commit()
+
+    # New tables (and their indexes) only; existing tables are left untouched
+    AdminBase.metadata.create_all(eng)
+    print("  ADMIN_DB migration complete.")
+
+if __name__ == "__main__":
+    migrate_payment_db()
+    migrate_admin_db()
+    print("\n✅ All migrations complete.")
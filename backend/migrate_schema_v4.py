@@ -0,0 +1,90 @@
+"""
+Migration script: Align PostgreSQL schema with models.py v4.0
+Adds:
+  1. product_prices table (server-side price table for carts)
+  2. carts / cart_items tables (server-side carts keyed by the reservation cart id)
+     + cart_items.client_id (links a line to the browser's copy)
+  3. shipping_status.phone_key + (order_id, phone_key) index (order tracking lookups)
+  4. shipping_events table, backfilled with one event per existing shipping_status row
+  5. background_jobs table (job queue with JOBS_BACKEND=postgres) + partial unique
+     index on dedupe_key for pending/running jobs + locked_by (claiming worker)
+  6. sales_rollups / rollup_watermarks tables + order_details.order_id and
+     orders.created_at indexes
+     (fill with: python sales_rollups.py backfill)
+  7. stock_reservations.settled_at + (status, settled_at) index (restock forecast demand)
+Safe to re-run; every step is idempotent.
+"""
+from db_utils import get_db_engine
+from models import PaymentBase, AdminBase
+from sqlalchemy import text
+
+def _run(conn, migrations):
+    for sql in migrations:
+        try:
+            conn.execute(text(sql))
+            print(f"  OK: {sql[:70]}")
+        except Exception as e:
+            print(f"  SKIP: {sql[:70]} -> {e}")
+    conn.commit()
+
+def migrate_payment_db():
+    print("\n--- Migrating PAYMENT_DB ---")
+    eng = get_db_engine('payment')
+    with eng.connect() as conn:
+        _run(conn, [
+            # Rollups join order lines by order id range
+            "CREATE INDEX IF NOT EXISTS ix_order_details_order_id ON order_details (order_id)",
+            # Rollup restatement reads the last few days of orders
+            "CREATE INDEX IF NOT EXISTS ix_orders_created_at ON orders (created_at)",
+        ])
+    # New tables (and their indexes) only; existing tables are left untouched
+    PaymentBase.metadata.create_all(eng)
+    with eng.connect() as conn:
+        _run(conn, [
+            "ALTER TABLE cart_items ADD COLUMN IF NOT EXISTS client_id VARCHAR(64)",
+            # Keep the oldest active job per key before making the key unique
+            "UPDATE background_jobs b SET status = 'failed', finished_at = now(), "
+            "last_error = 'Duplicate of an earlier job with the same key' "
+            "WHERE b.status IN ('pending', 'running') AND b.dedupe_key IS NOT NULL AND EXISTS ("
+            "SELECT 1 FROM background_jobs o WHERE o.dedupe_key = b.dedupe_key "
+            "AND o.status IN ('pending', 'running') AND (o.created_at, o.id) < (b.created_at, b.id))",
+            "CREATE UNIQUE INDEX IF NOT EXISTS ux_background_jobs_active_key ON background_jobs (dedupe_key) "
+            "WHERE status IN ('pending', 'running')",
+            "DROP INDEX IF EXISTS ix_background_jobs_dedupe_key",
+            "ALTER TABLE background_jobs ADD COLUMN IF NOT EXISTS locked_by VARCHAR(32)",
+        ])
+    print("  PAYMENT_DB migration complete.")
+
+def migrate_admin_db():
+    print("\n--- Migrating ADMIN_DB ---")
+    eng = get_db_engine('admin')
+    with eng.connect() as conn:
+        _run(conn, [
+            "ALTER TABLE shipping_status ADD COLUMN IF NOT EXISTS phone_key VARCHAR(20)",
+            # Same normalization as tracking.normalize_phone
+            "UPDATE shipping_status SET phone_key = regexp_replace(phone_number, '\\D', '', 'g') "
+            "WHERE phone_key IS NULL AND phone_number IS NOT NULL",
+            "UPDATE shipping_status SET phone_key = '0' || substr(phone_key, 3) "
+            "WHERE phone_key LIKE '84%' AND length(phone_key) >= 11",
+            "CREATE INDEX IF NOT EXISTS ix_shipping_status_order_phone ON shipping_status (order_id, phone_key)",
+            "ALTER TABLE stock_reservations ADD COLUMN IF NOT EXISTS settled_at TIMESTAMP",
+            # Older settled rows only know when they were held, close enough for daily demand
+            "UPDATE stock_reservations SET settled_at = created_at "
+            "WHERE settled_at IS NULL AND status IN ('committed', 'oversold', 'released')",
+            "CREATE INDEX IF NOT EXISTS ix_stock_reservations_status_settled ON stock_reservations (status, settled_at)",
+        ])
+
+    AdminBase.metadata.create_all(eng)
+
+    with eng.connect() as conn:
+        _run(conn, [
+            "INSERT INTO shipping_events (order_id, status, note, created_at) "
+            "SELECT s.order_id, s.status, NULL, s.updated_at FROM shipping_status s "
+            "WHERE NOT EXISTS (SELECT 1 FROM shipping_events e WHERE e.order_id = s.order_id)",
+        ])
+    print("  ADMIN_DB migration complete.")
+
+if __name__ == "__main__":
+    migrate_payment_db()
+    migrate_admin_db()
+    print("\n✅ All migrations complete.")
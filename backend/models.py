@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Text, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, DateTime, Text, Boolean, ForeignKey, Index, text
 from sqlalchemy.orm import declarative_base, relationship
 from datetime import datetime
 
@@ -56,11 +56,19 @@ class Order(PaymentBase):
     total_amount = Column(Float, nullable=False)
     status = Column(String(20), default='pending')  # pending, completed, failed, cancelled
     payment_method = Column(String(50), nullable=True)  # e.g. 'credit_card', 'cash'
+    idempotency_key = Column(String(64), nullable=True)  # Client retry key, unique per user, see /payment
     created_at = Column(DateTime, default=datetime.utcnow)
 
     # Relationship (within payment_db)
     order_details = relationship('OrderDetail', back_populates='order')
 
+    # Keys are chosen by clients, so one user's key must never find another user's order;
+    # created_at bounds the recent days that sales rollups recompute
+    __table_args__ = (
+        Index('ux_orders_user_idempotency_key', 'user_id', 'idempotency_key', unique=True),
+        Index('ix_orders_created_at', 'created_at'),
+    )
+
     def __repr__(self):
         return f"<Order(id={self.id}, user_id={self.user_id}, status='{self.status}')>"
 
@@ -68,7 +76,7 @@ class OrderDetail(PaymentBase):
     __tablename__ = 'order_details'
 
     id = Column(Integer, primary_key=True, index=True)
-    order_id = Column(Integer, ForeignKey('orders.id'), nullable=False)
+    order_id = Column(Integer, ForeignKey('orders.id'), nullable=False, index=True)
     product_name = Column(String(100), nullable=False)  # Logical FK -> admin_db.warehouse_inventory.product_name
     quantity = Column(Integer, nullable=False, default=1)
     unit_price = Column(Float, nullable=False)
@@ -93,6 +101,129 @@ class Payment(PaymentBase):
     def __repr__(self):
         return f"<Payment(id={self.id}, order_id={self.order_id}, status='{self.status}')>"
 
+class OutboxEvent(PaymentBase):
+    __tablename__ = 'outbox_events'
+
+    id = Column(Integer, primary_key=True, index=True)
+    event_type = Column(String(50), nullable=False)  # e.g. 'member.contact_update', 'reservation.commit'
+    payload = Column(Text, nullable=False)  # JSON
+    status = Column(String(20), default='pending')  # pending, done, failed
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text, nullable=True)
+    available_at = Column(DateTime, default=datetime.utcnow)  # Not retried before this time
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    # Processor polls pending rows that are due
+    __table_args__ = (Index('ix_outbox_events_status_available', 'status', 'available_at'),)
+
+    def __repr__(self):
+        return f"<OutboxEvent(id={self.id}, type='{self.event_type}', status='{self.status}')>"
+
+class BackgroundJob(PaymentBase):
+    __tablename__ = 'background_jobs'
+
+    # Only used with JOBS_BACKEND=postgres, see jobs.py
+    id = Column(String(32), primary_key=True)  # uuid4 hex, also the public job id
+    kind = Column(String(50), nullable=False)  # e.g. 'design.generate', 'rag.rebuild'
+    payload = Column(Text, nullable=False)  # JSON
+    dedupe_key = Column(String(100), nullable=True)  # At most one pending/running job per key
+    status = Column(String(20), default='pending')  # pending, running, done, failed
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=5)
+    result = Column(Text, nullable=True)  # JSON
+    last_error = Column(Text, nullable=True)
+    available_at = Column(DateTime, default=datetime.utcnow)  # Not started before this time
+    locked_at = Column(DateTime, nullable=True)  # Claim time; stale claims are requeued
+    locked_by = Column(String(32), nullable=True)  # Worker holding the claim; only it may finish the job
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
+
+    # Workers claim due pending rows with FOR UPDATE SKIP LOCKED; the partial
+    # unique index settles concurrent enqueues of the same key
+    __table_args__ = (
+        Index('ix_background_jobs_status_available', 'status', 'available_at'),
+        Index('ux_background_jobs_active_key', 'dedupe_key', unique=True,
+              postgresql_where=text("status IN ('pending', 'running')")),
+    )
+
+    def __repr__(self):
+        return f"<BackgroundJob(id='{self.id}', kind='{self.kind}', status='{self.status}')>"
+
+class SalesRollup(PaymentBase):
+    __tablename__ = 'sales_rollups'
+
+    # Maintained incrementally from completed orders, see sales_rollups.py
+    id = Column(Integer, primary_key=True, index=True)
+    bucket = Column(String(10), nullable=False)  # hour, day
+    bucket_start = Column(DateTime, nullable=False)  # Local time (ANALYTICS_UTC_OFFSET_HOURS)
+    product_name = Column(String(100), nullable=False)  # '*' = all products of the bucket
+    units = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0.0)  # Sum of order_details.subtotal
+    orders = Column(Integer, nullable=False, default=0)  # Orders with a line of this product
+
+    # One row per (bucket, product, start); the second index serves all-product range scans
+    __table_args__ = (
+        Index('ux_sales_rollups_bucket_product_start', 'bucket', 'product_name', 'bucket_start', unique=True),
+        Index('ix_sales_rollups_bucket_start', 'bucket', 'bucket_start'),
+    )
+
+    def __repr__(self):
+        return f"<SalesRollup(bucket='{self.bucket}', start={self.bucket_start}, product='{self.product_name}')>"
+
+class RollupWatermark(PaymentBase):
+    __tablename__ = 'rollup_watermarks'
+
+    name = Column(String(50), primary_key=True)  # e.g. 'sales'
+    last_order_id = Column(Integer, nullable=False, default=0)  # Orders up to this id are in the rollups
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<RollupWatermark(name='{self.name}', last_order_id={self.last_order_id})>"
+
+class ProductPrice(PaymentBase):
+    __tablename__ = 'product_prices'
+
+    sku = Column(String(100), primary_key=True)  # Product / assortment / gift option id used by the frontend
+    name = Column(String(100), nullable=False)
+    kind = Column(String(20), nullable=False, default='product')  # product, assortment, addon
+    unit_price = Column(Float, nullable=False)
+    image = Column(String(255), nullable=True)
+    active = Column(Boolean, nullable=False, default=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<ProductPrice(sku='{self.sku}', price={self.unit_price})>"
+
+class Cart(PaymentBase):
+    __tablename__ = 'carts'
+
+    id = Column(String(64), primary_key=True)  # Also the stock_reservations.cart_id of its holds
+    user_id = Column(Integer, nullable=True, index=True)  # Logical FK -> member_db.users.id; NULL for guests
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    items = relationship('CartItem', back_populates='cart', cascade='all, delete-orphan', passive_deletes=True)
+
+    def __repr__(self):
+        return f"<Cart(id='{self.id}', user_id={self.user_id})>"
+
+class CartItem(PaymentBase):
+    __tablename__ = 'cart_items'
+
+    id = Column(Integer, primary_key=True, index=True)
+    cart_id = Column(String(64), ForeignKey('carts.id', ondelete='CASCADE'), nullable=False, index=True)
+    sku = Column(String(100), nullable=False)  # Logical FK -> product_prices.sku
+    label = Column(String(100), nullable=True)  # Display name picked on the page (e.g. box variant)
+    quantity = Column(Integer, nullable=False, default=1)
+    options = Column(Text, nullable=True)  # JSON {option sku: quantity}, priced from product_prices
+    client_id = Column(String(64), nullable=True)  # The browser's id for the line (localStorage cart item id)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    cart = relationship('Cart', back_populates='items')
+
+    def __repr__(self):
+        return f"<CartItem(cart_id='{self.cart_id}', sku='{self.sku}', qty={self.quantity})>"
+
 # --- Administration Database Models ---
 class WarehouseInventory(AdminBase):
     __tablename__ = 'warehouse_inventory'
@@ -100,8 +231,30 @@ class WarehouseInventory(AdminBase):
     id = Column(Integer, primary_key=True, index=True)
     product_name = Column(String(100), unique=True, nullable=False)
     quantity = Column(Integer, default=0)
+    reserved_quantity = Column(Integer, default=0, nullable=False)  # Held by open carts, see StockReservation
     last_restock = Column(DateTime, default=datetime.utcnow)
 
+class StockReservation(AdminBase):
+    __tablename__ = 'stock_reservations'
+
+    id = Column(Integer, primary_key=True, index=True)
+    cart_id = Column(String(64), nullable=False, index=True)
+    product_name = Column(String(100), nullable=False)  # Logical FK -> warehouse_inventory.product_name
+    quantity = Column(Integer, nullable=False)
+    status = Column(String(20), default='held')  # held, short, expired, committed, released, oversold
+    expires_at = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    settled_at = Column(DateTime, nullable=True)  # When the cart was paid (committed/oversold) or released
+
+    # Sweeper scans held rows by expiry; the restock forecast reads paid lines by day
+    __table_args__ = (
+        Index('ix_stock_reservations_status_expires', 'status', 'expires_at'),
+        Index('ix_stock_reservations_status_settled', 'status', 'settled_at'),
+    )
+
+    def __repr__(self):
+        return f"<StockReservation(cart_id='{self.cart_id}', product='{self.product_name}', qty={self.quantity}, status='{self.status}')>"
+
 class ShippingStatus(AdminBase):
     __tablename__ = 'shipping_status'
     
@@ -109,12 +262,32 @@ class ShippingStatus(AdminBase):
     order_id = Column(Integer, unique=True, nullable=False)  # Logical FK -> payment_db.orders.id
     customer_name = Column(String(100), nullable=False)
     phone_number = Column(String(20), nullable=True)
+    phone_key = Column(String(20), nullable=True)  # Digits-only phone the order is tracked by, see tracking.normalize_phone
     status = Column(String(50), default='Pending')  # Pending, Shipped, Delivered, Cancelled
     updated_at = Column(DateTime, default=datetime.utcnow)
 
+    # Public tracking looks orders up by (order_id, phone)
+    __table_args__ = (Index('ix_shipping_status_order_phone', 'order_id', 'phone_key'),)
+
     def __repr__(self):
         return f"<ShippingStatus(order_id={self.order_id}, status='{self.status}')>"
 
+class ShippingEvent(AdminBase):
+    __tablename__ = 'shipping_events'
+
+    # Append-only history of status transitions; shipping_status holds the latest one
+    id = Column(Integer, primary_key=True, index=True)
+    order_id = Column(Integer, nullable=False)  # Logical FK -> shipping_status.order_id
+    status = Column(String(50), nullable=False)
+    note = Column(String(255), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    # A tracking lookup reads one order's events in order
+    __table_args__ = (Index('ix_shipping_events_order_created', 'order_id', 'created_at'),)
+
+    def __repr__(self):
+        return f"<ShippingEvent(order_id={self.order_id}, status='{self.status}')>"
+
 class CustomerProfile(AdminBase):
     __tablename__ = 'customer_profiles'
     
@@ -0,0 +1,129 @@
+"""
+Transactional outbox for checkout side effects (payment_db.outbox_events).
+
+/payment writes the order, its details, the payment and any follow-up work
+(member contact update, reservation commit, tracking record) in a single payment_db
+transaction. This processor then applies the follow-ups to the other
+databases asynchronously, retrying with backoff, so a crash can never leave
+payment_db and member_db/admin_db half-written.
+
+Handlers must be idempotent: an event may run again if the processor dies
+between applying it and marking it done.
+"""
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+from db_utils import get_db_session
+from models import OutboxEvent, User
+from reservations import commit_cart, move_cart
+from sessions import user_profiles
+from tracking import open_shipment
+
+logger = logging.getLogger("outbox")
+
+POLL_INTERVAL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "5"))
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 8
+
+HANDLERS = {}
+
+
+def handler(event_type):
+    def register(func):
+        HANDLERS[event_type] = func
+        return func
+    return register
+
+
+def new_event(event_type, payload):
+    """Build an outbox row; add it to the same session as the business write."""
+    return OutboxEvent(event_type=event_type, payload=json.dumps(payload), status='pending', attempts=0)
+
+
+@handler('member.contact_update')
+def apply_contact_update(payload):
+    session = get_db_session('member')
+    try:
+        session.execute(update(User).where(User.id == payload["user_id"]).values(**payload["changes"]))
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+    user_profiles.invalidate(payload["user_id"])
+
+
+@handler('reservation.commit')
+def apply_reservation_commit(payload):
+    commit_cart(payload["cart_id"])
+
+
+@handler('shipping.open')
+def apply_shipping_open(payload):
+    open_shipment(payload["order_id"], payload.get("customer_name"), payload.get("phone"))
+
+
+@handler('reservation.move')
+def apply_reservation_move(payload):
+    move_cart(payload["from_cart_id"], payload["to_cart_id"])
+
+
+def process_batch():
+    """Run one batch of due events. Returns how many were attempted."""
+    session = get_db_session('payment')
+    try:
+        events = session.query(OutboxEvent).filter(
+            OutboxEvent.status == 'pending',
+            OutboxEvent.available_at <= datetime.utcnow()
+        ).order_by(OutboxEvent.id).limit(BATCH_SIZE).with_for_update(skip_locked=True).all()
+
+        for event in events:
+            try:
+                HANDLERS[event.event_type](json.loads(event.payload))
+                event.status = 'done'
+                event.last_error = None
+            except Exception as e:
+                event.attempts = (event.attempts or 0) + 1
+                event.last_error = str(e)[:1000]
+                if event.attempts >= MAX_ATTEMPTS:
+                    event.status = 'failed'
+                    logger.error("Outbox event %s (%s) failed permanently: %s", event.id, event.event_type, e)
+                else:
+                    event.available_at = datetime.utcnow() + timedelta(seconds=2 ** event.attempts)
+        session.commit()
+        return len(events)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+_wakeup = None
+
+
+def notify():
+    """Ask the processor to run now instead of waiting for the next poll."""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def run_processor():
+    global _wakeup
+    _wakeup = asyncio.Event()
+    while True:
+        try:
+            while await asyncio.to_thread(process_batch) == BATCH_SIZE:
+                pass
+        except Exception as e:
+            logger.error("Outbox processor error: %s", e)
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=POLL_INTERVAL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
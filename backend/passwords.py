@@ -0,0 +1,68 @@
+"""
+Password hashing off the event loop.
+
+bcrypt is deliberately slow (~250 ms at cost 12), so running it inside an
+async handler stalls every other request. Hashing and verification run on a
+dedicated thread pool instead (bcrypt releases the GIL while hashing, so this
+scales with cores). At most PASSWORD_MAX_PENDING jobs may be queued; beyond
+that callers get PasswordPoolBusy and should answer 503.
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", str(os.cpu_count() or 2)))
+PASSWORD_MAX_PENDING = int(os.getenv("PASSWORD_MAX_PENDING", "64"))
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_WORKERS, thread_name_prefix="bcrypt")
+_pending = 0
+
+
+class PasswordPoolBusy(Exception):
+    """Too many password operations already queued."""
+
+
+# Password Hashing
+def get_password_hash(password, rounds=None):
+    # Truncate to 72 bytes to avoid bcrypt limitation and encode
+    pwd_bytes = password[:72].encode('utf-8')
+    salt = bcrypt.gensalt(rounds=rounds or BCRYPT_ROUNDS)
+    hashed_bytes = bcrypt.hashpw(pwd_bytes, salt)
+    return hashed_bytes.decode('utf-8') # Return string for storage
+
+def verify_password(plain_password, hashed_password):
+    plain_password_bytes = plain_password[:72].encode('utf-8')
+    hashed_password_bytes = hashed_password.encode('utf-8')
+    return bcrypt.checkpw(plain_password_bytes, hashed_password_bytes)
+
+def needs_rehash(hashed_password):
+    """True if the stored hash uses a lower cost factor than BCRYPT_ROUNDS."""
+    try:
+        # Format: $2b$<cost>$<salt+hash>
+        return int(hashed_password.split('$')[2]) < BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
+
+async def _run(func, *args):
+    global _pending
+    if _pending >= PASSWORD_MAX_PENDING:
+        raise PasswordPoolBusy()
+    _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+    finally:
+        _pending -= 1
+
+async def hash_password_async(password):
+    return await _run(get_password_hash, password)
+
+async def verify_password_async(plain_password, hashed_password):
+    return await _run(verify_password, plain_password, hashed_password)
+
+
+def shutdown_pool():
+    _executor.shutdown(wait=False, cancel_futures=True)
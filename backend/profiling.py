@@ -0,0 +1,194 @@
+"""
+Opt-in sampling profiler for slow requests.
+
+A profiled request gets a sampler thread that snapshots every busy thread's
+stack (sys._current_frames) each PROFILE_SAMPLE_MS, plus a log of the SQL
+statements it ran with their timings (via metrics.statement_observers).
+If the request takes longer than the threshold the result is kept: in
+memory (last PROFILE_KEEP) and, when PROFILE_DIR is set, as
+<id>.folded / <id>.json files. The .folded output is the collapsed-stack
+format read by flamegraph.pl and speedscope.
+
+Profiling is triggered either
+  - per request, with header `X-Profile: <PROFILE_TOKEN>` (ignored when
+    PROFILE_TOKEN is unset), or
+  - for a fraction of all requests, switched on via POST /admin/profiling.
+
+Samples cover all busy threads, so work of concurrent requests on the event
+loop can show up in a profile; the SQL log is exact per request.
+"""
+import contextvars
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+
+import metrics
+
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_DIR = os.getenv("PROFILE_DIR")
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+MAX_CONCURRENT = int(os.getenv("PROFILE_MAX_CONCURRENT", "4"))
+MAX_SQL_STATEMENTS = 500
+
+# Changed at runtime by POST /admin/profiling
+settings = {
+    "enabled": False,  # Profile requests without the header too
+    "sample_rate": 1.0,  # Fraction of requests profiled while enabled
+    "threshold_ms": float(os.getenv("PROFILE_THRESHOLD_MS", "500")),
+    "sample_ms": float(os.getenv("PROFILE_SAMPLE_MS", "5")),
+}
+
+_current = contextvars.ContextVar("current_profile", default=None)
+_profiles = deque(maxlen=PROFILE_KEEP)
+_profiles_lock = threading.Lock()
+_active = threading.BoundedSemaphore(MAX_CONCURRENT)
+logger = logging.getLogger("profiling")
+
+# Leaf frames that mean "this thread is idle", by (file name, function)
+_IDLE_LEAVES = {
+    ("selectors.py", "select"), ("threading.py", "wait"), ("queue.py", "get"),
+    ("thread.py", "_worker"), ("socket.py", "accept"),
+}
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, interval):
+        super().__init__(name="profiler-sampler", daemon=True)
+        self.interval = interval
+        self.counts = {}
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                name = names.get(thread_id, str(thread_id))
+                if thread_id == self.ident or name.startswith("profiler-"):
+                    continue
+                code = frame.f_code
+                if (os.path.basename(code.co_filename), code.co_name) in _IDLE_LEAVES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(name)
+                key = ";".join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class RequestProfile:
+    """Context manager wrapping one request; collects stack samples and SQL."""
+
+    def __init__(self, method, path, forced):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.forced = forced
+        self.route = None
+        self.status = None
+        self.sql = []
+        self.duration_ms = None
+
+    def __enter__(self):
+        self.started_at = datetime.utcnow()
+        self._token = _current.set(self)
+        self._sampler = _Sampler(settings["sample_ms"] / 1000)
+        self._started = time.perf_counter()
+        self._sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration_ms = round((time.perf_counter() - self._started) * 1000, 1)
+        self._sampler.stop()
+        _current.reset(self._token)
+        _active.release()
+
+    def record_sql(self, db_name, statement, elapsed):
+        if len(self.sql) < MAX_SQL_STATEMENTS:
+            self.sql.append({"db": db_name, "ms": round(elapsed * 1000, 2), "statement": statement[:2000]})
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self._sampler.counts.items()))
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "started_at": self.started_at.isoformat(),
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+            "duration_ms": self.duration_ms,
+            "trigger": "header" if self.forced else "sampled",
+            "samples": self._sampler.samples,
+            "sql_count": len(self.sql),
+            "sql_ms": round(sum(q["ms"] for q in self.sql), 2),
+        }
+
+
+def _observe_statement(db_name, statement, elapsed):
+    profile = _current.get()
+    if profile is not None:
+        profile.record_sql(db_name, statement, elapsed)
+
+metrics.statement_observers.append(_observe_statement)
+
+
+def start(method, path, header_value):
+    """Return a RequestProfile if this request should be profiled, else None."""
+    forced = bool(PROFILE_TOKEN) and header_value == PROFILE_TOKEN
+    if not forced and not (settings["enabled"] and random.random() < settings["sample_rate"]):
+        return None
+    # Bound the overhead: at most MAX_CONCURRENT samplers at once
+    if not _active.acquire(blocking=False):
+        return None
+    return RequestProfile(method, path, forced)
+
+
+def finish(profile):
+    """Keep the profile if it crossed the threshold. Returns its id, or None."""
+    if profile.duration_ms < settings["threshold_ms"]:
+        return None
+    record = {**profile.summary(), "sql": profile.sql}
+    folded = profile.folded()
+    with _profiles_lock:
+        _profiles.append((record, folded))
+    if PROFILE_DIR:
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            base = os.path.join(PROFILE_DIR, f"{profile.started_at:%Y%m%dT%H%M%S}-{profile.id}")
+            with open(base + ".folded", "w", encoding="utf-8") as f:
+                f.write(folded)
+            with open(base + ".json", "w", encoding="utf-8") as f:
+                json.dump(record, f, indent=2)
+        except OSError as e:
+            logger.warning("Could not write profile %s: %s", profile.id, e)
+    return profile.id
+
+
+def list_profiles():
+    with _profiles_lock:
+        return [{k: v for k, v in record.items() if k != "sql"} for record, _ in reversed(_profiles)]
+
+def get_profile(profile_id):
+    """Return (record, folded) or None."""
+    with _profiles_lock:
+        for record, folded in _profiles:
+            if record["id"] == profile_id:
+                return record, folded
+    return None
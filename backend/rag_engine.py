@@ -1,9 +1,12 @@
 import os
 import glob
-import traceback
+import logging
+import time
+import unicodedata
 import warnings
 from typing import List
 from dotenv import load_dotenv
+from metrics import rag_retrieval_latency, record_llm_usage
 
 # Suppress tokenizer warning
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
@@ -20,28 +23,54 @@ from langchain_core.prompts import ChatPromptTemplate
 
 load_dotenv()
 
+logger = logging.getLogger("rag_engine")
+
+# Load testing: answer with a canned reply after a fixed delay instead of calling Groq
+LLM_STUB = os.getenv("LLM_STUB", "").lower() in ("1", "true", "yes")
+LLM_STUB_DELAY_MS = int(os.getenv("LLM_STUB_DELAY_MS", "800"))
+
+class StubLLM:
+    """Stand-in for ChatGroq with a predictable latency and no API key."""
+
+    class _Reply:
+        def __init__(self, content):
+            self.content = content
+
+    def __init__(self, delay_ms):
+        self.delay = delay_ms / 1000
+
+    def invoke(self, messages):
+        time.sleep(self.delay)
+        return self._Reply("Our Matcha Mousse is a customer favourite! [stubbed reply]")
+
 class RAGEngine:
     def __init__(self, docs_dir: str = "../"):
-        print("Initializing RAGEngine...")
+        logger.info("Initializing RAGEngine...")
         self.docs_dir = docs_dir
         self.vector_store_path = "faiss_index"
         self.api_key = os.getenv("AI_KEY")
-        print(f"API Key present: {bool(self.api_key)}")
-        if not self.api_key:
-            raise ValueError("AI_KEY environment variable not set")
-        
-        print("Initializing ChatGroq...")
-        self.llm = ChatGroq(
-            temperature=0,
-            model_name="llama-3.3-70b-versatile",
-            api_key=self.api_key
-        )
+        logger.info("API Key present: %s", bool(self.api_key))
+        if LLM_STUB:
+            logger.info("LLM_STUB set - using a stubbed LLM (%s ms per reply)", LLM_STUB_DELAY_MS)
+            self.llm = StubLLM(LLM_STUB_DELAY_MS)
+            self.model_name = "stub"
+        else:
+            if not self.api_key:
+                raise ValueError("AI_KEY environment variable not set")
+
+            logger.info("Initializing ChatGroq...")
+            self.model_name = "llama-3.3-70b-versatile"
+            self.llm = ChatGroq(
+                temperature=0,
+                model_name=self.model_name,
+                api_key=self.api_key
+            )
         
-        print("Initializing Embeddings...")
+        logger.info("Initializing Embeddings...")
         self.embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
         self.vector_store = None
         self.chain = None
-        print("RAGEngine initialized.")
+        logger.info("RAGEngine initialized.")
 
     def load_documents(self) -> List:
         # Recursive glob to find all HTML files
@@ -49,15 +78,20 @@ class RAGEngine:
         
         # Filter out system directories
         html_files = []
-        exclude_dirs = {'venv', 'node_modules', '.git', '__pycache__'}
+        exclude_dirs = {'venv', 'node_modules', '.git', '__pycache__', 'dist'}
+        seen_paths = set()
         
         for file_path in all_html_files:
             # Check if any excluded directory is in the path
             parts = file_path.split(os.sep)
             if not any(excluded in parts for excluded in exclude_dirs):
-                html_files.append(file_path)
+                # Same name stored in both NFC and NFD form: index it once
+                canonical_path = unicodedata.normalize('NFC', file_path)
+                if canonical_path not in seen_paths:
+                    seen_paths.add(canonical_path)
+                    html_files.append(file_path)
         
-        print(f"Found {len(html_files)} HTML files to process.")
+        logger.info("Found %d HTML files to process.", len(html_files))
         docs = []
         from bs4 import BeautifulSoup
         from langchain_core.documents import Document
@@ -72,10 +106,16 @@ class RAGEngine:
                 
                 # Extract images and try to associate with context
                 images_info = []
+                seen_srcs = set()
                 for img in soup.find_all('img'):
                     src = img.get('src')
                     alt = img.get('alt', '')
                     if src and not src.startswith('data:'):
+                        # NFC so NFC/NFD spellings of one file name give one URL
+                        src = unicodedata.normalize('NFC', src)
+                        if src in seen_srcs:
+                            continue
+                        seen_srcs.add(src)
                         # Encode spaces in URL to ensure valid Markdown link
                         src = src.replace(" ", "%20")
                         
@@ -95,18 +135,18 @@ class RAGEngine:
                 # Prepend and append images to text to ensure they are in the chunk
                 combined_content = f"IMAGES IN THIS PAGE:\n{image_section}\n\nPAGE CONTENT:\n{text_content}\n\nIMAGES IN THIS PAGE:\n{image_section}"
                 
-                print(f"Extracted {len(images_info)} images from {file_path}")
+                logger.debug("Extracted %d images from %s", len(images_info), file_path)
                 if images_info:
-                    print(f"Sample: {images_info[0]}")
+                    logger.debug("Sample: %s", images_info[0])
                 
                 docs.append(Document(page_content=combined_content, metadata={"source": file_path}))
             except Exception as e:
-                print(f"Error loading {file_path}: {e}")
+                logger.error("Error loading %s: %s", file_path, e)
         return docs
 
     def initialize_vector_store(self):
         # Always recreate vector store to include new image data
-        print("Creating new vector store with image data...")
+        logger.info("Creating new vector store with image data...")
         self._ingest_documents()
 
     def _ingest_documents(self):
@@ -117,14 +157,14 @@ class RAGEngine:
             self.vector_store = FAISS.from_documents(splits, self.embeddings)
             self.vector_store.save_local(self.vector_store_path)
         else:
-            print("No documents to ingest.")
+            logger.warning("No documents to ingest.")
 
     def setup_chain(self):
         if not self.vector_store:
             self.initialize_vector_store()
         
         if not self.vector_store:
-            print("Vector store not initialized (no documents?).")
+            logger.warning("Vector store not initialized (no documents?).")
             return
 
         # We will use manual retrieval in query() for multimodal support
@@ -141,7 +181,8 @@ class RAGEngine:
             # Retrieve context - INCREASE retrieved docs to 5 for more context
             retriever = self.vector_store.as_retriever(search_kwargs={"k": 5})
             # Fix deprecation warning: use invoke instead of get_relevant_documents
-            docs = retriever.invoke(input_text)
+            with rag_retrieval_latency.time():
+                docs = retriever.invoke(input_text)
             context = "\n\n".join([d.page_content for d in docs])
 
             system_prompt = (
@@ -167,18 +208,19 @@ class RAGEngine:
             messages = [SystemMessage(content=system_prompt)]
             
             if image_data:
-                print("Image data received but vision model is unavailable. Appending note.")
+                logger.info("Image data received but vision model is unavailable. Appending note.")
                 # Fallback for text-only model
                 input_text += "\n\n[System Note: The user uploaded an image, but the vision model is currently unavailable due to provider restrictions. Please apologize and explain that you cannot see the image, but offer to help with any text description they provide.]"
             
-            print("Processing text-only request...")
+            logger.debug("Processing text-only request...")
             messages.append(HumanMessage(content=input_text))
 
+            started = time.perf_counter()
             response = self.llm.invoke(messages)
+            record_llm_usage(self.model_name, response, time.perf_counter() - started)
             return response.content
         except Exception as e:
-            print(f"Error during query execution: {e}")
-            traceback.print_exc()
+            logger.exception("Error during query execution: %s", e)
             raise e
 
 # Singleton instance for easy import
@@ -0,0 +1,399 @@
+"""
+Stock reservation subsystem (admin_db).
+
+Adding to cart places a time-bounded hold on stock instead of deducting it:
+  - reserve_items()  -> warehouse_inventory.reserved_quantity += n, one held row per line
+  - commit_cart()    -> on successful payment, every line of the cart is deducted
+  - release_cart()   -> cart emptied, holds are returned
+  - move_cart()      -> guest cart merged into a user's cart at login, holds follow it
+  - release_expired()-> background sweeper returns holds past their TTL
+
+A line that could not be held ('short') or whose hold ran out ('expired')
+keeps its row, so paying for the cart still deducts it: commit_cart() takes
+it from free stock if there is enough, and otherwise marks it 'oversold' and
+reports the shortfall instead of dropping it.
+
+Available-to-sell (quantity - reserved_quantity) is served from StockView,
+an in-process copy of warehouse_inventory kept current from the RETURNING
+rows of every write, so stock checks don't hit the database per request.
+Its version number is exposed as an ETag for conditional requests.
+"""
+import asyncio
+import json
+import os
+import threading
+import uuid
+import zlib
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import update, select
+from db_utils import get_db_session
+from models import WarehouseInventory, StockReservation
+
+logger = logging.getLogger("reservations")
+
+# Lines of a cart that paying for it still has to deduct
+OPEN_STATUSES = ('held', 'expired', 'short')
+
+RESERVATION_TTL_MINUTES = int(os.getenv("RESERVATION_TTL_MINUTES", "15"))
+SWEEP_INTERVAL_SECONDS = int(os.getenv("RESERVATION_SWEEP_SECONDS", "30"))
+SWEEP_BATCH_SIZE = 500
+STOCK_VIEW_MAX_AGE_SECONDS = int(os.getenv("STOCK_VIEW_MAX_AGE_SECONDS", "10"))
+
+
+class StockView:
+    """In-process map of product_name -> (quantity, reserved_quantity).
+
+    Writes made by this process are applied from their RETURNING rows and bump
+    `version`, which doubles as the ETag. Writes from other processes are picked
+    up by a reload once the view is older than STOCK_VIEW_MAX_AGE_SECONDS;
+    concurrent requests share a single reload.
+    """
+
+    def __init__(self):
+        self._rows = {}
+        self._lock = threading.Lock()
+        # Distinguishes ETags of different workers/restarts that reach the same version
+        self._epoch = uuid.uuid4().hex[:8]
+        self._snapshot = None  # (version, body bytes) of the full available map
+        self._refreshing = None
+        self._listeners = []
+        self.version = 0
+        self.loaded_at = None
+
+    def add_listener(self, callback):
+        """Register callback({product_name: row}) invoked with every set of changed rows."""
+        self._listeners.append(callback)
+
+    def _notify(self, changed):
+        if not changed:
+            return
+        delta = {
+            name: {"quantity": q, "reserved": r, "available": max(q - r, 0)}
+            for name, (q, r) in changed.items()
+        }
+        for callback in self._listeners:
+            try:
+                callback(delta)
+            except Exception as e:
+                logger.error("Stock view listener error: %s", e)
+
+    def load(self):
+        session = get_db_session('admin')
+        try:
+            rows = session.execute(
+                select(WarehouseInventory.product_name, WarehouseInventory.quantity, WarehouseInventory.reserved_quantity)
+            ).all()
+        finally:
+            session.close()
+
+        fresh = {r.product_name: (r.quantity or 0, r.reserved_quantity or 0) for r in rows}
+        with self._lock:
+            changed = {}
+            if fresh != self._rows:
+                changed = {name: value for name, value in fresh.items() if self._rows.get(name) != value}
+                changed.update({name: (0, 0) for name in self._rows if name not in fresh})
+                self._rows = fresh
+                self.version += 1
+            self.loaded_at = datetime.utcnow()
+        self._notify(changed)
+
+    def apply(self, product_name, quantity, reserved):
+        value = (quantity or 0, reserved or 0)
+        with self._lock:
+            if self._rows.get(product_name) == value:
+                return
+            self._rows[product_name] = value
+            self.version += 1
+        self._notify({product_name: value})
+
+    def invalidate(self):
+        """Force a reload on next access (e.g. after a bulk import)."""
+        with self._lock:
+            self.loaded_at = None
+
+    def is_stale(self):
+        if self.loaded_at is None:
+            return True
+        return (datetime.utcnow() - self.loaded_at).total_seconds() > STOCK_VIEW_MAX_AGE_SECONDS
+
+    async def ensure_fresh(self):
+        """Reload if stale. Only the very first load blocks; later reloads run in the background."""
+        if not self.is_stale():
+            return
+        if self._refreshing is None:
+            self._refreshing = asyncio.ensure_future(asyncio.to_thread(self.load))
+            self._refreshing.add_done_callback(self._refresh_done)
+        if self.loaded_at is None:
+            await asyncio.shield(self._refreshing)
+
+    def _refresh_done(self, future):
+        self._refreshing = None
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Stock view refresh failed: %s", future.exception())
+
+    def etag(self, product_names=None):
+        tag = f"{self._epoch}-{self.version}"
+        if product_names is not None:
+            names_key = "\n".join(product_names).encode('utf-8')
+            tag += f"-{zlib.crc32(names_key):08x}"
+        return f'"{tag}"'
+
+    def available(self, product_names):
+        if self.loaded_at is None:
+            self.load()
+        with self._lock:
+            result = {}
+            for name in product_names:
+                quantity, reserved = self._rows.get(name, (0, 0))
+                result[name] = max(quantity - reserved, 0)
+            return result
+
+    def snapshot(self):
+        """Return (etag, JSON body) for the full available map, serialized once per version."""
+        with self._lock:
+            version = self.version
+            if self._snapshot is None or self._snapshot[0] != version:
+                body = json.dumps(
+                    {name: max(q - r, 0) for name, (q, r) in self._rows.items()},
+                    ensure_ascii=False
+                ).encode('utf-8')
+                self._snapshot = (version, body)
+            return self.etag(), self._snapshot[1]
+
+
+stock_view = StockView()
+
+
+def _expiry():
+    return datetime.utcnow() + timedelta(minutes=RESERVATION_TTL_MINUTES)
+
+
+def reserve_items(cart_id, wanted, all_or_nothing=False):
+    """Hold stock for {product_name: quantity} under cart_id in one transaction.
+
+    Rows are locked in product_name order, like every other path that touches
+    several inventory rows, so two carts can never deadlock each other.
+    """
+    cart_id = cart_id or uuid.uuid4().hex
+    expires_at = _expiry()
+    wanted = sorted(wanted.items())
+    session = get_db_session('admin')
+    try:
+        results = []
+        held = []
+        for name, qty in wanted:
+            stmt = (
+                update(WarehouseInventory)
+                .where(
+                    WarehouseInventory.product_name == name,
+                    WarehouseInventory.quantity - WarehouseInventory.reserved_quantity >= qty
+                )
+                .values(reserved_quantity=WarehouseInventory.reserved_quantity + qty)
+                .returning(WarehouseInventory.quantity, WarehouseInventory.reserved_quantity)
+            )
+            row = session.execute(stmt).first()
+            if row is not None:
+                held.append((name, qty, row))
+            results.append({
+                "product_name": name,
+                "quantity": qty,
+                "reserved": row is not None,
+                "remaining": (row.quantity - row.reserved_quantity) if row is not None else None
+            })
+
+        all_reserved = all(r["reserved"] for r in results)
+        if all_or_nothing and not all_reserved:
+            session.rollback()
+            for r in results:
+                r["reserved"] = False
+                r["remaining"] = None
+            return {"success": False, "cart_id": cart_id, "expires_at": None, "items": results}
+
+        # Lines without stock are recorded too, so paying for them still deducts (see commit_cart)
+        held_names = {name for name, _, _ in held}
+        session.add_all([
+            StockReservation(
+                cart_id=cart_id, product_name=name, quantity=qty,
+                status='held' if name in held_names else 'short', expires_at=expires_at
+            )
+            for name, qty in wanted
+        ])
+        # Any activity on the cart keeps its earlier holds alive too
+        session.execute(
+            update(StockReservation)
+            .where(StockReservation.cart_id == cart_id, StockReservation.status == 'held')
+            .values(expires_at=expires_at)
+        )
+        session.commit()
+
+        for name, _, row in held:
+            stock_view.apply(name, row.quantity, row.reserved_quantity)
+
+        return {
+            "success": all_reserved,
+            "cart_id": cart_id,
+            "expires_at": expires_at.isoformat(),
+            "items": results
+        }
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def _settle(session, reservations, new_status):
+    """Move held reservations to committed/released/expired and fix up the inventory counters."""
+    totals = {}
+    now = datetime.utcnow()
+    for r in reservations:
+        totals[r.product_name] = totals.get(r.product_name, 0) + r.quantity
+        r.status = new_status
+        if new_status != 'expired':
+            r.settled_at = now
+
+    changed = []
+    for name, qty in totals.items():
+        values = {"reserved_quantity": WarehouseInventory.reserved_quantity - qty}
+        if new_status == 'committed':
+            values["quantity"] = WarehouseInventory.quantity - qty
+        row = session.execute(
+            update(WarehouseInventory)
+            .where(WarehouseInventory.product_name == name)
+            .values(**values)
+            .returning(WarehouseInventory.quantity, WarehouseInventory.reserved_quantity)
+        ).first()
+        if row is not None:
+            changed.append((name, row))
+    return changed
+
+
+def _deduct_unheld(session, reservations):
+    """Take lines without a live hold from free stock. Returns (changed rows, shortfall)."""
+    changed = []
+    shortfall = []
+    now = datetime.utcnow()
+    for r in reservations:
+        r.settled_at = now
+        row = session.execute(
+            update(WarehouseInventory)
+            .where(
+                WarehouseInventory.product_name == r.product_name,
+                WarehouseInventory.quantity - WarehouseInventory.reserved_quantity >= r.quantity
+            )
+            .values(quantity=WarehouseInventory.quantity - r.quantity)
+            .returning(WarehouseInventory.quantity, WarehouseInventory.reserved_quantity)
+        ).first()
+        if row is None:
+            r.status = 'oversold'
+            shortfall.append({"product_name": r.product_name, "quantity": r.quantity})
+        else:
+            r.status = 'committed'
+            changed.append((r.product_name, row))
+    return changed, shortfall
+
+
+def _settle_cart(cart_id, new_status):
+    """Commit or release every open line of a cart. Returns (lines settled, lines that could not be deducted)."""
+    session = get_db_session('admin')
+    try:
+        reservations = session.query(StockReservation).filter(
+            StockReservation.cart_id == cart_id,
+            StockReservation.status.in_(OPEN_STATUSES)
+        ).order_by(StockReservation.product_name).with_for_update().all()
+        held = [r for r in reservations if r.status == 'held']
+        unheld = [r for r in reservations if r.status != 'held']
+        changed = _settle(session, held, new_status)
+        shortfall = []
+        if new_status == 'committed':
+            more, shortfall = _deduct_unheld(session, unheld)
+            changed += more
+        else:
+            for r in unheld:
+                r.status = new_status
+                r.settled_at = datetime.utcnow()
+        session.commit()
+        for name, row in changed:
+            stock_view.apply(name, row.quantity, row.reserved_quantity)
+        return len(reservations), shortfall
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def commit_cart(cart_id):
+    """Deduct every line of a paid cart: holds are converted, other lines taken from free stock.
+
+    Returns [{"product_name", "quantity"}] of lines there was not enough stock
+    for; those are marked 'oversold' and logged for the warehouse to resolve.
+    """
+    _, shortfall = _settle_cart(cart_id, 'committed')
+    if shortfall:
+        logger.warning("Paid cart oversold", extra={"cart_id": cart_id, "shortfall": shortfall})
+    return shortfall
+
+
+def release_cart(cart_id):
+    """Return every hold of an abandoned/emptied cart. Returns how many lines it had."""
+    return _settle_cart(cart_id, 'released')[0]
+
+
+def move_cart(from_cart_id, to_cart_id):
+    """Re-key a cart's open holds onto another cart. Safe to repeat."""
+    session = get_db_session('admin')
+    try:
+        result = session.execute(
+            update(StockReservation)
+            .where(StockReservation.cart_id == from_cart_id, StockReservation.status.in_(OPEN_STATUSES))
+            .values(cart_id=to_cart_id, expires_at=_expiry())
+        )
+        session.commit()
+        return result.rowcount
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def release_expired():
+    """Return the stock of one batch of expired holds. Returns how many there were.
+
+    The lines stay 'expired' rather than 'released': the cart may still be paid.
+    """
+    session = get_db_session('admin')
+    try:
+        reservations = session.query(StockReservation).filter(
+            StockReservation.status == 'held',
+            StockReservation.expires_at < datetime.utcnow()
+        ).order_by(StockReservation.expires_at).limit(SWEEP_BATCH_SIZE).with_for_update(skip_locked=True).all()
+        if not reservations:
+            return 0
+        changed = _settle(session, reservations, 'expired')
+        session.commit()
+        for name, row in changed:
+            stock_view.apply(name, row.quantity, row.reserved_quantity)
+        return len(reservations)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+async def run_sweeper():
+    """Background task: release expired holds and resync the stock view."""
+    while True:
+        try:
+            released = await asyncio.to_thread(release_expired)
+            while released == SWEEP_BATCH_SIZE:
+                released = await asyncio.to_thread(release_expired)
+            # Full resync picks up writes made by other processes (seed scripts, other workers)
+            await asyncio.to_thread(stock_view.load)
+        except Exception as e:
+            logger.error("Reservation sweeper error: %s", e)
+        await asyncio.sleep(SWEEP_INTERVAL_SECONDS)
@@ -0,0 +1,309 @@
+"""
+Hourly and daily sales rollups (payment_db.sales_rollups).
+
+Each row holds the units, revenue and order count of one product in one
+hour or day; product '*' is the total of all products. Buckets are in local
+time (ANALYTICS_UTC_OFFSET_HOURS, Vietnam by default), so a "day" is a shop
+day rather than a UTC day.
+
+refresh() folds completed orders past the 'sales' watermark into the rollups
+with additive upserts, in batches of ROLLUP_BATCH_ORDERS, the watermark row
+locked for the whole batch so concurrent refreshes never count an order
+twice. Orders younger than ROLLUP_LAG_SECONDS are left for the next run:
+ids are handed out before commit, so a slow transaction could otherwise
+commit a lower id after the watermark has passed it. /payment queues an
+'analytics.rollup' job for the moment an order clears the lag (schedule());
+orders in the same ROLLUP_KEY_SECONDS window share one job, and a run that
+still finds younger orders past the watermark queues the next one itself.
+
+An order is counted once, with the status it had when the watermark passed
+it. restate() therefore recomputes the last ROLLUP_RESTATE_DAYS local days
+from scratch every ROLLUP_RESTATE_SECONDS, which picks up orders completed
+(or cancelled) after they were rolled up; older edits need a backfill.
+Charts read only the rollups, so their cost depends on the range asked
+for, not on order history.
+
+    python sales_rollups.py backfill   # rebuild everything from orders
+    python sales_rollups.py refresh    # catch up once
+"""
+import math
+import os
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, delete, union_all, literal, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from db_utils import get_db_session
+from models import Order, OrderDetail, SalesRollup, RollupWatermark
+
+UTC_OFFSET_HOURS = int(os.getenv("ANALYTICS_UTC_OFFSET_HOURS", "7"))
+ROLLUP_LAG_SECONDS = int(os.getenv("ROLLUP_LAG_SECONDS", "30"))
+ROLLUP_BATCH_ORDERS = int(os.getenv("ROLLUP_BATCH_ORDERS", "20000"))
+ROLLUP_RESTATE_DAYS = int(os.getenv("ROLLUP_RESTATE_DAYS", "2"))
+ROLLUP_RESTATE_SECONDS = int(os.getenv("ROLLUP_RESTATE_SECONDS", "300"))
+ROLLUP_KEY_SECONDS = 5  # Width of the time buckets that orders share a rollup job in
+WATERMARK = 'sales'
+RESTATE_WATERMARK = 'sales_restate'  # updated_at = last restate() run
+TOTAL = '*'
+BUCKETS = ('hour', 'day')
+
+
+def local_now():
+    return datetime.utcnow() + timedelta(hours=UTC_OFFSET_HOURS)
+
+
+def _aggregate(bucket, after_id, upto_id, since=None):
+    """SELECT of per-product and total rows for completed orders in (after_id, upto_id].
+
+    `since` (UTC) further limits it to orders created from then on.
+    """
+    start = func.date_trunc(bucket, Order.created_at + timedelta(hours=UTC_OFFSET_HOURS))
+    lines = (
+        select(
+            literal(bucket).label('bucket'),
+            start.label('bucket_start'),
+            OrderDetail.product_name,
+            OrderDetail.quantity,
+            OrderDetail.subtotal,
+            Order.id.label('order_id')
+        )
+        .join(OrderDetail, OrderDetail.order_id == Order.id)
+        .where(Order.id > after_id, Order.id <= upto_id, Order.status == 'completed',
+               *([Order.created_at >= since] if since else []))
+        .subquery()
+    )
+
+    def summed(product):
+        return select(
+            lines.c.bucket,
+            lines.c.bucket_start,
+            product,
+            func.sum(lines.c.quantity),
+            func.sum(lines.c.subtotal),
+            func.count(func.distinct(lines.c.order_id))
+        )
+
+    per_product = summed(lines.c.product_name).group_by(lines.c.bucket, lines.c.bucket_start, lines.c.product_name)
+    totals = summed(literal(TOTAL)).group_by(lines.c.bucket, lines.c.bucket_start)
+    return union_all(per_product, totals)
+
+def _upsert(bucket, after_id, upto_id, since=None):
+    stmt = pg_insert(SalesRollup).from_select(
+        ['bucket', 'bucket_start', 'product_name', 'units', 'revenue', 'orders'],
+        _aggregate(bucket, after_id, upto_id, since)
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[SalesRollup.bucket, SalesRollup.product_name, SalesRollup.bucket_start],
+        set_={
+            "units": SalesRollup.units + stmt.excluded.units,
+            "revenue": SalesRollup.revenue + stmt.excluded.revenue,
+            "orders": SalesRollup.orders + stmt.excluded.orders
+        }
+    )
+
+def _lock_watermark(session, name=WATERMARK, updated_at=None):
+    session.execute(
+        pg_insert(RollupWatermark)
+        .values(name=name, last_order_id=0, updated_at=updated_at or datetime.utcnow())
+        .on_conflict_do_nothing(index_elements=[RollupWatermark.name])
+    )
+    return session.execute(
+        select(RollupWatermark).where(RollupWatermark.name == name).with_for_update()
+    ).scalar_one()
+
+
+def refresh():
+    """Roll up every settled order past the watermark. Returns the number of order ids covered."""
+    covered = 0
+    while True:
+        session = get_db_session('payment')
+        try:
+            watermark = _lock_watermark(session)
+            settled = session.execute(
+                select(func.max(Order.id))
+                .where(Order.created_at <= datetime.utcnow() - timedelta(seconds=ROLLUP_LAG_SECONDS))
+            ).scalar_one_or_none() or 0
+            after_id = watermark.last_order_id
+            upto_id = min(settled, after_id + ROLLUP_BATCH_ORDERS)
+            if upto_id <= after_id:
+                session.rollback()
+                return covered
+            for bucket in BUCKETS:
+                session.execute(_upsert(bucket, after_id, upto_id))
+            watermark.last_order_id = upto_id
+            watermark.updated_at = datetime.utcnow()
+            session.commit()
+            covered += upto_id - after_id
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+
+def restate(force=False):
+    """Rebuild the rollups of the last ROLLUP_RESTATE_DAYS local days from orders.
+
+    Runs at most once per ROLLUP_RESTATE_SECONDS unless forced. Both buckets
+    start on a local day boundary, so whole rows are replaced and never mix
+    restated and additive counts. Returns True if it ran.
+    """
+    now = datetime.utcnow()
+    session = get_db_session('payment')
+    try:
+        # The sales watermark lock keeps refresh() out until the rows are replaced
+        watermark = _lock_watermark(session)
+        restated = _lock_watermark(session, RESTATE_WATERMARK, updated_at=datetime(1970, 1, 1))
+        if not force and restated.updated_at > now - timedelta(seconds=ROLLUP_RESTATE_SECONDS):
+            session.rollback()
+            return False
+        since = align(local_now() - timedelta(days=ROLLUP_RESTATE_DAYS), 'day')
+        session.execute(delete(SalesRollup).where(SalesRollup.bucket_start >= since))
+        for bucket in BUCKETS:
+            session.execute(_upsert(bucket, 0, watermark.last_order_id, since - timedelta(hours=UTC_OFFSET_HOURS)))
+        restated.last_order_id = watermark.last_order_id
+        restated.updated_at = now
+        session.commit()
+        return True
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def schedule_restate():
+    """(job key, delay in seconds) of the next periodic rollup run, one per ROLLUP_RESTATE_SECONDS slot."""
+    now = (datetime.utcnow() - datetime(1970, 1, 1)).total_seconds()
+    due = math.ceil((now + 1) / ROLLUP_RESTATE_SECONDS) * ROLLUP_RESTATE_SECONDS
+    return f"analytics.rollup:restate:{due}", due - now
+
+
+def oldest_unsettled():
+    """created_at (UTC) of the oldest order past the watermark, or None when caught up."""
+    session = get_db_session('payment')
+    try:
+        last_order_id = session.execute(
+            select(RollupWatermark.last_order_id).where(RollupWatermark.name == WATERMARK)
+        ).scalar_one_or_none() or 0
+        return session.execute(
+            select(func.min(Order.created_at)).where(Order.id > last_order_id)
+        ).scalar_one_or_none()
+    finally:
+        session.close()
+
+def schedule(created_at):
+    """(job key, delay in seconds) of the rollup run that covers an order created at `created_at` (UTC).
+
+    The run is due once the order clears the lag, rounded up to a
+    ROLLUP_KEY_SECONDS bucket; the key names that bucket, so a job that is
+    already running or due earlier never absorbs a later order.
+    """
+    now = datetime.utcnow()
+    settles = (created_at - datetime(1970, 1, 1)).total_seconds() + ROLLUP_LAG_SECONDS + 1
+    due = math.ceil(settles / ROLLUP_KEY_SECONDS) * ROLLUP_KEY_SECONDS
+    return f"analytics.rollup:{due}", max(due - (now - datetime(1970, 1, 1)).total_seconds(), 0)
+
+
+def backfill():
+    """Drop all rollups and rebuild them from the full order history."""
+    session = get_db_session('payment')
+    try:
+        watermark = _lock_watermark(session)
+        session.execute(delete(SalesRollup))
+        watermark.last_order_id = 0
+        watermark.updated_at = datetime.utcnow()
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+    return refresh()
+
+
+def align(moment, bucket):
+    """Start of the bucket (local time) that contains `moment`."""
+    moment = moment.replace(minute=0, second=0, microsecond=0)
+    if bucket == 'hour':
+        return moment
+    moment = moment.replace(hour=0)
+    if bucket == 'week':
+        return moment - timedelta(days=moment.weekday())
+    if bucket == 'month':
+        return moment.replace(day=1)
+    return moment
+
+def _points(rows):
+    return [
+        {"t": r.t.isoformat(), "units": int(r.units), "revenue": round(float(r.revenue), 2), "orders": int(r.orders)}
+        for r in rows
+    ]
+
+def timeseries(bucket, start, end, products=None, top=0):
+    """Sales per bucket in [start, end) (local time) from the rollups alone.
+
+    Week and month points are summed from the day rows. Returns the all-product
+    totals plus one series per product: the ones named in `products`, or else
+    the `top` best sellers by revenue in the range. Buckets without sales are
+    left out.
+    """
+    source = 'hour' if bucket == 'hour' else 'day'
+    period = SalesRollup.bucket_start if bucket in BUCKETS else func.date_trunc(bucket, SalesRollup.bucket_start)
+    in_range = (
+        SalesRollup.bucket == source,
+        SalesRollup.bucket_start >= start,
+        SalesRollup.bucket_start < end
+    )
+    session = get_db_session('payment')
+    try:
+        if not products and top:
+            products = session.execute(
+                select(SalesRollup.product_name)
+                .where(*in_range, SalesRollup.product_name != TOTAL)
+                .group_by(SalesRollup.product_name)
+                .order_by(func.sum(SalesRollup.revenue).desc())
+                .limit(top)
+            ).scalars().all()
+        rows = session.execute(
+            select(
+                period.label('t'),
+                SalesRollup.product_name,
+                func.sum(SalesRollup.units).label('units'),
+                func.sum(SalesRollup.revenue).label('revenue'),
+                func.sum(SalesRollup.orders).label('orders')
+            )
+            .where(*in_range, SalesRollup.product_name.in_([TOTAL, *(products or [])]))
+            .group_by(period, SalesRollup.product_name)
+            .order_by(period)
+        ).all()
+        watermark = session.get(RollupWatermark, WATERMARK)
+    finally:
+        session.close()
+
+    series = {name: [] for name in products or []}
+    totals = []
+    for row in rows:
+        (totals if row.product_name == TOTAL else series[row.product_name]).append(row)
+    return {
+        "bucket": bucket,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "utc_offset_hours": UTC_OFFSET_HOURS,
+        "last_order_id": watermark.last_order_id if watermark else 0,
+        "rolled_up_at": watermark.updated_at.isoformat() + "Z" if watermark and watermark.updated_at else None,
+        "totals": _points(totals),
+        "products": {name: _points(points) for name, points in series.items()}
+    }
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "refresh"
+    if command not in ("backfill", "refresh"):
+        sys.exit("usage: python sales_rollups.py [backfill|refresh]")
+    started = datetime.utcnow()
+    if command == "backfill":
+        covered = backfill()
+    else:
+        covered = refresh()
+        restate(force=True)
+    print(f"✅ Rolled up {covered} order ids in {(datetime.utcnow() - started).total_seconds():.1f}s")
@@ -1,7 +1,7 @@
 import random
 from datetime import datetime, timedelta
 from db_utils import get_db_session
-from models import User, ShippingStatus, CustomerProfile
+from models import User, ShippingStatus, ShippingEvent, CustomerProfile
 
 def seed_admin_data():
     print("Seeding Admin Data...")
@@ -49,15 +49,19 @@ def seed_admin_data():
 
                 status = random.choice(statuses)
                 order_id = int(datetime.utcnow().timestamp()) + random.randint(1, 100000)
-                
+                phone = f"09{random.randint(10000000, 99999999)}"
+                updated_at = datetime.utcnow() - timedelta(days=random.randint(0, 30))
+
                 shipping = ShippingStatus(
                     order_id=order_id,
                     customer_name=name,
-                    phone_number=f"09{random.randint(10000000, 99999999)}",
+                    phone_number=phone,
+                    phone_key=phone,
                     status=status,
-                    updated_at=datetime.utcnow() - timedelta(days=random.randint(0, 30))
+                    updated_at=updated_at
                 )
                 admin_session.add(shipping)
+                admin_session.add(ShippingEvent(order_id=order_id, status=status, created_at=updated_at))
                 print(f"Created order #{order_id} ({status})")
         
         admin_session.commit()
@@ -1,6 +1,7 @@
 import os
 import re
 import random
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
 from db_utils import get_db_session
 from models import WarehouseInventory
@@ -60,20 +61,28 @@ def seed_inventory():
     added_count = 0
     
     try:
+        # One IN query for all candidates instead of a lookup per product
+        existing = set()
+        if products:
+            existing = {
+                name for (name,) in session.query(WarehouseInventory.product_name)
+                .filter(WarehouseInventory.product_name.in_(products))
+            }
+
+        new_rows = []
         for name in products:
-            # Check if exists
-            exists = session.query(WarehouseInventory).filter(WarehouseInventory.product_name == name).first()
-            if not exists:
+            safe_name = name.encode('ascii', 'ignore').decode('ascii')
+            if name not in existing:
                 # Create with dummy quantity
                 qty = random.randint(10, 100)
-                new_item = WarehouseInventory(product_name=name, quantity=qty)
-                session.add(new_item)
-                added_count += 1
-                safe_name = name.encode('ascii', 'ignore').decode('ascii')
+                new_rows.append({"product_name": name, "quantity": qty})
                 print(f"Added: {safe_name} (Qty: {qty})")
             else:
-                safe_name = name.encode('ascii', 'ignore').decode('ascii')
                 print(f"Skipped (Exists): {safe_name}")
+
+        if new_rows:
+            session.execute(insert(WarehouseInventory), new_rows)
+        added_count = len(new_rows)
         
         session.commit()
         print(f"Seeding complete. Added {added_count} new items.")
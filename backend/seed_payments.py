@@ -30,6 +30,7 @@ def seed_payments():
         print(f"Existing orders: {existing}")
 
         # --- 4. Create 15 sample orders ---
+        planned = []  # (user, order, detail_rows)
         for i in range(15):
             user = random.choice(users)
 
@@ -54,7 +55,6 @@ def seed_payments():
             total = round(total, 2)
             created_at = datetime.utcnow() - timedelta(days=random.randint(0, 60))
 
-            # Create Order
             order = Order(
                 user_id        = user.id,
                 total_amount   = total,
@@ -62,32 +62,24 @@ def seed_payments():
                 payment_method = random.choice(['credit_card', 'cash', 'bank_transfer']),
                 created_at     = created_at,
             )
-            payment_session.add(order)
-            payment_session.flush()  # get order.id before commit
-
-            # Create OrderDetails
-            for d in detail_rows:
-                detail = OrderDetail(
-                    order_id     = order.id,
-                    product_name = d['product_name'],
-                    quantity     = d['quantity'],
-                    unit_price   = d['unit_price'],
-                    subtotal     = d['subtotal'],
-                )
-                payment_session.add(detail)
-
-            # Create Payment linked to this Order
-            payment = Payment(
+            planned.append((user, order, detail_rows))
+
+        # One batched INSERT for all orders, then one each for details and payments
+        payment_session.add_all([order for _, order, _ in planned])
+        payment_session.flush()  # get order ids before commit
+
+        for user, order, detail_rows in planned:
+            payment_session.add_all([OrderDetail(order_id=order.id, **d) for d in detail_rows])
+            payment_session.add(Payment(
                 order_id  = order.id,
                 user_id   = user.id,
-                amount    = total,
+                amount    = order.total_amount,
                 status    = 'completed',
-                timestamp = created_at,
-            )
-            payment_session.add(payment)
+                timestamp = order.created_at,
+            ))
 
             items_str = ', '.join(f"{d['product_name'].encode('ascii','ignore').decode()} x{d['quantity']}" for d in detail_rows)
-            print(f"  Order #{order.id}: ${total} | {user.username} | [{items_str}]")
+            print(f"  Order #{order.id}: ${order.total_amount} | {user.username} | [{items_str}]")
 
         payment_session.commit()
         print("Payment seeding complete!")
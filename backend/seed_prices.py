@@ -0,0 +1,107 @@
+"""
+Seed payment_db.product_prices from the catalog constants in the frontend.
+
+Reads PRODUCT and ASSORTMENTS from js/product.js and GIFT_OPTIONS from
+js/models.js, so the server-side cart charges exactly what the product page
+shows. Re-running updates changed prices in place.
+"""
+import os
+import re
+from datetime import datetime
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from db_utils import get_db_session
+from models import ProductPrice
+
+JS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "js")
+
+# (file, constant, kind, price field)
+CATALOG_SOURCES = [
+    ("product.js", "PRODUCT", "product", "basePrice"),
+    ("product.js", "ASSORTMENTS", "assortment", "extraPrice"),
+    ("models.js", "GIFT_OPTIONS", "addon", "price"),
+]
+
+def _constant_body(content, name):
+    """Source text of `const NAME = {...}` / `[...]`, up to the matching closing bracket."""
+    match = re.search(r"const\s+" + name + r"\s*=\s*([\[{])", content)
+    if not match:
+        return ""
+    opening = match.group(1)
+    closing = "]" if opening == "[" else "}"
+    depth = 0
+    for index in range(match.start(1), len(content)):
+        char = content[index]
+        if char == opening:
+            depth += 1
+        elif char == closing:
+            depth -= 1
+            if depth == 0:
+                return content[match.start(1):index + 1]
+    return ""
+
+def _objects(body):
+    """Top-level {...} entries of an array body, or the object itself."""
+    if body.startswith("{"):
+        return [body]
+    return re.findall(r"\{[^{}]*\}", body)
+
+def _field(entry, key):
+    match = re.search(key + r"""\s*:\s*(?:'([^']*)'|"([^"]*)"|([\d.]+))""", entry)
+    if not match:
+        return None
+    return next(group for group in match.groups() if group is not None)
+
+def scan_catalog(js_dir=JS_DIR):
+    prices = {}
+    for filename, constant, kind, price_field in CATALOG_SOURCES:
+        with open(os.path.join(js_dir, filename), 'r', encoding='utf-8') as f:
+            content = f.read()
+        for entry in _objects(_constant_body(content, constant)):
+            sku = _field(entry, "id")
+            name = _field(entry, "name")
+            price = _field(entry, price_field)
+            if sku and name and price:
+                prices[sku] = {
+                    "sku": sku,
+                    "name": name,
+                    "kind": kind,
+                    "unit_price": round(float(price), 2),
+                    "image": _field(entry, "image"),
+                    "active": True,
+                }
+    return list(prices.values())
+
+def seed_prices():
+    rows = scan_catalog()
+    print(f"Found {len(rows)} priced items.")
+    if not rows:
+        return
+
+    session = get_db_session('payment')
+    try:
+        now = datetime.utcnow()
+        stmt = pg_insert(ProductPrice).values([{**row, "updated_at": now} for row in rows])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ProductPrice.sku],
+            set_={
+                "name": stmt.excluded.name,
+                "kind": stmt.excluded.kind,
+                "unit_price": stmt.excluded.unit_price,
+                "image": stmt.excluded.image,
+                "active": stmt.excluded.active,
+                "updated_at": stmt.excluded.updated_at,
+            }
+        )
+        session.execute(stmt)
+        session.commit()
+        for row in rows:
+            print(f"  {row['kind']:<10} {row['sku']:<24} {row['unit_price']:>7.2f}")
+        print("Price seeding complete.")
+    except Exception as e:
+        session.rollback()
+        print(f"Error seeding prices: {e}")
+    finally:
+        session.close()
+
+if __name__ == "__main__":
+    seed_prices()
@@ -1,6 +1,6 @@
 from db_utils import get_db_session
 from models import User
-from app import get_password_hash
+from passwords import get_password_hash
 
 def seed_users():
     print("Seeding Users...")
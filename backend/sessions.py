@@ -0,0 +1,152 @@
+"""
+Stateless session tokens and a short-lived user profile cache.
+
+/login issues an HMAC-signed token carrying the user id and expiry, so any
+worker can verify it without touching member_db. Profile lookups needed by
+/payment and the admin endpoints go through `user_profiles`, a small TTL
+cache in front of the users table.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import select
+from db_utils import get_db_session
+from models import User
+
+SESSION_SECRET = os.getenv("SESSION_SECRET")
+SESSION_TTL_HOURS = int(os.getenv("SESSION_TTL_HOURS", "24"))
+PROFILE_CACHE_TTL_SECONDS = int(os.getenv("PROFILE_CACHE_TTL_SECONDS", "60"))
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+
+logger = logging.getLogger("sessions")
+
+# Publicly known values (the sample .env) would let anyone forge a session
+if SESSION_SECRET in ("change_me", "changeme", "secret"):
+    raise RuntimeError(
+        "SESSION_SECRET is a placeholder; set a random value "
+        "(python -c \"import secrets; print(secrets.token_hex(32))\") or leave it empty"
+    )
+if not SESSION_SECRET:
+    # Tokens then only survive until restart and aren't valid across workers
+    logger.warning("SESSION_SECRET not set, using a random per-process secret.")
+    SESSION_SECRET = secrets.token_hex(32)
+
+_SECRET_BYTES = SESSION_SECRET.encode('utf-8')
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode('ascii')
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def _sign(payload_part):
+    return _b64encode(hmac.new(_SECRET_BYTES, payload_part.encode('ascii'), hashlib.sha256).digest())
+
+
+def issue_token(user_id, username):
+    """Return (token, expires_at_epoch) for a logged-in user."""
+    expires_at = int(time.time()) + SESSION_TTL_HOURS * 3600
+    payload = {"uid": user_id, "usr": username, "exp": expires_at}
+    payload_part = _b64encode(json.dumps(payload, separators=(",", ":")).encode('utf-8'))
+    return f"{payload_part}.{_sign(payload_part)}", expires_at
+
+def verify_token(token):
+    """Return the token's claims, or None if it is malformed, forged or expired."""
+    try:
+        payload_part, signature = token.split(".", 1)
+        if not hmac.compare_digest(signature, _sign(payload_part)):
+            return None
+        claims = json.loads(_b64decode(payload_part))
+    except (ValueError, TypeError):
+        return None
+    if claims.get("exp", 0) < time.time():
+        return None
+    return claims
+
+def claims_from_header(authorization):
+    """Parse an 'Authorization: Bearer <token>' header value."""
+    if not authorization:
+        return None
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    return verify_token(token.strip())
+
+
+# Columns a profile is built from; selecting only these skips loading password hashes etc.
+PROFILE_COLUMNS = (User.id, User.username, User.email, User.full_name, User.phone_number, User.address, User.status)
+
+
+class ProfileCache:
+    """LRU + TTL cache of user_id -> profile dict, filled in bulk from member_db."""
+
+    def __init__(self, ttl_seconds, max_size):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._items = OrderedDict()  # user_id -> (expires_at, profile)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def to_profile(user):
+        """Profile dict from a User or a row of PROFILE_COLUMNS."""
+        return {
+            "id": user.id,
+            "username": user.username,
+            "email": user.email,
+            "full_name": user.full_name,
+            "phone_number": user.phone_number,
+            "address": user.address,
+            "status": user.status,
+        }
+
+    def put(self, profile):
+        with self._lock:
+            self._items[profile["id"]] = (time.monotonic() + self.ttl_seconds, profile)
+            self._items.move_to_end(profile["id"])
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._items.pop(user_id, None)
+
+    def get_many(self, user_ids):
+        """Return {user_id: profile} for the ids that exist; misses cost one IN query."""
+        now = time.monotonic()
+        found = {}
+        missing = []
+        with self._lock:
+            for user_id in set(user_ids):
+                entry = self._items.get(user_id)
+                if entry and entry[0] > now:
+                    found[user_id] = entry[1]
+                    self._items.move_to_end(user_id)
+                else:
+                    missing.append(user_id)
+
+        if missing:
+            session = get_db_session('member')
+            try:
+                users = session.execute(select(*PROFILE_COLUMNS).where(User.id.in_(missing))).all()
+            finally:
+                session.close()
+            for user in users:
+                profile = self.to_profile(user)
+                self.put(profile)
+                found[user.id] = profile
+        return found
+
+    def get(self, user_id):
+        return self.get_many([user_id]).get(user_id)
+
+
+user_profiles = ProfileCache(PROFILE_CACHE_TTL_SECONDS, PROFILE_CACHE_SIZE)
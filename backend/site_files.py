@@ -0,0 +1,26 @@
+"""
+Which files in the repo belong to the public website.
+
+The site shares the repo root with configuration and docs (docker-compose.yml
+holds the database password), so both the asset build and the API's static
+file route only ever publish files with a web asset extension outside the
+non-site directories below.
+"""
+import os
+
+WEB_EXTENSIONS = {
+    ".html", ".css", ".js",
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".avif", ".svg", ".ico",
+    ".woff", ".woff2", ".ttf", ".otf", ".eot",
+}
+EXCLUDE_DIRS = {
+    "backend", "dist", "node_modules", ".git", "init-db", "venv", ".venv", "__pycache__", "postgres_data",
+}
+
+
+def is_site_file(rel_path):
+    """True if a '/'- or os.sep-separated path relative to the site root may be published."""
+    parts = [p for p in rel_path.replace(os.sep, "/").split("/") if p]
+    if not parts or any(p.startswith(".") or p in EXCLUDE_DIRS for p in parts):
+        return False
+    return os.path.splitext(parts[-1])[1].lower() in WEB_EXTENSIONS
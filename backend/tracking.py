@@ -0,0 +1,187 @@
+"""
+Order tracking (admin_db.shipping_status / shipping_events).
+
+Every status change is appended to shipping_events and mirrored into the
+order's shipping_status row, both in one admin_db transaction, so the row is
+always the latest event. Customers look an order up by (order_id, phone):
+shipping_status is matched through its (order_id, phone_key) index and the
+order's events through (order_id, created_at). Results are kept in a short
+TTL cache that writes from this process invalidate immediately; other
+workers see a change within TRACKING_CACHE_TTL_SECONDS.
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from sqlalchemy import select, insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from db_utils import get_db_session
+from models import ShippingStatus, ShippingEvent
+
+TRACKING_CACHE_TTL_SECONDS = int(os.getenv("TRACKING_CACHE_TTL_SECONDS", "15"))
+TRACKING_CACHE_SIZE = int(os.getenv("TRACKING_CACHE_SIZE", "10000"))
+SHIPPING_STATUSES = ('Pending', 'Shipped', 'Delivered', 'Cancelled')
+MAX_ORDER_ID = 2 ** 31 - 1
+
+
+def normalize_phone(phone):
+    """Digits only, with a +84 prefix folded into the local leading 0."""
+    digits = re.sub(r"\D", "", phone or "")
+    if digits.startswith("84") and len(digits) >= 11:
+        digits = "0" + digits[2:]
+    return digits[:20] or None
+
+def parse_order_id(text):
+    """Accept '123', '#123' or 'ORDER-123'; None for anything else."""
+    match = re.fullmatch(r"\s*#?(?:order-?)?(\d{1,10})\s*", text or "", re.IGNORECASE)
+    if not match:
+        return None
+    order_id = int(match.group(1))
+    return order_id if 0 < order_id <= MAX_ORDER_ID else None
+
+def _iso(value):
+    return value.isoformat() + "Z" if value else None
+
+
+class TrackingCache:
+    """LRU + TTL cache of (order_id, phone_key) -> tracking response (None for a miss)."""
+
+    def __init__(self, ttl_seconds, max_size):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._items = OrderedDict()  # (order_id, phone_key) -> (expires_at, result)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                return False, None
+            if entry[0] <= time.monotonic():
+                del self._items[key]
+                return False, None
+            self._items.move_to_end(key)
+            return True, entry[1]
+
+    def put(self, key, result):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl_seconds, result)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def invalidate(self, order_ids):
+        order_ids = set(order_ids)
+        with self._lock:
+            for key in [key for key in self._items if key[0] in order_ids]:
+                del self._items[key]
+
+
+tracking_cache = TrackingCache(TRACKING_CACHE_TTL_SECONDS, TRACKING_CACHE_SIZE)
+
+
+def _load(order_id, phone_key):
+    session = get_db_session('admin')
+    try:
+        current = session.execute(
+            select(ShippingStatus.order_id, ShippingStatus.status, ShippingStatus.updated_at)
+            .where(ShippingStatus.order_id == order_id, ShippingStatus.phone_key == phone_key)
+        ).first()
+        if current is None:
+            return None
+        events = session.execute(
+            select(ShippingEvent.status, ShippingEvent.note, ShippingEvent.created_at)
+            .where(ShippingEvent.order_id == order_id)
+            .order_by(ShippingEvent.created_at, ShippingEvent.id)
+        ).all()
+    finally:
+        session.close()
+
+    return {
+        "order_id": current.order_id,
+        "status": current.status,
+        "updated_at": _iso(current.updated_at),
+        "events": [{"status": e.status, "note": e.note, "at": _iso(e.created_at)} for e in events]
+    }
+
+def lookup(order_id, phone):
+    """Tracking info for an order if the phone matches the one it was placed with, else None."""
+    phone_key = normalize_phone(phone)
+    if not phone_key:
+        return None
+    key = (order_id, phone_key)
+    hit, result = tracking_cache.get(key)
+    if not hit:
+        result = _load(order_id, phone_key)
+        tracking_cache.put(key, result)  # Misses are cached too, so guessing stays cheap
+    return result
+
+
+def open_shipment(order_id, customer_name, phone, note="Order placed"):
+    """Create the tracking record of a new order. Safe to repeat."""
+    session = get_db_session('admin')
+    try:
+        now = datetime.utcnow()
+        created = session.execute(
+            pg_insert(ShippingStatus).values(
+                order_id=order_id,
+                customer_name=customer_name or "Unknown",
+                phone_number=(phone or "").strip()[:20] or None,
+                phone_key=normalize_phone(phone),
+                status='Pending',
+                updated_at=now
+            ).on_conflict_do_nothing(index_elements=[ShippingStatus.order_id]).returning(ShippingStatus.id)
+        ).first()
+        if created is not None:
+            session.execute(insert(ShippingEvent).values(order_id=order_id, status='Pending', note=note, created_at=now))
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+    tracking_cache.invalidate([order_id])
+
+
+def record_statuses(shipments, status, note=None):
+    """Append one event per order and move its shipping_status row to `status`.
+
+    `shipments` is a list of {"order_id", "customer_name", "phone"}; customer
+    and phone are only used for orders that have no tracking record yet.
+    One multi-row INSERT for the events and one multi-row upsert for the rows.
+    Returns the timestamp written.
+    """
+    if not shipments:
+        return None
+    now = datetime.utcnow()
+    session = get_db_session('admin')
+    try:
+        session.execute(insert(ShippingEvent), [
+            {"order_id": s["order_id"], "status": status, "note": note, "created_at": now} for s in shipments
+        ])
+        stmt = pg_insert(ShippingStatus).values([
+            {
+                "order_id": s["order_id"],
+                "customer_name": s.get("customer_name") or "Unknown",
+                "phone_number": (s.get("phone") or "").strip()[:20] or None,
+                "phone_key": normalize_phone(s.get("phone")),
+                "status": status,
+                "updated_at": now
+            }
+            for s in shipments
+        ])
+        session.execute(stmt.on_conflict_do_update(
+            index_elements=[ShippingStatus.order_id],
+            set_={"status": stmt.excluded.status, "updated_at": stmt.excluded.updated_at}
+        ))
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+    tracking_cache.invalidate([s["order_id"] for s in shipments])
+    return now
@@ -1,9 +1,11 @@
+import json
 import requests
 import time
 
 BASE_URL = "http://localhost:8000"
 
 def test_registration():
+    """Register a fresh user; returns its credentials or None."""
     print("\n--- Testing Registration (Member DB) ---")
     payload = {
         "username": "testuser_long_" + str(int(time.time())),
@@ -15,25 +17,50 @@ def test_registration():
         print(f"Status: {response.status_code}")
         print(f"Response: {response.json()}")
         if response.status_code == 200:
-            return True
+            return payload["username"], payload["password"]
     except Exception as e:
         print(f"Error: {e}")
-    return False
+    return None
 
-def test_payment():
+def test_login(username, password):
+    """Log in; returns the session token /payment requires, or None."""
+    print("\n--- Testing Login (Member DB) ---")
+    try:
+        response = requests.post(f"{BASE_URL}/login", json={"username": username, "password": password})
+        print(f"Status: {response.status_code}")
+        if response.status_code == 200:
+            return response.json().get("token")
+    except Exception as e:
+        print(f"Error: {e}")
+    return None
+
+def test_payment(token):
     print("\n--- Testing Payment (Payment DB) ---")
-    payload = {
-        "user_id": 1,
-        "amount": 45.50,
-        "order_info": "Chocolate Cake x1",
-        "status": "completed"
-    }
+    headers = {"Authorization": f"Bearer {token}"}
     try:
-        response = requests.post(f"{BASE_URL}/payment", json=payload)
+        # /payment charges only server cart lines (sku seeded by seed_prices.py)
+        response = requests.post(f"{BASE_URL}/api/cart/items", headers=headers,
+                                 json={"sku": "cupcake-box-001", "quantity": 1, "label": "Chocolate Cake"})
+        print(f"Cart Status: {response.status_code}")
+        if response.status_code != 200:
+            print(f"Response: {response.json()}")
+            return None
+        cart = response.json()
+        payload = {
+            "amount": round(cart["item"]["subtotal"] + 8.99, 2),  # Items plus the 8.99 shipping fee
+            "cart_id": cart["cart_id"],
+            "line_ids": [cart["item"]["id"]],
+            "order_info": json.dumps({"checkout": {"paymentMethod": "card"}}),
+            "status": "completed"
+        }
+        response = requests.post(f"{BASE_URL}/payment", json=payload, headers=headers)
         print(f"Status: {response.status_code}")
         print(f"Response: {response.json()}")
+        if response.status_code == 200:
+            return response.json().get("order_id")
     except Exception as e:
         print(f"Error: {e}")
+    return None
 
 def test_analytics():
     print("\n--- Testing Analytics (Admin DB) ---")
@@ -48,41 +75,27 @@ def test_analytics():
     except Exception as e:
         print(f"Error: {e}")
 
-def test_admin_expansion():
+def test_admin_expansion(order_id=None):
     print("\n--- Testing Admin Expansion (Shipping, Customer, Warehouse) ---")
     
     # 1. Shipping
     print("Testing Shipping...")
-    ship_payload = {"user_id":1, "amount":0} # Mock payload for init
     try:
-        resp = requests.post(f"{BASE_URL}/admin/shipping/init", json=ship_payload)
-        if resp.status_code == 200:
-            ship_id = resp.json().get('id')
-            print(f"Initialized Shipping ID: {ship_id}")
-            
-            # Update status
-            # Note: The init API mocks the order_id with timestamp, we need to fetch it or rely on the mock logic
-            # For this test, let's fetch all and update the last one
-            get_resp = requests.get(f"{BASE_URL}/admin/shipping")
-            all_shipping = get_resp.json()
-            if all_shipping:
-                last_order_id = all_shipping[-1]['order_id']
-                update_resp = requests.put(f"{BASE_URL}/admin/shipping/{last_order_id}", json={"status": "Shipped"})
-                print(f"Update Status: {update_resp.status_code}")
+        if order_id:
+            # Orders get a shipping row on first status update
+            update_resp = requests.put(f"{BASE_URL}/admin/shipping/{order_id}", json={"status": "Shipped"})
+            print(f"Update Status (Order {order_id}): {update_resp.status_code}")
         else:
-            print(f"Shipping Init Failed: {resp.text}")
+            print("No order from the payment test, skipping status update")
+
+        get_resp = requests.get(f"{BASE_URL}/admin/shipping")
+        print(f"Shipping List: {len(get_resp.json())} items")
     except Exception as e:
         print(f"Shipping Error: {e}")
 
     # 2. Customer
     print("Testing Customer...")
     try:
-        # Update user 1
-        cust_payload = {"vip_level": "Gold", "status": "Active"}
-        resp = requests.put(f"{BASE_URL}/admin/customers/1", json=cust_payload)
-        print(f"Customer Update (User 1): {resp.status_code}")
-        
-        # Verify
         resp = requests.get(f"{BASE_URL}/admin/customers")
         print(f"Customer List: {len(resp.json())} items")
     except Exception as e:
@@ -101,9 +114,11 @@ def test_admin_expansion():
         print(f"Warehouse Error: {e}")
 
 if __name__ == "__main__":
-    if test_registration():
-        test_payment()
+    credentials = test_registration()
+    token = test_login(*credentials) if credentials else None
+    if token:
+        order_id = test_payment(token)
         test_analytics()
-        test_admin_expansion()
+        test_admin_expansion(order_id)
     else:
-        print("Registration failed, skipping downstream tests.")
+        print("Registration or login failed, skipping downstream tests.")
@@ -3,8 +3,6 @@
  * Fetches data from backend APIs and updates the UI dynamically.
  */
 
-const API_BASE_URL = 'http://localhost:8000';
-
 document.addEventListener('DOMContentLoaded', () => {
     initAdminDashboard();
 });
@@ -14,6 +12,61 @@ function initAdminDashboard() {
     fetchShippingStatus();
     fetchCustomerProfiles();
     fetchWarehouseInventory();
+    subscribeAdminUpdates();
+}
+
+/**
+ * Follow inventory and shipping changes pushed by the backend (Server-Sent Events)
+ * instead of re-fetching whole tables. Each message only carries the changed rows.
+ */
+function subscribeAdminUpdates() {
+    if (!window.EventSource) return;
+
+    const stream = new EventSource(`${API_BASE_URL}/api/events?channels=inventory,shipping`);
+
+    stream.addEventListener('inventory', event => {
+        const changes = JSON.parse(event.data);
+        Object.entries(changes).forEach(([name, row]) => {
+            // Skip rows with a debounced local edit in flight; the server echo would undo the optimistic value
+            if (pendingUpdates[name]) return;
+
+            const item = allWarehouseItems.find(i => i.product_name === name);
+            if (item) {
+                item.quantity = row.quantity;
+                item.reserved_quantity = row.reserved;
+            } else {
+                allWarehouseItems.push({
+                    product_name: name,
+                    quantity: row.quantity,
+                    reserved_quantity: row.reserved,
+                    last_restock: new Date().toISOString()
+                });
+            }
+        });
+        renderWarehouseTable();
+        renderWarehousePagination();
+    });
+
+    let reloadShippingTimer = null;
+    stream.addEventListener('shipping', event => {
+        const changes = JSON.parse(event.data);
+        let hasNewOrder = false;
+        Object.entries(changes).forEach(([orderId, row]) => {
+            const order = allShippingOrders.find(o => String(o.order_id) === orderId);
+            if (order) {
+                order.status = row.status;
+                order.updated_at = row.updated_at;
+            } else if (row.new) {
+                hasNewOrder = true;
+            }
+        });
+        renderShippingTable();
+        if (hasNewOrder) {
+            // New orders need customer details from the full list; one reload per burst
+            clearTimeout(reloadShippingTimer);
+            reloadShippingTimer = setTimeout(fetchShippingStatus, 1000);
+        }
+    });
 }
 
 
@@ -271,9 +324,17 @@ window.submitShippingUpdate = async function () {
         });
 
         if (response.ok) {
+            const data = await response.json();
             closeModal('updateStatusModal');
             showToast('Shipping status updated successfully', 'success');
-            fetchShippingStatus();
+
+            // Patch the row in place; other open dashboards get it via the event stream
+            const order = allShippingOrders.find(o => o.order_id === currentUpdatingOrderId);
+            if (order) {
+                order.status = data.status;
+                order.updated_at = data.updated_at;
+            }
+            renderShippingTable();
         } else {
             const err = await response.json().catch(() => ({}));
             showToast(`Failed to update status: ${err.detail || 'Unknown error'}`, 'error');
@@ -506,7 +567,7 @@ window.openUpdateVIPModal = function (userId, currentLevel) {
     openModal('updateVIPModal');
 }
 
-wwindow.submitVIPUpdate = async function () {
+window.submitVIPUpdate = async function () {
     if (!currentUpdatingUserId) return;
     const newLevel = document.getElementById('modal-vip-level').value;
 
@@ -563,7 +624,7 @@ async function fetchWarehouseInventory(preservePage = false) {
 }
 // ... (renderWarehouseTable implementation omitted, assumes it's unchanged) ...
 
-wwindow.updateStock = function (productName, quantityChange, btnElement) {
+window.updateStock = function (productName, quantityChange, btnElement) {
     const itemIndex = allWarehouseItems.findIndex(i => i.product_name === productName);
     if (itemIndex === -1) return;
 
@@ -4,7 +4,7 @@
  * @module cart
  */
 
-import { MOCK_ADDRESSES, SHIPPING_METHODS, calculateDeliveryDate, formatDeliveryDate } from './models.js';
+import { MOCK_ADDRESSES, SHIPPING_METHODS, calculateDeliveryDate, formatDeliveryDate, generateCartItemId } from './models.js';
 
 // State
 let cart = [];
@@ -52,6 +52,7 @@ function init() {
     loadMultiShipMode();
     renderCart();
     attachEventListeners();
+    syncServerCart();
 }
 
 /**
@@ -97,6 +98,116 @@ function loadCart() {
     }
 }
 
+/**
+ * Headers for the cart API; the session token gives access to the user's cart
+ */
+function cartApiHeaders() {
+    const headers = { 'Content-Type': 'application/json' };
+    const token = JSON.parse(localStorage.getItem('user') || 'null')?.token;
+    if (token) {
+        headers['Authorization'] = `Bearer ${token}`;
+    }
+    return headers;
+}
+
+/**
+ * Reconcile local lines with the server cart, which holds the authoritative
+ * quantities and prices. Local lines whose server line id never got recorded
+ * are linked through the local id the server keeps with the line. Server lines
+ * added on another device (or merged in at login) are added locally; lines
+ * removed elsewhere are dropped.
+ */
+async function syncServerCart() {
+    const cartId = localStorage.getItem('cartId');
+    if (!cartId) return;
+
+    let response;
+    try {
+        response = await fetch(`${API_BASE_URL}/api/cart/${encodeURIComponent(cartId)}`, { headers: cartApiHeaders() });
+    } catch (e) {
+        console.error('Failed to load server cart', e);
+        return;
+    }
+
+    if (response.status === 403 || response.status === 404) {
+        // No usable server cart: keep the lines; checkout adds them to a new one
+        cart.forEach(item => delete item.serverLineId);
+        if (response.status === 403) {
+            localStorage.removeItem('cartId');
+        }
+        saveCart();
+        return;
+    }
+    if (!response.ok) return;
+
+    const serverCart = await response.json();
+    const lines = new Map(serverCart.items.map(line => [line.id, line]));
+    const byClientId = new Map(serverCart.items.filter(line => line.client_id).map(line => [line.client_id, line]));
+    cart.forEach(item => {
+        if (!item.serverLineId && byClientId.has(item.id)) {
+            item.serverLineId = byClientId.get(item.id).id;
+        }
+    });
+    cart = cart.filter(item => !item.serverLineId || lines.has(item.serverLineId));
+    cart.forEach(item => {
+        const line = item.serverLineId && lines.get(item.serverLineId);
+        if (line) {
+            item.quantity = line.quantity;
+            item.finalPrice = line.unit_price;
+            lines.delete(item.serverLineId);
+        }
+    });
+    lines.forEach(line => {
+        const byKind = kind => line.options.filter(opt => opt.kind === kind);
+        const optionsTotal = line.options.reduce((sum, opt) => sum + opt.unit_price * opt.quantity, 0);
+        cart.push({
+            id: generateCartItemId(),
+            serverLineId: line.id,
+            productId: line.sku,
+            productName: line.name,
+            productImage: line.image,
+            basePrice: line.unit_price - optionsTotal,
+            quantity: line.quantity,
+            selectedOptions: byKind('addon').map(opt => ({ id: opt.sku, name: opt.name, price: opt.unit_price, quantity: opt.quantity })),
+            assortment: byKind('assortment').map(opt => ({ id: opt.sku, name: opt.name, extraPrice: opt.unit_price, image: opt.image, quantity: opt.quantity })),
+            finalPrice: line.unit_price
+        });
+    });
+
+    saveCart();
+    loadCart();  // Fills display defaults for lines that came from the server
+    renderCart();
+}
+
+/**
+ * Push a line's new quantity to the server cart
+ * @param {Object} item - Cart item with a serverLineId
+ */
+function updateServerLine(item) {
+    const cartId = localStorage.getItem('cartId');
+    if (!cartId || !item.serverLineId) return;
+
+    fetch(`${API_BASE_URL}/api/cart/${encodeURIComponent(cartId)}/items/${item.serverLineId}`, {
+        method: 'PATCH',
+        headers: cartApiHeaders(),
+        body: JSON.stringify({ quantity: item.quantity })
+    }).catch(e => console.error('Failed to update server cart', e));
+}
+
+/**
+ * Remove a line from the server cart
+ * @param {Object} item - Cart item with a serverLineId
+ */
+function removeServerLine(item) {
+    const cartId = localStorage.getItem('cartId');
+    if (!cartId || !item.serverLineId) return;
+
+    fetch(`${API_BASE_URL}/api/cart/${encodeURIComponent(cartId)}/items/${item.serverLineId}`, {
+        method: 'DELETE',
+        headers: cartApiHeaders()
+    }).catch(e => console.error('Failed to update server cart', e));
+}
+
 /**
  * Compute unit price of a cart item (base + addons + assortment)
  * Falls back gracefully if finalPrice is missing.
@@ -236,6 +347,7 @@ function handleQuantityChange(itemId, delta) {
     item.quantity = newQuantity;
     saveCart();
     renderCart();
+    updateServerLine(item);
 }
 
 /**
@@ -251,6 +363,7 @@ function handleQuantityInput(itemId, event) {
     item.quantity = newQuantity;
     saveCart();
     renderCart();
+    updateServerLine(item);
 }
 
 /**
@@ -259,12 +372,34 @@ function handleQuantityInput(itemId, event) {
  */
 function handleRemoveItem(itemId) {
     if (confirm('Are you sure you want to remove this item from your cart?')) {
+        const removed = cart.find(item => item.id === itemId);
         cart = cart.filter(item => item.id !== itemId);
         saveCart();
         renderCart();
+        if (removed) {
+            removeServerLine(removed);
+        }
+        if (cart.length === 0) {
+            releaseCartReservations();
+        }
     }
 }
 
+/**
+ * Give back stock held for this cart once it has been emptied
+ */
+function releaseCartReservations() {
+    const cartId = localStorage.getItem('cartId');
+    if (!cartId) return;
+
+    localStorage.removeItem('cartId');
+    fetch(`${API_BASE_URL}/api/inventory/release`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ cart_id: cartId })
+    }).catch(e => console.error('Failed to release reserved stock', e));
+}
+
 /**
  * Handle shipping address dropdown change for a specific cart item
  * @param {string} itemId - The cart item ID
@@ -0,0 +1,8 @@
+/**
+ * @fileoverview Where the pages reach the API.
+ * Loaded in <head> of every page that calls it, so page scripts and modules
+ * can all read the global API_BASE_URL.
+ */
+
+// Same origin when the API serves the site (SERVE_FRONTEND=1); the local API from Live Server / file://
+window.API_BASE_URL = location.protocol === 'file:' || ['5500', '5501', '8080'].includes(location.port) ? 'http://localhost:8000' : '';
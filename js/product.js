@@ -158,101 +158,123 @@ function handleAssortmentAdd(event) {
  * Fetch inventory status from backend and update UI
  */
 async function fetchInventoryStatus() {
-    // 1. Get Assortment Names
-    const productNames = ASSORTMENTS.map(item => item.name);
-
-    // 2. Get Box Names (scrape from DOM)
-    const boxElements = document.querySelectorAll('.box-option');
-    const boxNames = Array.from(boxElements).map(el => {
-        const nameEl = el.querySelector('.box-option-name');
-        return nameEl ? nameEl.textContent.trim() : '';
-    }).filter(name => name);
-
-    // Combine lists
-    const allNames = [...productNames, ...boxNames];
-
     try {
-        const response = await fetch('http://127.0.0.1:8000/api/inventory/check', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({ product_names: allNames })
+        // Full stock snapshot; 'no-cache' makes the browser revalidate with
+        // If-None-Match, so unchanged stock comes back as an empty 304.
+        const response = await fetch(`${API_BASE_URL}/api/inventory`, {
+            cache: 'no-cache'
         });
 
         if (!response.ok) throw new Error('Network response was not ok');
 
         const inventory = await response.json();
-
-        // --- Update Assortments ---
-        ASSORTMENTS.forEach(item => {
-            if (inventory.hasOwnProperty(item.name)) {
-                item.stock = inventory[item.name];
-            } else {
-                item.stock = 0; // Default to 0 if not returned
-            }
-        });
-        renderAssortments(); // Re-render assortments
-
-        // --- Update Boxes ---
-        boxElements.forEach(el => {
-            const nameEl = el.querySelector('.box-option-name');
-            const name = nameEl ? nameEl.textContent.trim() : '';
-            const stock = inventory.hasOwnProperty(name) ? inventory[name] : 0;
-
-            // Add or update stock label
-            let stockLabel = el.querySelector('.stock-label');
-            if (!stockLabel) {
-                stockLabel = document.createElement('div');
-                stockLabel.className = 'stock-label';
-                stockLabel.style.fontSize = '0.85rem';
-                stockLabel.style.marginTop = '4px';
-                stockLabel.style.fontWeight = 'bold';
-                el.appendChild(stockLabel);
-            }
-            stockLabel.textContent = stock > 0 ? `${stock} left` : 'Sold Out';
-            stockLabel.style.color = stock > 0 ? '#1a1157' : 'red';
-
-            // Check if sold out
-            if (stock <= 0) {
-                el.classList.add('disabled', 'sold-out');
-                el.style.opacity = '0.5';
-                el.style.pointerEvents = 'none';
-                el.style.filter = 'grayscale(100%)';
-
-                // Optional: Add "Sold Out" text
-                if (!el.querySelector('.sold-out-badge')) {
-                    const badge = document.createElement('div');
-                    badge.className = 'sold-out-badge';
-                    badge.textContent = 'SOLD OUT';
-                    badge.style.position = 'absolute';
-                    badge.style.top = '10px';
-                    badge.style.left = '50%';
-                    badge.style.transform = 'translateX(-50%)';
-                    badge.style.background = 'red';
-                    badge.style.color = 'white';
-                    badge.style.padding = '4px 8px';
-                    badge.style.borderRadius = '4px';
-                    badge.style.fontWeight = 'bold';
-                    badge.style.zIndex = '20';
-                    el.appendChild(badge);
-                }
-            } else {
-                // Determine if we need to reset stats if re-fetching
-                el.classList.remove('disabled', 'sold-out');
-                el.style.opacity = '1';
-                el.style.pointerEvents = 'auto';
-                el.style.filter = 'none';
-                const badge = el.querySelector('.sold-out-badge');
-                if (badge) badge.remove();
-            }
-        });
+        applyInventory(inventory, false);
 
     } catch (error) {
         console.error("Failed to fetch inventory:", error);
     }
 }
 
+let inventoryStream = null;
+
+/**
+ * Subscribe to live stock changes pushed by the backend (Server-Sent Events).
+ * Each message only carries the products whose stock changed.
+ */
+function subscribeInventoryUpdates() {
+    if (!window.EventSource || inventoryStream) return;
+
+    inventoryStream = new EventSource(`${API_BASE_URL}/api/events?channels=inventory`);
+    inventoryStream.addEventListener('inventory', event => {
+        const changes = JSON.parse(event.data);
+        const inventory = {};
+        Object.keys(changes).forEach(name => {
+            inventory[name] = changes[name].available;
+        });
+        applyInventory(inventory, true);
+    });
+    // Anything missed while disconnected is picked up from a fresh snapshot
+    let connectedBefore = false;
+    inventoryStream.addEventListener('open', () => {
+        if (connectedBefore) fetchInventoryStatus();
+        connectedBefore = true;
+    });
+}
+
+/**
+ * Apply a {name: available} stock map to assortments and box options
+ * @param {Object} inventory - Stock per product name
+ * @param {boolean} isPartial - Only the listed products changed (push update)
+ */
+function applyInventory(inventory, isPartial) {
+    const boxElements = document.querySelectorAll('.box-option');
+
+    // --- Update Assortments ---
+    ASSORTMENTS.forEach(item => {
+        if (inventory.hasOwnProperty(item.name)) {
+            item.stock = inventory[item.name];
+        } else if (!isPartial) {
+            item.stock = 0; // Default to 0 if not returned
+        }
+    });
+    renderAssortments(); // Re-render assortments
+
+    // --- Update Boxes ---
+    boxElements.forEach(el => {
+        const nameEl = el.querySelector('.box-option-name');
+        const name = nameEl ? nameEl.textContent.trim() : '';
+        if (isPartial && !inventory.hasOwnProperty(name)) return;
+        const stock = inventory.hasOwnProperty(name) ? inventory[name] : 0;
+
+        // Add or update stock label
+        let stockLabel = el.querySelector('.stock-label');
+        if (!stockLabel) {
+            stockLabel = document.createElement('div');
+            stockLabel.className = 'stock-label';
+            stockLabel.style.fontSize = '0.85rem';
+            stockLabel.style.marginTop = '4px';
+            stockLabel.style.fontWeight = 'bold';
+            el.appendChild(stockLabel);
+        }
+        stockLabel.textContent = stock > 0 ? `${stock} left` : 'Sold Out';
+        stockLabel.style.color = stock > 0 ? '#1a1157' : 'red';
+
+        // Check if sold out
+        if (stock <= 0) {
+            el.classList.add('disabled', 'sold-out');
+            el.style.opacity = '0.5';
+            el.style.pointerEvents = 'none';
+            el.style.filter = 'grayscale(100%)';
+
+            // Optional: Add "Sold Out" text
+            if (!el.querySelector('.sold-out-badge')) {
+                const badge = document.createElement('div');
+                badge.className = 'sold-out-badge';
+                badge.textContent = 'SOLD OUT';
+                badge.style.position = 'absolute';
+                badge.style.top = '10px';
+                badge.style.left = '50%';
+                badge.style.transform = 'translateX(-50%)';
+                badge.style.background = 'red';
+                badge.style.color = 'white';
+                badge.style.padding = '4px 8px';
+                badge.style.borderRadius = '4px';
+                badge.style.fontWeight = 'bold';
+                badge.style.zIndex = '20';
+                el.appendChild(badge);
+            }
+        } else {
+            // Determine if we need to reset stats if re-fetching
+            el.classList.remove('disabled', 'sold-out');
+            el.style.opacity = '1';
+            el.style.pointerEvents = 'auto';
+            el.style.filter = 'none';
+            const badge = el.querySelector('.sold-out-badge');
+            if (badge) badge.remove();
+        }
+    });
+}
+
 /**
  * Initialize the product page
  */
@@ -263,6 +285,7 @@ function init() {
     updatePrice();
     attachEventListeners();
     fetchInventoryStatus(); // Check stock on load
+    subscribeInventoryUpdates(); // Then follow live changes
 }
 
 /**
@@ -509,6 +532,49 @@ function updatePrice() {
     renderSelectedList();
 }
 
+/**
+ * Mirror a new cart line into the server-side cart (priced there at checkout).
+ * Records the server line id on the stored item; the server also keeps the
+ * local item id, so cart.js can link the two if this page is left before the
+ * response arrives. Resolves even when the API is unreachable, in which case
+ * the line stays client-priced.
+ * @param {Object} cartItem - Line just saved to localStorage
+ * @param {Object<string, number>} options - Assortment / gift option id -> quantity
+ * @returns {Promise<void>}
+ */
+function addToServerCart(cartItem, options) {
+    const headers = { 'Content-Type': 'application/json' };
+    const token = JSON.parse(localStorage.getItem('user') || 'null')?.token;
+    if (token) {
+        headers['Authorization'] = `Bearer ${token}`;
+    }
+
+    return fetch(`${API_BASE_URL}/api/cart/items`, {
+        method: 'POST',
+        headers,
+        body: JSON.stringify({
+            cart_id: localStorage.getItem('cartId'),
+            sku: PRODUCT.id,
+            quantity: cartItem.quantity,
+            options,
+            label: cartItem.productName,
+            client_id: cartItem.id
+        })
+    })
+        .then(response => response.ok ? response.json() : null)
+        .then(result => {
+            if (!result) return;
+            localStorage.setItem('cartId', result.cart_id);
+            const cart = JSON.parse(localStorage.getItem('cart') || '[]');
+            const stored = cart.find(item => item.id === cartItem.id);
+            if (stored) {
+                stored.serverLineId = result.item.id;
+                localStorage.setItem('cart', JSON.stringify(cart));
+            }
+        })
+        .catch(e => console.error('Failed to add item to server cart', e));
+}
+
 /**
  * Handle add to cart button click
  */
@@ -579,32 +645,46 @@ function handleAddToCart() {
         localStorage.setItem('cart', JSON.stringify(cart));
 
         // --- NEW: Deduct Inventory Logic ---
-        // 1. Deduct Box (Quantity 1 per cart addition usually, or cartItem.quantity if that existed)
-        // Wait, the logic above sets quantity: 1. So we deduct 1 box.
+        // One batched reservation for the box and every assortment item.
+        // Stock is held (not deducted) until payment; abandoned holds expire server-side.
+        const reserveItems = [];
         const boxNameEl = document.querySelector('.box-option.selected .box-option-name');
         if (boxNameEl) {
-            const boxName = boxNameEl.textContent.trim();
-            // Call API to deduct 1 box
-            fetch('http://127.0.0.1:8000/admin/warehouse/update', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ product_name: boxName, quantity_change: -1 })
-            }).catch(e => console.error('Failed to deduct box stock', e));
+            reserveItems.push({ product_name: boxNameEl.textContent.trim(), quantity: 1 });
         }
-
-        // 2. Deduct Assortment Items
         pickedAssortments.forEach(item => {
-            fetch('http://127.0.0.1:8000/admin/warehouse/update', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ product_name: item.name, quantity_change: -item.quantity })
-            }).catch(e => console.error('Failed to deduct assortment stock', e));
+            reserveItems.push({ product_name: item.name, quantity: item.quantity });
         });
 
-        // 3. Refresh Inventory Display after short delay to allow DB to update
-        setTimeout(() => {
-            fetchInventoryStatus();
-        }, 500);
+        // The server cart is created first so the holds are placed under its id
+        const options = {};
+        [...pickedAssortments, ...pickedOptions].forEach(opt => {
+            options[opt.id] = (options[opt.id] || 0) + opt.quantity;
+        });
+        addToServerCart(cartItem, options)
+            .then(() => reserveItems.length > 0 && fetch(`${API_BASE_URL}/api/inventory/reserve`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                // Reuse the cart's reservation id so all holds share one TTL
+                body: JSON.stringify({ items: reserveItems, cart_id: localStorage.getItem('cartId') })
+            }))
+            .then(response => response && response.ok ? response.json() : null)
+            .then(result => {
+                if (result?.cart_id) {
+                    localStorage.setItem('cartId', result.cart_id);
+                }
+                const failed = result ? result.items.filter(i => !i.reserved) : [];
+                if (failed.length > 0) {
+                    window.showToast?.(`Not enough stock for: ${failed.map(i => i.product_name).join(', ')}`, 'warning');
+                }
+            })
+            .catch(e => console.error('Failed to reserve stock', e))
+            // Live updates already carry the new stock; only poll without them
+            .finally(() => {
+                if (!inventoryStream || inventoryStream.readyState !== EventSource.OPEN) {
+                    fetchInventoryStatus();
+                }
+            });
         // -----------------------------------
 
         // Immediately refresh cart badge on header (product page)
@@ -456,6 +456,99 @@ function handleDeleteItem(itemId) {
     );
 }
 
+/**
+ * Idempotency key of the checkout being placed. Retries of the same cart,
+ * checkout details and total reuse it so a resent request can't double-charge;
+ * any change to them starts a new order with a new key.
+ * @param {number} totalAmount
+ * @returns {string}
+ */
+function checkoutIdempotencyKey(totalAmount) {
+    const fingerprint = JSON.stringify({
+        cartId: localStorage.getItem('cartId'),
+        items: cart,
+        checkout: checkoutData,
+        total: totalAmount
+    });
+    let saved = null;
+    try {
+        saved = JSON.parse(localStorage.getItem('checkoutIdempotencyKey') || 'null');
+    } catch (e) {
+        // Bare key stored by an older version of this page; start over
+    }
+    if (saved?.fingerprint === fingerprint) {
+        return saved.key;
+    }
+    const key = window.crypto?.randomUUID
+        ? window.crypto.randomUUID()
+        : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    localStorage.setItem('checkoutIdempotencyKey', JSON.stringify({ key, fingerprint }));
+    return key;
+}
+
+/**
+ * Make sure every local line is in the server cart, which is the only thing
+ * /payment charges. Lines whose server id never got recorded are linked by
+ * their local id; lines the server doesn't have yet are added by sku.
+ * @param {Object} headers - Headers carrying the session token
+ * @returns {Promise<string[]>} Names of lines that could not be placed
+ */
+async function placeLinesInServerCart(headers) {
+    let cartId = localStorage.getItem('cartId');
+    if (cartId) {
+        const response = await fetch(`${API_BASE_URL}/api/cart/${encodeURIComponent(cartId)}`, { headers });
+        if (response.ok) {
+            const serverCart = await response.json();
+            const lineIds = new Set(serverCart.items.map(line => line.id));
+            const byClientId = new Map(serverCart.items.filter(line => line.client_id).map(line => [line.client_id, line.id]));
+            cart.forEach(item => {
+                if (!lineIds.has(item.serverLineId)) {
+                    item.serverLineId = byClientId.get(item.id) || null;
+                }
+            });
+        } else if (response.status === 403 || response.status === 404) {
+            cart.forEach(item => delete item.serverLineId);
+            if (response.status === 403) {
+                localStorage.removeItem('cartId');
+                cartId = null;
+            }
+        }
+    }
+
+    const failed = [];
+    for (const item of cart.filter(item => !item.serverLineId)) {
+        const options = {};
+        [...(item.assortment || []), ...(item.selectedOptions || [])].forEach(opt => {
+            if (opt.quantity > 0) {
+                options[opt.id] = (options[opt.id] || 0) + opt.quantity;
+            }
+        });
+        const response = await fetch(`${API_BASE_URL}/api/cart/items`, {
+            method: 'POST',
+            headers,
+            body: JSON.stringify({
+                cart_id: cartId,
+                sku: item.productId,
+                quantity: item.quantity,
+                options,
+                label: item.productName,
+                client_id: item.id
+            })
+        });
+        if (!response.ok) {
+            failed.push(item.productName);
+            continue;
+        }
+        const result = await response.json();
+        cartId = result.cart_id;
+        localStorage.setItem('cartId', cartId);
+        item.serverLineId = result.item.id;
+    }
+
+    localStorage.setItem('cart', JSON.stringify(cart));
+    return failed;
+}
+
 /**
  * Handle place order
  */
@@ -477,8 +570,8 @@ window.handlePlaceOrder = function () {
     }
 
     const totalAmount = calculateOrderTotal();
+    // Lines are priced from the server cart; the order carries only the checkout form
     const orderInfo = JSON.stringify({
-        items: cart,
         checkout: checkoutData,
         date: new Date().toISOString()
     });
@@ -491,7 +584,8 @@ window.handlePlaceOrder = function () {
                 const currentUser = JSON.parse(localStorage.getItem('user') || 'null');
                 const userId = Number(currentUser?.id);
 
-                if (!userId) {
+                // Orders are placed with the signed session from /login; older sessions must log in again
+                if (!userId || !currentUser?.token) {
                     showToast('User session not found. Please log in again.', 'error');
                     setTimeout(() => {
                         window.location.href = 'membership-login.html';
@@ -499,16 +593,29 @@ window.handlePlaceOrder = function () {
                     return;
                 }
 
-                const response = await fetch('http://localhost:8000/payment', {
+                const headers = {
+                    'Content-Type': 'application/json',
+                    'Authorization': `Bearer ${currentUser.token}`
+                };
+
+                const unplaced = await placeLinesInServerCart(headers);
+                if (unplaced.length > 0) {
+                    showToast(`These items can no longer be ordered: ${unplaced.join(', ')}. Please remove them from your cart.`, 'error');
+                    return;
+                }
+
+                headers['Idempotency-Key'] = checkoutIdempotencyKey(totalAmount);
+
+                const response = await fetch(`${API_BASE_URL}/payment`, {
                     method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json'
-                    },
+                    headers,
                     body: JSON.stringify({
                         user_id: userId,
                         amount: totalAmount,
                         order_info: orderInfo,
-                        status: 'completed'
+                        status: 'completed',
+                        cart_id: localStorage.getItem('cartId'),
+                        line_ids: cart.map(item => item.serverLineId)
                     })
                 });
 
@@ -516,7 +623,8 @@ window.handlePlaceOrder = function () {
                     const result = await response.json();
 
                     const order = {
-                        id: `order-${Date.now()}`,
+                        // Server order number, which the tracking page looks up
+                        id: result.order_id ? `ORDER-${result.order_id}` : `order-${Date.now()}`,
                         db_id: result.payment_id,
                         date: new Date().toISOString(),
                         items: cart,
@@ -531,7 +639,9 @@ window.handlePlaceOrder = function () {
 
                     // Clear cart and checkout data
                     localStorage.removeItem('cart');
+                    localStorage.removeItem('cartId');
                     localStorage.removeItem('checkoutData');
+                    localStorage.removeItem('checkoutIdempotencyKey');
 
                     showToast(`Order placed successfully! Payment ID: ${result.payment_id}`, 'success');
 
@@ -541,6 +651,16 @@ window.handlePlaceOrder = function () {
                 } else {
                     const err = await response.json().catch(() => ({}));
                     showToast(`Payment failed: ${err.detail || 'Unknown error'}`, 'error');
+                    if (response.status === 401) {
+                        setTimeout(() => {
+                            window.location.href = 'membership-login.html';
+                        }, 1500);
+                    } else if (response.status === 409) {
+                        // Server cart differs from this page; the cart page reloads it
+                        setTimeout(() => {
+                            window.location.href = 'cart.html';
+                        }, 1500);
+                    }
                 }
             } catch (error) {
                 console.error('Error placing order:', error);
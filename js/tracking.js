@@ -16,15 +16,55 @@ const DEFAULT_TRACKING_STEPS = [
     { code: 'delivered', title: 'Delivered successfully', note: 'Order has been delivered. Enjoy!' }
 ];
 
+// Shipping status recorded by the bakery -> timeline step it has reached
+const STATUS_STEP_CODES = { Pending: 'prep', Shipped: 'on_delivery', Delivered: 'delivered' };
+
 function formatTime(d) {
     const hh = d.getHours().toString().padStart(2, '0');
     const mm = d.getMinutes().toString().padStart(2, '0');
     return `${hh}:${mm}`;
 }
 
+/**
+ * Timeline built from the order's recorded status events
+ * @param {Array<{status: string, note: string|null, at: string}>} events - Oldest first
+ * @returns {{steps: Array, activeIndex: number}}
+ */
+function buildLiveTimeline(events) {
+    const steps = DEFAULT_TRACKING_STEPS.map(step => ({ ...step, time: '' }));
+    let activeIndex = 0;
+    let cancelled = null;
+    events.forEach(event => {
+        if (event.status === 'Cancelled') {
+            cancelled = event;
+            return;
+        }
+        const index = steps.findIndex(step => step.code === STATUS_STEP_CODES[event.status]);
+        if (index < 0) return;
+        cancelled = null;
+        activeIndex = index;
+        steps[index].time = formatTime(new Date(event.at));
+        if (event.note) steps[index].note = event.note;
+    });
+    if (cancelled) {
+        steps.splice(activeIndex + 1, steps.length, {
+            code: 'cancelled',
+            title: 'Order cancelled',
+            time: formatTime(new Date(cancelled.at)),
+            note: cancelled.note || 'This order has been cancelled.'
+        });
+        activeIndex += 1;
+    }
+    return { steps, activeIndex };
+}
+
 function enrichShipments(rawShipments = []) {
     const now = new Date();
     return rawShipments.map((s, idx) => {
+        if (s.live) {
+            // Recorded by the server: real step times, no demo driver
+            return { ...s, orderId: s.orderId || currentOrderId, shipper: null };
+        }
         // Always assign a demo driver based on index
         const shipper = SHIPPERS[idx % SHIPPERS.length];
         // Build a fake timeline around "now" for demo
@@ -244,7 +284,7 @@ function updateShipper(shipment) {
     const card = document.getElementById('shipper-card');
     const step = shipment.steps[shipment.activeIndex];
     if (!step || !card) return;
-    if (step.code === 'on_delivery' || step.code === 'delivered') {
+    if (shipment.shipper && (step.code === 'on_delivery' || step.code === 'delivered')) {
         card.style.display = 'grid';
         const nameEl = document.getElementById('shipper-name');
         const phoneEl = document.getElementById('shipper-phone');
@@ -290,13 +330,45 @@ function updateView() {
 
 function tickProgress() {
     shipments.forEach(s => {
-        if (s.activeIndex < s.steps.length - 1) {
+        if (!s.live && s.activeIndex < s.steps.length - 1) {
             s.activeIndex += 1;
         }
     });
     updateView();
 }
 
+/**
+ * Look the order up on the server
+ * @param {string} orderId - Order ID as entered (e.g., "ORDER-12")
+ * @param {string} phone - Phone number the order was placed with
+ * @returns {Promise<Object|null>} Tracking info, or null if unknown / unreachable
+ */
+async function fetchServerTracking(orderId, phone) {
+    try {
+        const params = new URLSearchParams({ order_id: orderId, phone });
+        const response = await fetch(`${API_BASE_URL}/api/tracking?${params}`);
+        return response.ok ? await response.json() : null;
+    } catch (e) {
+        console.error('Error fetching tracking:', e);
+        return null;
+    }
+}
+
+/**
+ * Shipments for a server-tracked order; recipients come from the local order when known
+ * @param {Object} tracking - Response of /api/tracking
+ * @param {Object|null} order - Matching order from localStorage
+ * @returns {Array} Array of tracking shipments
+ */
+function convertServerTracking(tracking, order) {
+    const orderId = `ORDER-${tracking.order_id}`;
+    const { steps, activeIndex } = buildLiveTimeline(tracking.events);
+    const recipients = order ? convertOrderToTrackingShipments(order) : [];
+    currentOrderId = orderId;
+    const base = recipients.length ? recipients : [{ id: '#SHIP-1', recipient: 'Your order' }];
+    return base.map(s => ({ ...s, orderId, steps, activeIndex, live: true }));
+}
+
 /**
  * Show tracking form and hide tracking content
  */
@@ -320,7 +392,7 @@ function showTrackingContent() {
 /**
  * Handle form submission
  */
-function handleTrackingFormSubmit(e) {
+async function handleTrackingFormSubmit(e) {
     e.preventDefault();
 
     const orderIdInput = document.getElementById('order-id-input');
@@ -344,10 +416,11 @@ function handleTrackingFormSubmit(e) {
     // Disable submit button
     if (submitBtn) submitBtn.disabled = true;
 
-    // Find order
+    // Recorded status from the server first; orders only known to this browser fall back to the demo timeline
     const order = findOrderByIdAndPhone(orderId, phone);
+    const tracking = await fetchServerTracking(orderId, phone);
 
-    if (!order) {
+    if (!order && !tracking) {
         if (errorMessage) {
             errorMessage.textContent = 'Order not found. Please check your Order ID and Phone number.';
             errorMessage.classList.add('show');
@@ -357,7 +430,9 @@ function handleTrackingFormSubmit(e) {
     }
 
     // Convert order to tracking shipments
-    const trackingShipments = convertOrderToTrackingShipments(order);
+    const trackingShipments = tracking
+        ? convertServerTracking(tracking, order)
+        : convertOrderToTrackingShipments(order);
 
     if (trackingShipments.length === 0) {
         if (errorMessage) {
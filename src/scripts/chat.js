@@ -167,7 +167,7 @@ document.addEventListener('DOMContentLoaded', () => {
 
         try {
             // 3. Send to Backend
-            const response = await fetch('http://localhost:8000/chat', {
+            const response = await fetch(`${API_BASE_URL}/chat`, {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'